@@ -0,0 +1 @@
+"""Benchmarks, e.g. python -m bench.storage_profiles."""
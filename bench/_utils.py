@@ -0,0 +1,92 @@
+__author__ = "Quentin Roy"
+
+import json
+import os
+import time
+from lightmill.app import create_app, import_experiment
+from lightmill.blueprints._utils import clear_model_id_cache
+from lightmill.model import db
+from lightmill import plans
+
+EXPERIMENT_ID = "BENCH"
+
+
+def write_experiment(path, runs, blocks, trials):
+    """Write a touchstone experiment with runs * blocks * trials trials."""
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<experiment author="bench" id="{}" name="Benchmark">'.format(EXPERIMENT_ID),
+        '<factor id="tech" type="String"><value id="A"/><value id="B"/></factor>',
+        '<factor id="size" type="Integer"><value id="1"/><value id="2"/></factor>',
+        '<measure id="time" type="float" log="ok" cine="ok"/>',
+        '<measure id="x" type="integer" cine="ok"/>',
+        '<measure id="y" type="integer" cine="ok"/>',
+    ]
+    for run_num in range(runs):
+        lines.append('<run id="S{}">'.format(run_num))
+        for block_num in range(blocks):
+            lines.append('<block values="tech={}">'.format("AB"[block_num % 2]))
+            for trial_num in range(trials):
+                lines.append('<trial values="size={}"/>'.format(trial_num % 2 + 1))
+            lines.append("</block>")
+        lines.append("</run>")
+    lines.append("</experiment>")
+    with open(path, "w") as experiment_file:
+        experiment_file.write("\n".join(lines))
+
+
+def create_bench_app(directory, runs, blocks, trials, **options):
+    """Create an application using a new database in directory, with a
+    generated experiment imported."""
+    experiment_path = os.path.join(directory, "experiment.xml")
+    write_experiment(experiment_path, runs, blocks, trials)
+    app = create_app(os.path.join(directory, "lightmill.db"), **options)
+    import_experiment(app, experiment_path)
+    return app
+
+
+def close_bench_app(app):
+    db.session.remove()
+    db.get_engine(app).dispose()
+    clear_model_id_cache()
+    plans._run_plans.clear()
+
+
+def trial_results(event_count):
+    return {
+        "trial": {"time": 1.5},
+        "events": [{"time": i * 0.016, "x": i, "y": i * 2} for i in range(event_count)],
+    }
+
+
+def post_run_results(client, run_id, blocks, trials, event_count):
+    """Lock run_id and post the results of all its trials, in order. Return the
+    number of trials posted."""
+    token = json.loads(
+        client.get("/api/run/{}/{}/lock".format(EXPERIMENT_ID, run_id)).data
+    )["token"]
+    measures = trial_results(event_count)
+    for block_num in range(blocks):
+        for trial_num in range(trials):
+            response = client.post(
+                "/api/trial/{}/{}/{}/{}".format(
+                    EXPERIMENT_ID, run_id, block_num, trial_num
+                ),
+                data=json.dumps({"token": token, "measures": measures}),
+            )
+            assert response.status_code == 200, response.data
+    return blocks * trials
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+class Timer(object):
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.duration = time.perf_counter() - self.start
@@ -0,0 +1,106 @@
+"""Measure the bytes sent and the CPU used by the gzip compression of responses,
+at several compression levels.
+
+    python -m bench.compression [--levels 1 6 9] [--runs 4] [--events 20]
+"""
+
+__author__ = "Quentin Roy"
+
+import argparse
+import tempfile
+import time
+from lightmill.compression import gzip_compress, _compress_chunks
+from ._utils import EXPERIMENT_ID, create_bench_app, close_bench_app, post_run_results
+
+BLOCKS = 4
+TRIALS = 25
+
+# Responses to compress. Streamed responses are compressed chunk by chunk.
+URLS = [
+    "/experiment/{}.csv".format(EXPERIMENT_ID),
+    "/experiment/{}-events.csv".format(EXPERIMENT_ID),
+    "/api/run/{}/S0/plan".format(EXPERIMENT_ID),
+]
+
+
+def get_bodies(runs, event_count):
+    """Return {url: (chunks, streamed)} for the uncompressed responses of URLS."""
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_bench_app(directory, runs, BLOCKS, TRIALS)
+        try:
+            client = app.test_client()
+            for run_num in range(runs):
+                post_run_results(
+                    client, "S{}".format(run_num), BLOCKS, TRIALS, event_count
+                )
+            bodies = {}
+            for url in URLS:
+                response = client.get(url, buffered=False)
+                assert response.status_code == 200, url
+                bodies[url] = (list(response.iter_encoded()), response.is_streamed)
+                response.close()
+        finally:
+            close_bench_app(app)
+    return bodies
+
+
+def compress(chunks, streamed, level):
+    """Compress chunks the way a response is compressed, and return the size of
+    the result."""
+    if streamed:
+        return sum(len(chunk) for chunk in _compress_chunks(chunks, level))
+    return len(gzip_compress(b"".join(chunks), level))
+
+
+def measure(chunks, streamed, level, repeat):
+    """Return the compressed size and the CPU time (in ms) of the compression."""
+    durations = []
+    for _ in range(repeat):
+        start = time.process_time()
+        size = compress(chunks, streamed, level)
+        durations.append(time.process_time() - start)
+    return size, min(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--levels",
+        type=int,
+        nargs="+",
+        default=[1, 6, 9],
+        help="Compression levels (from 1 to 9).",
+    )
+    parser.add_argument("--runs", type=int, default=4, help="Number of runs.")
+    parser.add_argument(
+        "--events", type=int, default=20, help="Number of events per trial."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of compressions measured."
+    )
+    args = parser.parse_args()
+    bodies = get_bodies(args.runs, args.events)
+    print(
+        "{:<28} {:>6} {:>11} {:>11} {:>7} {:>9}".format(
+            "response", "level", "size (KB)", "sent (KB)", "ratio", "CPU (ms)"
+        )
+    )
+    for url in URLS:
+        chunks, streamed = bodies[url]
+        raw_size = sum(len(chunk) for chunk in chunks)
+        for level in args.levels:
+            size, cpu_time = measure(chunks, streamed, level, args.repeat)
+            print(
+                "{:<28} {:>6} {:>11.1f} {:>11.1f} {:>6.1f}x {:>9.2f}".format(
+                    url.replace(EXPERIMENT_ID, "<xp>"),
+                    level,
+                    raw_size / 1024,
+                    size / 1024,
+                    raw_size / size,
+                    cpu_time,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
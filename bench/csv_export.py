@@ -0,0 +1,193 @@
+"""Compare the offline CSV export with the exporter it replaced, which walked
+the trials and the events of each run through the ORM.
+
+    python -m bench.csv_export [--runs 4] [--trials 25] [--events 20]
+"""
+
+__author__ = "Quentin Roy"
+
+import argparse
+import filecmp
+import os
+import tempfile
+from contextlib import ExitStack
+from lightmill.csv_export import (
+    MANIFEST_FILE_NAME,
+    convert_bool,
+    create_event_fields,
+    create_logger,
+    create_trial_fields,
+    xp_csv_export,
+)
+from lightmill.model import Experiment
+from ._utils import (
+    EXPERIMENT_ID,
+    create_bench_app,
+    close_bench_app,
+    post_run_results,
+    Timer,
+)
+
+BLOCKS = 4
+
+
+class _MultiLogger(object):
+    def __init__(self, loggers):
+        self._loggers = loggers
+
+    def writerow(self, row):
+        for logger in self._loggers:
+            logger.writerow(row)
+
+
+def _get_trial_row(trial, fields, factor_values):
+    row = {
+        u"Experiment Name": trial.experiment.name or trial.experiment.id,
+        u"Run Id": trial.run.id,
+        u"Block Number": trial.block.number,
+        u"Trial Number": trial.number,
+        u"Practice": convert_bool(trial.block.practice),
+    }
+    for factor_value in factor_values:
+        factor_name = fields["factor"][factor_value.factor.id]["final_name"]
+        row[factor_name] = convert_bool(factor_value.name or factor_value.id)
+    for measure_value in trial.measure_values:
+        measure_name = fields["measure"][measure_value.measure.id]["final_name"]
+        row[measure_name] = convert_bool(measure_value.value)
+    return row
+
+
+def _get_event_row(event, fields, factor_values):
+    trial = event.trial
+    row = {
+        u"Experiment Name": trial.experiment.name or trial.experiment.id,
+        u"Run Id": trial.run.id,
+        u"Block Number": trial.block.number,
+        u"Trial Number": trial.number,
+        u"Practice": convert_bool(trial.block.practice),
+        u"Event Number": event.number,
+    }
+    for factor_value in factor_values:
+        factor_name = fields["factor"][factor_value.factor.id]["final_name"]
+        row[factor_name] = convert_bool(factor_value.name or factor_value.id)
+    for measure_value in event.measure_values.values():
+        measure_name = fields["measure"][measure_value.measure.id]["final_name"]
+        row[measure_name] = convert_bool(measure_value.value)
+    return row
+
+
+def orm_csv_export(experiment, target_dir):
+    """Export experiment the way the previous exporter did (without its progress
+    output): one query per trial for its factor values, and lazy loading of its
+    events and their measure values."""
+    trial_fields = create_trial_fields(experiment)
+    event_fields = create_event_fields(experiment)
+    runs_dir = os.path.join(target_dir, "runs")
+    events_dir = os.path.join(target_dir, "events")
+    os.makedirs(runs_dir)
+    os.makedirs(events_dir)
+    with ExitStack() as stack:
+
+        def open_logger(fields, path):
+            return create_logger(fields, stack.enter_context(open(path, "w")))
+
+        xp_logger = open_logger(
+            trial_fields, os.path.join(target_dir, experiment.id + ".csv")
+        )
+        xp_event_logger = open_logger(
+            event_fields, os.path.join(target_dir, experiment.id + "-events.csv")
+        )
+        for run in experiment.runs:
+            if not run.started():
+                continue
+            trial_logger = _MultiLogger(
+                [
+                    xp_logger,
+                    open_logger(trial_fields, os.path.join(runs_dir, run.id + ".csv")),
+                ]
+            )
+            for trial in run.trials:
+                factor_values = list(trial.iter_all_factor_values())
+                trial_logger.writerow(
+                    _get_trial_row(trial, trial_fields, factor_values)
+                )
+                events_path = os.path.join(
+                    events_dir,
+                    "{}-{}-{}.csv".format(run.id, trial.block.number, trial.number),
+                )
+                with open(events_path, "w") as events_file:
+                    events_logger = create_logger(event_fields, events_file)
+                    for event in trial.events:
+                        row = _get_event_row(event, event_fields, factor_values)
+                        events_logger.writerow(row)
+                        xp_event_logger.writerow(row)
+
+
+def _same_files(directory, other_directory):
+    comparison = filecmp.dircmp(directory, other_directory, [MANIFEST_FILE_NAME])
+    pending = [comparison]
+    while pending:
+        comparison = pending.pop()
+        if comparison.left_only or comparison.right_only:
+            return False
+        _, mismatch, errors = filecmp.cmpfiles(
+            comparison.left, comparison.right, comparison.common_files, shallow=False
+        )
+        if mismatch or errors:
+            return False
+        pending.extend(comparison.subdirs.values())
+    return True
+
+
+METHODS = [("orm", orm_csv_export), ("queries", xp_csv_export)]
+
+
+def bench_export(runs, trials_per_block, event_count):
+    """Return the duration of the export with each method, and whether they
+    wrote the same files."""
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_bench_app(directory, runs, BLOCKS, trials_per_block)
+        try:
+            client = app.test_client()
+            for run_num in range(runs):
+                post_run_results(
+                    client, "S{}".format(run_num), BLOCKS, trials_per_block, event_count
+                )
+            durations = {}
+            for name, export in METHODS:
+                target_dir = os.path.join(directory, name)
+                os.makedirs(target_dir)
+                with Timer() as timer:
+                    export(Experiment.query.get_by_id(EXPERIMENT_ID), target_dir)
+                durations[name] = timer.duration
+            same = _same_files(*(os.path.join(directory, name) for name, _ in METHODS))
+        finally:
+            close_bench_app(app)
+    return durations, same
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=4, help="Number of runs.")
+    parser.add_argument(
+        "--trials", type=int, default=25, help="Number of trials per block."
+    )
+    parser.add_argument(
+        "--events", type=int, default=20, help="Number of events per trial."
+    )
+    args = parser.parse_args()
+    durations, same = bench_export(args.runs, args.trials, args.events)
+    print(
+        "{} trials, {} events: orm {:.2f} s, queries {:.2f} s ({:.1f}x), {}".format(
+            args.runs * BLOCKS * args.trials,
+            args.runs * BLOCKS * args.trials * args.events,
+            durations["orm"],
+            durations["queries"],
+            durations["orm"] / durations["queries"],
+            "same files" if same else "DIFFERENT FILES",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
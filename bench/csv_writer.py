@@ -0,0 +1,171 @@
+"""Measure the CSV download of an experiment with 100000 trials, and compare
+the chunked CSV writer with formatting and sending rows one at a time.
+
+    python -m bench.csv_writer [--runs 100] [--database <path>]
+
+Importing the generated experiment takes a while: with --database, the
+database is kept and reused by later runs.
+"""
+
+__author__ = "Quentin Roy"
+
+import argparse
+import csv
+import io
+import os
+import random
+import shutil
+import tempfile
+from datetime import datetime
+from lightmill.app import create_app
+from lightmill.blueprints._csv import csv_chunks
+from lightmill.model import db, Block, Measure, Run, Trial, TrialMeasureValue
+from ._utils import EXPERIMENT_ID, create_bench_app, close_bench_app, Timer
+
+BLOCKS = 10
+TRIALS = 100
+
+
+def _format_csv_cell(cell_content):
+    """Format a cell the way the CSV routes used to."""
+    enclose = False
+    if '"' in cell_content:
+        enclose = True
+        cell_content = cell_content.replace('"', '""')
+    if "\n" in cell_content or "," in cell_content:
+        enclose = True
+    if enclose:
+        return '"' + cell_content + '"'
+    return cell_content
+
+
+def row_lines(rows):
+    """Format rows the way the CSV routes used to: one line per row."""
+    for row in rows:
+        yield ",".join(_format_csv_cell(cell) for cell in row) + "\n"
+
+
+def create_database(path, runs):
+    """Create an experiment of runs * BLOCKS * TRIALS completed trials in a new
+    database at path."""
+    with tempfile.TemporaryDirectory() as directory:
+        close_bench_app(create_bench_app(directory, runs, BLOCKS, TRIALS))
+        shutil.move(os.path.join(directory, "lightmill.db"), path)
+    app = create_app(path)
+    try:
+        measures = dict(
+            db.session.query(Measure.id, Measure._db_id).filter(
+                Measure.trial_level.is_(True)
+            )
+        )
+        trial_db_ids = [
+            db_id
+            for db_id, in db.session.query(Trial._db_id)
+            .join(Block, Run)
+            .filter(Run.experiment.has(id=EXPERIMENT_ID))
+        ]
+        rows = []
+        for trial_db_id in trial_db_ids:
+            rows.append(
+                {
+                    "_measure_db_id": measures["time"],
+                    "_trial_db_id": trial_db_id,
+                    "value": str(random.random() * 1000),
+                }
+            )
+        db.session.execute(TrialMeasureValue.__table__.insert(), rows)
+        db.session.execute(
+            Trial.__table__.update().values(completion_date=datetime.now())
+        )
+        db.session.execute(
+            Run.__table__.update().values(next_trial_position=Run.trial_total)
+        )
+        db.session.commit()
+        return len(trial_db_ids)
+    finally:
+        close_bench_app(app)
+
+
+def bench_download(path, accept_encoding=None):
+    """Return the duration of the CSV download of the experiment, its body and
+    its number of chunks."""
+    app = create_app(path)
+    try:
+        headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+        with Timer() as timer:
+            response = app.test_client().get(
+                "/experiment/{}.csv".format(EXPERIMENT_ID),
+                headers=headers,
+                buffered=False,
+            )
+            chunks = list(response.iter_encoded())
+            response.close()
+    finally:
+        close_bench_app(app)
+    return timer.duration, b"".join(chunks), len(chunks)
+
+
+def bench_formatting(rows, repeat):
+    """Return the duration and the number of writes of each way of formatting
+    rows."""
+    results = {}
+    for name, write in (("rows", row_lines), ("chunks", csv_chunks)):
+        durations = []
+        for _ in range(repeat):
+            with Timer() as timer:
+                writes = list(write(rows))
+            durations.append(timer.duration)
+        results[name] = (min(durations), len(writes), "".join(writes))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=100,
+        help="Number of runs of {} trials.".format(BLOCKS * TRIALS),
+    )
+    parser.add_argument(
+        "--database", help="Database to create, or to reuse if it exists."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of runs of each measure."
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.database or os.path.join(directory, "bench.db")
+        if not os.path.exists(path):
+            with Timer() as timer:
+                trial_count = create_database(os.path.abspath(path), args.runs)
+            print("{} trials created in {:.1f} s.".format(trial_count, timer.duration))
+
+        for accept_encoding in (None, "gzip"):
+            durations = []
+            for _ in range(args.repeat):
+                duration, body, chunk_count = bench_download(path, accept_encoding)
+                durations.append(duration)
+            print(
+                "Download{}: {:.2f} s ({:.1f} MB, {} chunks)".format(
+                    " with " + accept_encoding if accept_encoding else "",
+                    min(durations),
+                    len(body) / 1024 / 1024,
+                    chunk_count,
+                )
+            )
+            if accept_encoding is None:
+                rows = list(csv.reader(io.StringIO(body.decode())))
+
+    results = bench_formatting(rows, args.repeat)
+    assert results["rows"][2] == results["chunks"][2]
+    for name, (duration, write_count, _) in results.items():
+        print(
+            "Formatting {} by {}: {:.2f} s, {} writes".format(
+                len(rows), name, duration, write_count
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Compare the ways of recording the results of a trial: ORM objects flushed by
+the unit of work (how trials used to be recorded), and the set-based inserts of
+lightmill.ingest.
+
+    python -m bench.ingest [--events 100 1000 10000] [--trials 5]
+"""
+
+__author__ = "Quentin Roy"
+
+import argparse
+import tempfile
+from lightmill.ingest import record_trial_results
+from lightmill.model import db, Event, EventMeasureValue, Measure, Run
+from lightmill.model import TrialMeasureValue
+from ._utils import EXPERIMENT_ID, create_bench_app, close_bench_app, Timer
+
+
+def record_with_orm(trial, trial_values, events_values):
+    """Record the results of trial with one ORM object per event and value."""
+    for measure, value in trial_values:
+        trial.measure_values.append(TrialMeasureValue(value, measure))
+    for number, event_values in enumerate(events_values):
+        Event(
+            [EventMeasureValue(value, measure) for measure, value in event_values],
+            number,
+            trial,
+        )
+
+
+def record_with_inserts(trial, trial_values, events_values):
+    """Record the results of trial with lightmill.ingest."""
+    record_trial_results(
+        trial,
+        [(measure._db_id, value) for measure, value in trial_values],
+        (
+            [(measure._db_id, value) for measure, value in event_values]
+            for event_values in events_values
+        ),
+    )
+
+
+METHODS = [("orm", record_with_orm), ("inserts", record_with_inserts)]
+
+
+def bench_events(event_count, trial_count):
+    """Return the number of events recorded per second by each method."""
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_bench_app(directory, len(METHODS), 1, trial_count)
+        try:
+            time, x, y = (
+                Measure.query.get_by_id(measure_id, EXPERIMENT_ID)
+                for measure_id in ("time", "x", "y")
+            )
+            trial_values = [(time, "1.5")]
+            events_values = [
+                [(time, str(i * 0.016)), (x, str(i)), (y, str(i * 2))]
+                for i in range(event_count)
+            ]
+            throughputs = {}
+            for run_num, (name, record) in enumerate(METHODS):
+                run = Run.query.get_by_id("S{}".format(run_num), EXPERIMENT_ID)
+                trials = [run.get_trial_at(position) for position in range(trial_count)]
+                with Timer() as timer:
+                    for trial in trials:
+                        record(trial, trial_values, events_values)
+                        db.session.commit()
+                throughputs[name] = event_count * trial_count / timer.duration
+        finally:
+            close_bench_app(app)
+    return throughputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--events",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000],
+        help="Numbers of events per trial.",
+    )
+    parser.add_argument(
+        "--trials", type=int, default=5, help="Number of trials recorded per method."
+    )
+    args = parser.parse_args()
+    print(
+        "{:>8} {:>14} {:>14} {:>8}".format(
+            "events", "orm (ev/s)", "inserts (ev/s)", "speedup"
+        )
+    )
+    for event_count in args.events:
+        throughputs = bench_events(event_count, args.trials)
+        print(
+            "{:>8} {:>14.0f} {:>14.0f} {:>7.1f}x".format(
+                event_count,
+                throughputs["orm"],
+                throughputs["inserts"],
+                throughputs["inserts"] / throughputs["orm"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
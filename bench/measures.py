@@ -0,0 +1,144 @@
+"""Compare the ways of flattening nested measure payloads: building the path of
+every leaf and looking it up (how payloads used to be flattened), and walking
+the measure plan of the experiment.
+
+    python -m bench.measures [--events 10000] [--depth 1 3 5] [--repeat 5]
+"""
+
+__author__ = "Quentin Roy"
+
+import argparse
+from lightmill.blueprints.api.trial import _MeasurePlan, _flatten_measures
+from ._utils import Timer
+
+
+class BenchMeasure(object):
+    """Stand-in for the Measure model, with the attributes used by plans."""
+
+    def __init__(self, db_id, measure_id):
+        self._db_id = db_id
+        self.id = measure_id
+        self.trial_level = False
+        self.event_level = True
+
+
+def _convert_measures(measures):
+    for measure_path, value in _get_measures_paths(measures):
+        if value is not None:
+            yield ".".join(measure_path), value
+
+
+def _get_measures_paths(measures):
+    if isinstance(measures, dict):
+        for path_head, path_tail in measures.items():
+            for path_tail, value in _get_measures_paths(path_tail):
+                yield [path_head] + path_tail, value
+    elif isinstance(measures, list):
+        path_head = 0
+        for path_tail in measures:
+            for path_tail, value in _get_measures_paths(path_tail):
+                yield [str(path_head)] + path_tail, value
+            path_head += 1
+    else:
+        yield [], measures
+
+
+def flatten_with_paths(measures, plan):
+    """Flatten measures as they used to be: join the path of every leaf and look
+    its measure up."""
+    return [
+        (plan.entries[measure_id][0], value)
+        for measure_id, value in _convert_measures(measures)
+    ]
+
+
+def flatten_with_plan(measures, plan):
+    """Flatten measures by walking plan."""
+    return [
+        (entry[0], value)
+        for _, entry, value in _flatten_measures(measures, plan.root, None)
+    ]
+
+
+def create_payload(depth):
+    """Return the measures of an event nested depth levels deep, and the
+    measures they match."""
+    measures = []
+    payload = {}
+    for branch in ("pointer", "target", "cursor"):
+        node = payload[branch] = {}
+        path = [branch]
+        for level in range(1, depth):
+            key = "level{}".format(level)
+            path.append(key)
+            node[key] = {}
+            node = node[key]
+        for leaf in ("x", "y", "time"):
+            node[leaf] = 1.5
+            measures.append(".".join(path + [leaf]))
+    node["points"] = [1, 2, 3, 4]
+    measures.extend(
+        ".".join(path + ["points", str(i)]) for i in range(len(node["points"]))
+    )
+    return payload, [
+        BenchMeasure(db_id, measure_id) for db_id, measure_id in enumerate(measures)
+    ]
+
+
+METHODS = [("paths", flatten_with_paths), ("plan", flatten_with_plan)]
+
+
+def bench_depth(depth, event_count, repeat):
+    """Return the number of events flattened per second by each method."""
+    payload, measures = create_payload(depth)
+    plan = _MeasurePlan(dict((measure.id, measure) for measure in measures))
+    events = [payload] * event_count
+    assert flatten_with_paths(payload, plan) == flatten_with_plan(payload, plan)
+    throughputs = {}
+    for name, flatten in METHODS:
+        durations = []
+        for _ in range(repeat):
+            with Timer() as timer:
+                for event in events:
+                    flatten(event, plan)
+            durations.append(timer.duration)
+        throughputs[name] = event_count / min(durations)
+    return throughputs, len(measures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--events", type=int, default=10000, help="Number of events flattened."
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        nargs="+",
+        default=[1, 3, 5],
+        help="Nesting depths of the measures.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of runs of each method."
+    )
+    args = parser.parse_args()
+    print(
+        "{:>6} {:>9} {:>14} {:>14} {:>8}".format(
+            "depth", "measures", "paths (ev/s)", "plan (ev/s)", "speedup"
+        )
+    )
+    for depth in args.depth:
+        throughputs, measure_count = bench_depth(depth, args.events, args.repeat)
+        print(
+            "{:>6} {:>9} {:>14.0f} {:>14.0f} {:>7.1f}x".format(
+                depth,
+                measure_count,
+                throughputs["paths"],
+                throughputs["plan"],
+                throughputs["plan"] / throughputs["paths"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
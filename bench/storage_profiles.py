@@ -0,0 +1,94 @@
+"""Compare the storage profiles: trial recording throughput, and latency of the
+experiment's web page while trials are being recorded.
+
+    python -m bench.storage_profiles [--events 100] [--trials 25]
+"""
+
+__author__ = "Quentin Roy"
+
+import argparse
+import tempfile
+import threading
+from lightmill.storage import STORAGE_PROFILES
+from ._utils import (
+    EXPERIMENT_ID,
+    create_bench_app,
+    close_bench_app,
+    post_run_results,
+    percentile,
+    Timer,
+)
+
+BLOCKS = 4
+
+
+def bench_profile(profile, trials_per_block, event_count, page_requests):
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_bench_app(
+            directory, 4, BLOCKS, trials_per_block, storage_profile=profile
+        )
+        try:
+            client = app.test_client()
+
+            # Recording throughput, without readers.
+            with Timer() as timer:
+                count = post_run_results(
+                    client, "S0", BLOCKS, trials_per_block, event_count
+                )
+            throughput = count / timer.duration
+
+            # Page latency while another thread records the results of a run.
+            writer = threading.Thread(
+                target=post_run_results,
+                args=(app.test_client(), "S1", BLOCKS, trials_per_block, event_count),
+            )
+            latencies = []
+            writer.start()
+            while writer.is_alive() or len(latencies) < page_requests:
+                with Timer() as timer:
+                    response = client.get("/experiment/{}".format(EXPERIMENT_ID))
+                assert response.status_code == 200
+                latencies.append(timer.duration * 1000)
+            writer.join()
+        finally:
+            close_bench_app(app)
+    return throughput, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--events", type=int, default=100, help="Number of events per trial."
+    )
+    parser.add_argument(
+        "--trials", type=int, default=25, help="Number of trials per block."
+    )
+    parser.add_argument(
+        "--page-requests",
+        type=int,
+        default=20,
+        help="Minimum number of requests to the experiment page.",
+    )
+    args = parser.parse_args()
+    print(
+        "{:<6} {:>12} {:>14} {:>14} {:>14}".format(
+            "", "trials/s", "page p50 (ms)", "page p95 (ms)", "page max (ms)"
+        )
+    )
+    for profile in sorted(STORAGE_PROFILES):
+        throughput, latencies = bench_profile(
+            profile, args.trials, args.events, args.page_requests
+        )
+        print(
+            "{:<6} {:>12.1f} {:>14.1f} {:>14.1f} {:>14.1f}".format(
+                profile,
+                throughput,
+                percentile(latencies, 0.5),
+                percentile(latencies, 0.95),
+                max(latencies),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import lightmill.default_settings as default_settings
 from lightmill.csv_export import csv_export
+from lightmill import parquet_export
 import argparse
 import os
 
@@ -7,7 +8,7 @@ if __name__ == "__main__":
 
     DEFAULT_OUTPUT_DIR = os.environ["LIGHTMILL_EXPORT_DIR"] or "./export"
 
-    parser = argparse.ArgumentParser(description="Lightmill CSV export.")
+    parser = argparse.ArgumentParser(description="Lightmill export.")
     parser.add_argument(
         "-o",
         "--output-dir",
@@ -18,10 +19,51 @@ if __name__ == "__main__":
     parser.add_argument(
         "-d",
         "--database",
-        default=default_settings.DATABASE_URI,
+        default=default_settings.DATABASE_URL,
         type=str,
-        help="Database file path (default: {}).".format(default_settings.DATABASE_URI),
+        help="Database URL or SQLite file path"
+        " (default: {}).".format(default_settings.DATABASE_URL),
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        default="csv",
+        choices=["csv", "parquet"],
+        help="Export format (default: csv). Parquet exports write one typed file"
+        " for the trials and one for the events of each experiment. They require"
+        " pyarrow and are always complete.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        type=int,
+        help="Number of processes exporting runs in parallel (default: 1).",
+    )
+    parser.add_argument(
+        "--completed-only",
+        default=False,
+        action="store_true",
+        help="Only export completed trials (CSV only). Later exports then only"
+        " append the trials completed since the last one.",
+    )
+    parser.add_argument(
+        "--full",
+        default=False,
+        action="store_true",
+        help="With --completed-only, re-export every completed trial instead of"
+        " only appending the trials completed since the last export.",
     )
     args = parser.parse_args()
 
-    csv_export(args.output_dir, args.database)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+
+    if args.format == "parquet":
+        if not parquet_export.is_available():
+            parser.error("Parquet exports require pyarrow (pip install pyarrow).")
+        parquet_export.parquet_export(args.output_dir, args.database)
+    else:
+        csv_export(
+            args.output_dir, args.database, args.jobs, args.full, args.completed_only
+        )
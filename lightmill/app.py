@@ -2,6 +2,7 @@ __author__ = "Quentin Roy"
 
 import os
 from flask import Flask
+from sqlalchemy.engine.url import make_url
 from .blueprints.web import web_blueprint
 from .blueprints.api import (
     experiment_blueprint,
@@ -10,8 +11,17 @@ from .blueprints.api import (
     trial_blueprint,
 )
 from .blueprints.api import root_blueprint as api_root_blueprint
+from .blueprints._utils import clear_model_id_cache
 from .model import db, Experiment
+from .model.upgrade import upgrade_database
 from .touchstone import create_experiment, parse_experiment_id
+from .journal import TrialJournal
+from .storage import apply_storage_profile, apply_write_lock
+from .compression import compress_responses
+from .default_settings import STORAGE_PROFILE, COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL
+
+# Engine options that only apply to QueuePools.
+SQLITE_IGNORED_ENGINE_OPTIONS = ("pool_size", "max_overflow")
 
 
 def create_app(
@@ -21,16 +31,34 @@ def create_app(
     do_not_protect_runs=False,
     add_missing_measures=True,
     volatile=False,
+    journal_path=None,
+    storage_profile=STORAGE_PROFILE,
+    multiprocess=False,
+    pool_size=None,
+    pool_max_overflow=None,
+    pool_recycle=None,
+    pool_pre_ping=False,
+    cache_dir=None,
+    compression_min_size=COMPRESSION_MIN_SIZE,
+    compression_level=COMPRESSION_LEVEL,
 ):
     # app creation
     app = Flask(__name__.split(".")[0])
-    app.config["SQLALCHEMY_DATABASE_URI"] = (
-        "sqlite://" if volatile else "sqlite:///" + os.path.abspath(database_uri)
+    database_url = "sqlite://" if volatile else get_database_url(database_uri)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = get_engine_options(
+        database_url,
+        pool_size=pool_size,
+        max_overflow=pool_max_overflow,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["SQLALCHEMY_ECHO"] = sql_echo
     app.config["UNPROTECTED_RUNS"] = do_not_protect_runs
     app.config["ADD_MISSING_MEASURES"] = add_missing_measures
+    app.config["CACHE_DIR"] = cache_dir and os.path.abspath(cache_dir)
+    app.config["MULTIPROCESS"] = multiprocess
     # FIXME: This depends on the current package and how it is run. Breaks easily.
     app.jinja_env.add_extension("lightmill.jinja2htmlcompress.SelectiveHTMLCompress")
 
@@ -40,17 +68,66 @@ def create_app(
     app.register_blueprint(run_blueprint, url_prefix="/api/run")
     app.register_blueprint(block_blueprint, url_prefix="/api/block")
     app.register_blueprint(trial_blueprint, url_prefix="/api/trial")
+    if compression_min_size > 0:
+        compress_responses(app, compression_min_size, compression_level)
 
     # database initialization
     db.init_app(app)
     db.app = app
+    engine = db.get_engine(app)
+    if multiprocess and (volatile or journal_path):
+        raise ValueError(
+            "Volatile databases and journals cannot be shared between processes."
+        )
+    # Other databases handle their settings and concurrent writers themselves.
+    if engine.dialect.name == "sqlite":
+        apply_storage_profile(engine, storage_profile)
+        if multiprocess:
+            apply_write_lock(engine, os.path.abspath(engine.url.database) + ".lock")
     db.create_all()
+    upgrade_database()
+    # Cached database ids may belong to a database used before.
+    clear_model_id_cache()
+
+    if journal_path:
+        if volatile:
+            raise ValueError("A journal cannot be used with a volatile database.")
+        journal = TrialJournal(journal_path, app)
+        app.extensions["trial_journal"] = journal
+        journal.start()
 
     app.debug = debug
 
     return app
 
 
+def get_database_url(database):
+    """Return database if it is a database URL, or the URL of the SQLite database
+    at this path otherwise."""
+    if "://" in database:
+        return database
+    return "sqlite:///" + os.path.abspath(database)
+
+
+def get_engine_options(database_url, **options):
+    """Return the engine options that are set (i.e. not None or False).
+
+    SQLite connections are not pooled in a QueuePool (SQLAlchemy uses a NullPool
+    for database files and a StaticPool for in-memory databases), so pool sizing
+    options are ignored for SQLite databases.
+    """
+    options = dict(
+        (name, value)
+        for name, value in options.items()
+        if value is not None and value is not False
+    )
+    if make_url(database_url).get_backend_name() == "sqlite":
+        for name in SQLITE_IGNORED_ENGINE_OPTIONS:
+            if options.pop(name, None) is not None:
+                print("{} is ignored for SQLite databases.".format(name))
+    return options
+
+
 def import_experiment(app, touchstone_file):
     expe_id = parse_experiment_id(touchstone_file)
     with app.test_request_context():
@@ -61,3 +138,4 @@ def import_experiment(app, touchstone_file):
             experiment = create_experiment(touchstone_file)
             db.session.add(experiment)
             db.session.commit()
+            clear_model_id_cache()
@@ -0,0 +1,41 @@
+import re
+
+# Approximate number of characters sent at once by csv_chunks.
+CHUNK_SIZE = 64 * 1024
+
+# Characters that require a cell to be quoted.
+_SPECIAL_CHARACTERS = re.compile('["\n\r]')
+
+
+def format_csv_cell(cell_content):
+    "Escaping CSV cells accordingly to RFC4180 (https://tools.ietf.org/html/rfc4180)"
+    if "," in cell_content or _SPECIAL_CHARACTERS.search(cell_content):
+        return '"' + cell_content.replace('"', '""') + '"'
+    return cell_content
+
+
+def format_csv_row(cells):
+    """Format a row of cells (strings) as a CSV line."""
+    line = ",".join(cells)
+    # Fast path: no cell needs to be quoted if the line only contains the
+    # separators, and no quote or line break.
+    if line.count(",") == len(cells) - 1 and not _SPECIAL_CHARACTERS.search(line):
+        return line + "\n"
+    return ",".join(map(format_csv_cell, cells)) + "\n"
+
+
+def csv_chunks(rows, chunk_size=CHUNK_SIZE):
+    """Yield rows (lists of strings) formatted as CSV, grouped in chunks of about
+    chunk_size characters."""
+    chunk = []
+    size = 0
+    for row in rows:
+        line = format_csv_row(row)
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield "".join(chunk)
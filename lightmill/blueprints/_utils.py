@@ -1,9 +1,15 @@
 import time
-from flask import jsonify
+from functools import lru_cache
+from flask import jsonify, request, g, current_app as app, Response
 from flask.helpers import make_response
 from .errors import UnknownElement
+from sqlalchemy import event
 from sqlalchemy.orm.exc import NoResultFound
-from ..model import Trial, Block, Run, Experiment
+from ..model import db, Trial, Block, Run, Experiment
+from ..compression import GZIP_ETAG_SUFFIX
+
+# Maximum number of database ids cached for each kind of element.
+MODEL_ID_CACHE_SIZE = 10000
 
 
 def register_invalid_error(blueprint, errorType):
@@ -34,9 +40,201 @@ def answer_options(blueprint):
         return resp
 
 
+# The natural keys of an element (i.e. its id or number and the ids or numbers of
+# its parents) never change once it is imported, so their database ids can be
+# cached. Keys that are not found are not cached.
+@lru_cache(maxsize=MODEL_ID_CACHE_SIZE)
+def _get_experiment_db_id(experiment_id):
+    return (
+        db.session.query(Experiment._db_id).filter(Experiment.id == experiment_id).one()
+    )[0]
+
+
+@lru_cache(maxsize=MODEL_ID_CACHE_SIZE)
+def _get_run_db_id(experiment_id, run_id):
+    return (
+        db.session.query(Run._db_id)
+        .join(Experiment)
+        .filter(Run.id == run_id, Experiment.id == experiment_id)
+        .one()
+    )[0]
+
+
+@lru_cache(maxsize=MODEL_ID_CACHE_SIZE)
+def _get_block_db_id(experiment_id, run_id, block_number):
+    return (
+        db.session.query(Block._db_id)
+        .join(Run, Experiment)
+        .filter(
+            Block.number == block_number,
+            Run.id == run_id,
+            Experiment.id == experiment_id,
+        )
+        .one()
+    )[0]
+
+
+@lru_cache(maxsize=MODEL_ID_CACHE_SIZE)
+def _get_trial_db_id(experiment_id, run_id, block_number, trial_number):
+    return (
+        db.session.query(Trial._db_id)
+        .join(Block, Run, Experiment)
+        .filter(
+            Trial.number == trial_number,
+            Block.number == block_number,
+            Run.id == run_id,
+            Experiment.id == experiment_id,
+        )
+        .one()
+    )[0]
+
+
+_model_id_caches = {
+    "experiment": _get_experiment_db_id,
+    "run": _get_run_db_id,
+    "block": _get_block_db_id,
+    "trial": _get_trial_db_id,
+}
+
+
+# Other caches keyed by database ids (e.g. dicts), cleared with the model id
+# caches since database ids may be reused once their element is deleted, or by
+# another database.
+_db_id_caches = []
+
+
+def register_db_id_cache(cache):
+    """Clear cache (an object with a clear method) with the model id caches."""
+    _db_id_caches.append(cache)
+    return cache
+
+
+def clear_model_id_cache():
+    for get_db_id in _model_id_caches.values():
+        get_db_id.cache_clear()
+    for cache in _db_id_caches:
+        cache.clear()
+
+
+def model_id_cache_info():
+    """Return the statistics of the database id caches."""
+    info = {}
+    for name, get_db_id in _model_id_caches.items():
+        cache_info = get_db_id.cache_info()
+        requests = cache_info.hits + cache_info.misses
+        info[name] = {
+            "hits": cache_info.hits,
+            "misses": cache_info.misses,
+            "hitRate": cache_info.hits / requests if requests else None,
+            "size": cache_info.currsize,
+            "maxSize": cache_info.maxsize,
+        }
+    return info
+
+
+@event.listens_for(db.session, "after_flush")
+def _clear_deleted_model_ids(session, flush_context):
+    if any(
+        isinstance(instance, (Experiment, Run, Block, Trial))
+        for instance in session.deleted
+    ):
+        clear_model_id_cache()
+
+
+def _load(model, get_db_id, *key):
+    instance = model.query.get(get_db_id(*key))
+    if instance is None:
+        # The element has been deleted (e.g. by another process) since its id
+        # has been cached.
+        clear_model_id_cache()
+        instance = model.query.get(get_db_id(*key))
+        if instance is None:
+            raise NoResultFound()
+    return instance
+
+
+def conditional(view):
+    """Mark a GET view whose answer only depends on the version of the element
+    targeted by its URL, so that it can be answered with 304 Not Modified.
+
+    Blueprints must call answer_conditional_requests for this to be effective.
+    """
+    view.conditional = True
+    return view
+
+
+def get_matching_etag(etag):
+    """Return the tag of the request's If-None-Match header that matches etag,
+    either as is or as the etag of its gzip compressed representation, or None
+    if there is none."""
+    for candidate in (etag, etag + GZIP_ETAG_SUFFIX):
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def make_not_modified_response(etag):
+    """Return a 304 Not Modified response if the request's If-None-Match header
+    matches etag, or None otherwise."""
+    matching_etag = get_matching_etag(etag)
+    if matching_etag is None:
+        return None
+    response = Response(status=304)
+    # There is no body.
+    del response.headers["Content-Type"]
+    response.set_etag(matching_etag)
+    return response
+
+
+def answer_conditional_requests(blueprint):
+    @blueprint.before_request
+    def answer_not_modified():
+        etag = g.get("etag")
+        if etag is not None:
+            return make_not_modified_response(etag)
+
+    @blueprint.after_request
+    def set_etag(response):
+        etag = g.get("etag")
+        if etag is not None and response.status_code == 200:
+            response.set_etag(etag)
+        return response
+
+
+# Version of an element's representation, by element kind. Blocks do not have
+# their own version: the version of their run is incremented when they change.
+_version_queries = {
+    "experiment": lambda db_id: db.session.query(Experiment.version).filter(
+        Experiment._db_id == db_id
+    ),
+    "run": lambda db_id: db.session.query(Run.version).filter(Run._db_id == db_id),
+    "block": lambda db_id: db.session.query(Run.version)
+    .join(Block)
+    .filter(Block._db_id == db_id),
+    "trial": lambda db_id: db.session.query(Trial.version).filter(
+        Trial._db_id == db_id
+    ),
+}
+
+
+_KEY_NAMES = ("experiment", "run", "block", "trial")
+
+
+def _get_etag(kind, *key):
+    db_id = _model_id_caches[kind](*key)
+    version = _version_queries[kind](db_id).scalar()
+    if version is not None:
+        return "{}-{}-{}".format(kind, db_id, version)
+
+
 def _inject_trial(values):
-    trial = Trial.query.get_by_number(
-        values["trial"], values["block"], values["run"], values["experiment"]
+    trial = _load(
+        Trial,
+        _get_trial_db_id,
+        values["experiment"],
+        values["run"],
+        values["block"],
+        values["trial"],
     )
     values["trial"] = trial
     values["experiment"] = trial.experiment
@@ -45,8 +243,8 @@ def _inject_trial(values):
 
 
 def _inject_block(values):
-    block = Block.query.get_by_number(
-        values["block"], values["run"], values["experiment"]
+    block = _load(
+        Block, _get_block_db_id, values["experiment"], values["run"], values["block"]
     )
     values["experiment"] = block.experiment
     values["block"] = block
@@ -54,13 +252,13 @@ def _inject_block(values):
 
 
 def _inject_run(values):
-    run = Run.query.get_by_id(values["run"], values["experiment"])
+    run = _load(Run, _get_run_db_id, values["experiment"], values["run"])
     values["run"] = run
     values["experiment"] = run.experiment
 
 
 def _inject_experiment(values):
-    values["experiment"] = Experiment.query.get_by_id(values["experiment"])
+    values["experiment"] = _load(Experiment, _get_experiment_db_id, values["experiment"])
 
 
 def inject_model(endpoint, values):
@@ -74,13 +272,21 @@ def inject_model(endpoint, values):
     try:
         if "experiment" in values:
             if "run" not in values:
-                _inject_experiment(values)
+                kind, inject = "experiment", _inject_experiment
             elif "block" not in values:
-                _inject_run(values)
+                kind, inject = "run", _inject_run
             elif "trial" not in values:
-                _inject_block(values)
+                kind, inject = "block", _inject_block
             else:
-                _inject_trial(values)
+                kind, inject = "trial", _inject_trial
+            view = app.view_functions.get(endpoint)
+            if request.method == "GET" and getattr(view, "conditional", False):
+                key = [values[name] for name in _KEY_NAMES if name in values]
+                g.etag = _get_etag(kind, *key)
+                if g.etag is not None and get_matching_etag(g.etag) is not None:
+                    # The view will not be called.
+                    return
+            inject(values)
     except NoResultFound:
         raise UnknownElement("Target not found.", payload={"request": values})
 
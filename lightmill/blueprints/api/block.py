@@ -4,7 +4,7 @@ from flask import jsonify
 from flask.blueprints import Blueprint
 from ...model import Trial
 from .._utils import convert_date, allow_origin, inject_model, answer_options
-from .._utils import register_invalid_error
+from .._utils import register_invalid_error, conditional, answer_conditional_requests
 from ..errors import UnknownElement
 
 blueprint = Blueprint('block', os.path.splitext(__name__)[0])
@@ -13,13 +13,15 @@ blueprint.url_value_preprocessor(inject_model)
 register_invalid_error(blueprint, UnknownElement)
 allow_origin(blueprint)
 answer_options(blueprint)
+answer_conditional_requests(blueprint)
 
 
 @blueprint.route('/<experiment>/<run>/<int:block>')
+@conditional
 def block_props(experiment, run, block):
     props = {
         'number': block.number,
-        'measuredBlockNumber': block.measured_block_number(),
+        'measuredBlockNumber': block.measured_number,
         'factorValues': dict((value.factor.id, value.id) for value in block.factor_values),
         'trialCount': block.trials.count(),
         'practice': block.practice
@@ -30,7 +32,6 @@ def block_props(experiment, run, block):
 def generate_block_trials_info(block,
                                completed_only=False,
                                exp_values=None,
-                               measured_block_num=None,
                                block_values=None,
                                measures=True,
                                short=False):
@@ -56,18 +57,15 @@ def generate_block_trials_info(block,
             'completionDate': convert_date(trial.completion_date)
         }
         if not short:
-            measured_block_num = (block.measured_block_number()
-                                  if measured_block_num is None and not block.practice
-                                  else measured_block_num)
             result.update({
                 'experimentId': experiment.id,
                 'runId': trial.run.id,
                 'blockNumber': block.number,
                 'practice': block.practice,
             })
-            if measured_block_num is not None:
+            if block.measured_number is not None:
                 result.update({
-                    'measuredBlockNumber': measured_block_num
+                    'measuredBlockNumber': block.measured_number
                 })
         if measures:
             result.update({
@@ -1,11 +1,13 @@
 import os
+import uuid
 from flask.blueprints import Blueprint
 from flask import jsonify
-from sqlalchemy import func
-from .run import run_info
+from .run import run_info, run_props
 from ..errors import UnknownElement
 from .._utils import allow_origin, answer_options, inject_model, register_invalid_error
-from ...model import Block, Trial, Run
+from .._utils import conditional, answer_conditional_requests
+from ...model import db
+from ...progress import notify
 
 blueprint = Blueprint('experiment', os.path.splitext(__name__)[0])
 
@@ -14,9 +16,11 @@ blueprint.url_value_preprocessor(inject_model)
 register_invalid_error(blueprint, UnknownElement)
 allow_origin(blueprint)
 answer_options(blueprint)
+answer_conditional_requests(blueprint)
 
 
 @blueprint.route('/<experiment>')
+@conditional
 def props(experiment):
     factors = {}
     for factor in experiment.factors:
@@ -50,11 +54,7 @@ def props(experiment):
 
 @blueprint.route('/<experiment>/available_run')
 def get_free_run(experiment):
-    available_run = (experiment.runs
-                     .outerjoin(Block, Trial)
-                     .filter(Run.token.is_(None))
-                     .having(func.count(Trial.completion_date) == 0)
-                     .group_by(Run)).first()
+    available_run = experiment.free_runs().first()
 
     if available_run:
         return run_info(available_run)
@@ -65,3 +65,24 @@ def get_free_run(experiment):
     })
     response.status_code = 410
     return response
+
+
+@blueprint.route('/<experiment>/allocate')
+def allocate_run(experiment):
+    """Lock the next available run and return its info with its token."""
+    token = str(uuid.uuid4())
+    run = experiment.allocate_run(token)
+    if run is None:
+        db.session.rollback()
+        response = jsonify({
+            'message': 'No available runs.',
+            'type': 'NoAvailableRuns'
+        })
+        response.status_code = 410
+        return response
+    notify(run, 'runLocked', locked=True)
+    db.session.commit()
+    print("Run {} locked.".format(repr(run)))
+    answer = run_props(run)
+    answer['token'] = token
+    return jsonify(answer)
@@ -1,10 +1,11 @@
 import os
 import io
 from flask.blueprints import Blueprint
-from flask import jsonify, request
+from flask import jsonify, request, current_app as app
 from .experiment import props as experiment_props
 from ..errors import UnknownElement
 from .._utils import allow_origin, answer_options, inject_model, register_invalid_error
+from .._utils import clear_model_id_cache, model_id_cache_info
 from ...touchstone import create_experiment, parse_experiment_id, TouchStoneParsingException
 from ...model import Experiment, db
 
@@ -53,8 +54,24 @@ def import_experiment():
             io.StringIO(request.data.decode('utf8')))
         db.session.add(experiment)
         db.session.commit()
+        clear_model_id_cache()
         print('Experiment imported.')
         return experiment_props(experiment)
     except TouchStoneParsingException as e:
         print('Experiment not imported: {}'.format(e.message))
         raise CannotImportExperiment(e.message or 'Cannot parse experiment')
+
+
+@blueprint.route('/journal')
+def journal_status():
+    journal = app.extensions.get('trial_journal')
+    if journal is None:
+        return jsonify({'enabled': False})
+    status = journal.status()
+    status['enabled'] = True
+    return jsonify(status)
+
+
+@blueprint.route('/cache')
+def cache_status():
+    return jsonify(model_id_cache_info())
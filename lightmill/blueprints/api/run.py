@@ -1,25 +1,68 @@
 import os
 import uuid
 import json
+from datetime import datetime
 from flask import jsonify, request, current_app as app, Response
 from flask.blueprints import Blueprint
-from .trial import trial_info
+from .trial import trial_info, trial_json, check_token, record_measures, wait_for_journal
+from .trial import WrongMeasureKey
 from .block import generate_block_trials_info
-from ...model import db
+from ...model import db, ExperimentProgressError, Trial, Block
+from ...plans import get_run_plan
+from ...progress import notify
 from .._utils import allow_origin, inject_model, answer_options, register_invalid_error
+from .._utils import convert_date, conditional, answer_conditional_requests
+from .._utils import make_not_modified_response
 from ..errors import UnknownElement
 
 
+# Maximum number of trials returned by run_upcoming_trials.
+MAX_UPCOMING_TRIALS = 100
+
 blueprint = Blueprint('run', os.path.splitext(__name__)[0])
+
+
+def reads_progress(view):
+    """Mark a view whose answer depends on the trials already completed, so that
+    journaled results are applied before it is answered."""
+    view.reads_progress = True
+    return view
+
+
+@blueprint.url_value_preprocessor
+def apply_journal(endpoint, values):
+    # This must happen before inject_model computes the version of the run.
+    if getattr(app.view_functions.get(endpoint), 'reads_progress', False):
+        wait_for_journal()
+
+
 blueprint.url_value_preprocessor(inject_model)
 register_invalid_error(blueprint, UnknownElement)
+register_invalid_error(blueprint, WrongMeasureKey)
 allow_origin(blueprint)
 answer_options(blueprint)
+answer_conditional_requests(blueprint)
+
+
+@blueprint.errorhandler(ExperimentProgressError)
+def handle_experiment_error(error):
+    response = jsonify({
+        'message': error.args[0],
+        'type': error.__class__.__name__
+    })
+    response.status_code = 405
+    return response
 
 
 @blueprint.route('/<experiment>/<run>')
+@reads_progress
+@conditional
 def run_info(run, experiment=None):
-    return jsonify({
+    return jsonify(run_props(run))
+
+
+def run_props(run):
+    return {
         'id': run.id,
         'experimentId': run.experiment.id,
         'completed': run.completed(),
@@ -27,10 +70,11 @@ def run_info(run, experiment=None):
         'trialCount': run.trial_count(),
         'blockCount': run.block_count(),
         'locked': run.locked
-    })
+    }
 
 
 @blueprint.route('/<experiment>/<run>/current_trial')
+@reads_progress
 def run_current_trial(run, experiment=None):
     trial = run.current_trial()
     if not trial:
@@ -44,6 +88,7 @@ def run_current_trial(run, experiment=None):
 
 
 @blueprint.route('/<experiment>/<run>/next_trial')
+@reads_progress
 def run_next_trial(experiment, run):
     current_trial = run.current_trial()
     if not current_trial:
@@ -64,19 +109,39 @@ def run_next_trial(experiment, run):
     return trial_info(next_trial)
 
 
+@blueprint.route('/<experiment>/<run>/upcoming')
+@reads_progress
+@conditional
+def run_upcoming_trials(experiment, run):
+    """Return the next n uncompleted trials of the run (1 by default)."""
+    count = request.args.get('n', 1, type=int)
+    if not 0 < count <= MAX_UPCOMING_TRIALS:
+        response = jsonify({
+            'message': 'n must be between 1 and {}.'.format(MAX_UPCOMING_TRIALS),
+            'type': 'InvalidTrialCount'
+        })
+        response.status_code = 400
+        return response
+    return Response(
+        '[' + ', '.join(trial_json(trial, measures=False)
+                        for trial in run.upcoming_trials(count)) + ']',
+        mimetype='application/json'
+    )
+
+
 @blueprint.route('/<experiment>/<run>/lock')
 def lock_run(experiment, run):
-    token = None
-    if run.locked and not ('UNPROTECTED_RUNS' in app.config and app.config['UNPROTECTED_RUNS']):
+    token = str(uuid.uuid4())
+    force = 'UNPROTECTED_RUNS' in app.config and app.config['UNPROTECTED_RUNS']
+    if not run.lock(token, force=force):
+        db.session.rollback()
         response = jsonify({
             'message': 'Run {} of {} is already locked.'.format(run.id, experiment.id),
             'type': 'RunAlreadyLocked'
         })
         response.status_code = 405
         return response
-
-    token = str(uuid.uuid4())
-    run.token = token
+    notify(run, 'runLocked', locked=True)
     db.session.commit()
     print("Run {} locked.".format(repr(run)))
     return jsonify({
@@ -88,58 +153,162 @@ def lock_run(experiment, run):
 
 @blueprint.route('/<experiment>/<run>/unlock', methods=['POST'])
 def unlock_run(experiment, run):
-    if not run.locked:
-        response = jsonify({
-            'message': 'Run {} of {} is not locked.'.format(run.id, experiment.id),
-            'type': 'RunNotLocked'
-        })
-        response.status_code = 405
-        return response
-    elif not request.is_json:
+    if not request.is_json:
         response = jsonify({
             'message': 'Incorrect request type.',
             'type': 'Incorrect Request Type'
         })
         response.status_code = 405
         return response
-    elif request.get_json().get('token', None) != run.token:
-        response = jsonify({
-            'message': 'Wrong token: {} for run {}'.format(request.data.get('token', None), run.id),
-            'type': 'WrongToken'
-        })
+    token = request.get_json().get('token', None)
+    if token is None or not run.unlock(token):
+        db.session.rollback()
+        if not run.locked:
+            response = jsonify({
+                'message': 'Run {} of {} is not locked.'.format(run.id, experiment.id),
+                'type': 'RunNotLocked'
+            })
+        else:
+            response = jsonify({
+                'message': 'Wrong token: {} for run {}'.format(token, run.id),
+                'type': 'WrongToken'
+            })
         response.status_code = 405
         return response
-    else:
-        run.token = None
-        db.session.commit()
-        return run_info(experiment, run)
+    notify(run, 'runUnlocked', locked=False)
+    db.session.commit()
+    return run_info(run, experiment)
+
+
+@blueprint.route('/<experiment>/<run>/results', methods=['POST'])
+def post_results(experiment, run):
+    # Like trial.post_result, do not use request.get_json() to allow POST requests
+    # without preflight.
+    data = json.loads(request.data)
+
+    token_error = check_token(run, data['token'])
+    if token_error:
+        return token_error
+
+    wait_for_journal()
+    trials_data = data['trials']
+    keys = [(trial_data['blockNumber'], trial_data['number'])
+            for trial_data in trials_data]
+    # The batch may start with trials that have already been recorded (e.g. it is
+    # being re-sent after a lost answer).
+    completed_count = _get_completed_prefix_length(run, keys)
+    statuses = [
+        {'blockNumber': key[0], 'number': key[1], 'status': 'alreadyCompleted'}
+        for key in keys[:completed_count]
+    ]
+    # Fetch the next uncompleted trials of the run at once to check that the rest
+    # of the batch completes them sequentially.
+    pending = run.upcoming_trials(len(trials_data) - completed_count)
+    to_record = []
+    for trial_data, key in zip(trials_data[completed_count:], keys[completed_count:]):
+        if len(to_record) >= len(pending):
+            raise ExperimentProgressError(
+                'Cannot complete trial {} of block {}: run {} does not have enough '
+                'trials left.'.format(key[1], key[0], run.id)
+            )
+        trial = pending[len(to_record)]
+        if key != (trial.block.number, trial.number):
+            raise ExperimentProgressError(
+                'Cannot complete trial {} of block {}: trial {} of block {} is not '
+                'completed yet. Trials must be completed sequentially.'.format(
+                    key[1], key[0], trial.number, trial.block.number
+                )
+            )
+        to_record.append((trial, trial_data['measures']))
+        statuses.append({'blockNumber': key[0], 'number': key[1], 'status': 'completed'})
+
+    # Sequential completion has been checked above for the whole batch.
+    completion_date = datetime.today()
+    if to_record and not run.advance(pending[0].position, len(to_record),
+                                     completion_date):
+        raise ExperimentProgressError(
+            'Run {} has been updated concurrently.'.format(run.id)
+        )
+    for trial, data_measures in to_record:
+        trial.completion_date = completion_date
+        record_measures(trial, data_measures.get('trial', {}),
+                        data_measures.get('events', []))
+    if to_record:
+        notify(run, 'trialCompleted',
+               completed_trial_count=pending[0].position + len(to_record))
+    db.session.commit()
+    return jsonify({
+        'runId': run.id,
+        'experimentId': experiment.id,
+        'trials': statuses
+    })
+
+
+def _get_completed_prefix_length(run, keys):
+    """Return the number of trials at the start of keys, a list of (block number,
+    trial number), that have already been completed.
+
+    They must be consecutive trials of run, and immediately precede its first
+    uncompleted trial if keys continues with other trials.
+    """
+    if not keys:
+        return 0
+    first_position = (
+        db.session.query(Trial.position)
+        .join(Block)
+        .filter(Block._run_db_id == run._db_id,
+                Block.number == keys[0][0],
+                Trial.number == keys[0][1])
+        .scalar()
+    )
+    if first_position is None:
+        raise ExperimentProgressError(
+            'Cannot complete trial {} of block {}: run {} does not have such a '
+            'trial.'.format(keys[0][1], keys[0][0], run.id)
+        )
+    completed_keys = (
+        db.session.query(Block.number, Trial.number)
+        .join(Trial)
+        .filter(Block._run_db_id == run._db_id,
+                Trial.position >= first_position,
+                Trial.position < min(first_position + len(keys),
+                                     run.next_trial_position))
+        .order_by(Trial.position)
+        .all()
+    )
+    count = 0
+    for key, completed_key in zip(keys, completed_keys):
+        if key != tuple(completed_key):
+            break
+        count += 1
+    if 0 < count < len(keys) and first_position + count != run.next_trial_position:
+        key = keys[count]
+        raise ExperimentProgressError(
+            'Cannot complete trial {} of block {}: it does not follow the completed '
+            'trials of the batch, or they are not consecutive.'.format(key[1], key[0])
+        )
+    return count
 
 
 @blueprint.route('/<experiment>/<run>/plan')
 def run_plan(experiment, run):
-    exp_values = list(factor.default_value
-                      for factor
-                      in run.experiment.factors
-                      if factor.default_value)
-    measured_block_num = 0
-    blocks = []
-    for block in run.blocks:
-        block_info = {
-            'number': block.number,
-            'factorValues': dict((value.factor.id, value.id) for value in block.factor_values),
-            'trials': list(generate_block_trials_info(block,
-                                                      exp_values=exp_values,
-                                                      short=True,
-                                                      measures=False)),
-            'practice': block.practice
-        }
-        if not block.practice:
-            block_info.update({
-                'measuredBlockNumber': measured_block_num
-            })
-            measured_block_num += 1
-        blocks.append(block_info)
-    return Response(json.dumps(blocks), mimetype='application/json')
+    plan = get_run_plan(run)
+    etag = plan.etag(run)
+    not_modified_response = make_not_modified_response(etag)
+    if not_modified_response is not None:
+        return not_modified_response
+    completion_dates = [
+        convert_date(completion_date)
+        for completion_date, in db.session.query(Trial.completion_date)
+        .join(Block)
+        .filter(Block._run_db_id == run._db_id,
+                Trial.position < run.next_trial_position)
+        .order_by(Trial.position)
+    ]
+    response = Response(''.join(plan.render(completion_dates)),
+                        mimetype='application/json')
+    response.set_etag(etag)
+    return response
 
 
 def generate_run_trials_info(run, completed_only=False):
@@ -147,19 +316,13 @@ def generate_run_trials_info(run, completed_only=False):
                       for factor
                       in run.experiment.factors
                       if factor.default_value)
-    measured_block_num = 0
     for block in run.blocks:
         is_block_started = False
         for trial in generate_block_trials_info(block,
                                                 completed_only=completed_only,
-                                                exp_values=exp_values,
-                                                measured_block_num=(None
-                                                                    if block.practice
-                                                                    else measured_block_num)):
+                                                exp_values=exp_values):
             yield trial
             is_block_started = True
         else:
             if completed_only and not is_block_started:
                 break
-        if not block.practice:
-            measured_block_num += 1
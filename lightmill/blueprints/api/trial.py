@@ -2,13 +2,16 @@ import os
 import itertools
 import warnings
 import json
-from flask import jsonify, request, current_app as app
+import tempfile
+from flask import jsonify, request, g, current_app as app, Response
 from flask.blueprints import Blueprint
 from ..errors import UnknownElement
 from .._utils import register_invalid_error, inject_model, allow_origin, answer_options
-from .._utils import convert_date
-from ...model import db, ExperimentProgressError, Measure, TrialMeasureValue, Event
-from ...model import MeasureLevelError, EventMeasureValue
+from .._utils import convert_date, conditional, answer_conditional_requests
+from .._utils import register_db_id_cache
+from ...model import db, ExperimentProgressError, Measure
+from ...ingest import record_trial_results
+from ...progress import notify
 
 
 class WrongMeasureKey(Warning):
@@ -26,12 +29,33 @@ class WrongMeasureKey(Warning):
         return rv
 
 
+class MalformedResults(Exception):
+    status_code = 400
+
+    def __init__(self, message, status_code=status_code, payload=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status_code = status_code
+        self.payload = payload
+
+    def to_dict(self):
+        rv = dict(self.payload or ())
+        rv['message'] = self.message
+        return rv
+
+
+# Size above which newline-delimited JSON bodies are spooled to disk.
+NDJSON_SPOOL_SIZE = 1024 * 1024
+
+
 blueprint = Blueprint('trial', os.path.splitext(__name__)[0])
 blueprint.url_value_preprocessor(inject_model)
 register_invalid_error(blueprint, UnknownElement)
 register_invalid_error(blueprint, WrongMeasureKey)
+register_invalid_error(blueprint, MalformedResults)
 allow_origin(blueprint)
 answer_options(blueprint)
+answer_conditional_requests(blueprint)
 
 
 @blueprint.errorhandler(ExperimentProgressError)
@@ -46,12 +70,121 @@ def handle_experiment_error(error):
 
 @blueprint.route('/<experiment>/<run>/<int:block>/<int:trial>', methods=['POST'])
 def post_result(experiment, run, block, trial):
+    if request.mimetype == 'application/x-ndjson':
+        return _post_ndjson_result(run, trial)
+
     # Do not use request.get_json() to support unset content type and allow POST requests
     # without preflight.
     data = json.loads(request.data)
 
-    # check the token
-    token = data['token']
+    token_error = check_token(run, data['token'])
+    if token_error:
+        return token_error
+
+    data_measures = data['measures']
+    if data_measures:
+        journal = app.extensions.get('trial_journal')
+        if journal is not None:
+            return _journal_result(journal, trial, data_measures.get('trial', {}),
+                                   data_measures.get('events', []))
+        trial.set_completed()
+        record_measures(trial, data_measures.get('trial', {}),
+                        data_measures.get('events', []))
+        notify(run, 'trialCompleted', completed_trial_count=trial.position + 1)
+        db.session.commit()
+    return trial_info(trial)
+
+
+def _journal_result(journal, trial, trial_measures, events_measures):
+    """Acknowledge trial results once written to the journal.
+
+    The results are applied to the database later on by the journal, so
+    everything that could make them fail is checked beforehand.
+    """
+    if trial.completed or journal.is_pending(trial):
+        raise ExperimentProgressError("Trial already completed.")
+    previous = trial.previous()
+    if previous is not None and not previous.completed and not journal.is_pending(previous):
+        raise ExperimentProgressError(
+            "Cannot complete trial {}: previous trial is not completed yet. "
+            "Trials must be completed sequentially.".format(repr(trial))
+        )
+    if not app.config.get('ADD_MISSING_MEASURES', False):
+        # Consume the measures to refuse unknown measure keys.
+        for _ in _get_measures_values(trial_measures, 'trial', trial):
+            pass
+        for event_measures in events_measures:
+            for _ in _get_measures_values(event_measures, 'event', trial):
+                pass
+    journal.append(trial, trial_measures, events_measures)
+    notify(trial.run, 'trialCompleted', completed_trial_count=trial.position + 1)
+    db.session.commit()
+    response = trial_info(trial)
+    response.status_code = 202
+    return response
+
+
+def wait_for_journal():
+    """Make sure journaled results are applied before reading or recording results
+    directly."""
+    journal = app.extensions.get('trial_journal')
+    if journal is not None:
+        journal.wait_drained()
+        # The journal has been applied by another session.
+        db.session.expire_all()
+
+
+def _post_ndjson_result(run, trial):
+    """Record trial results sent as newline-delimited JSON.
+
+    The first line is a header object holding the token and the trial level
+    measures (e.g. {"token": "...", "trial": {...}}). Each following line holds
+    the measures of one event. The whole body is read and checked before
+    anything is written so that the database is not locked while the client
+    uploads it. Large bodies are spooled to disk, and events are parsed again
+    as they are recorded so they never need to be held in memory all at once.
+    """
+    with tempfile.SpooledTemporaryFile(NDJSON_SPOOL_SIZE) as events_file:
+        header = _spool_ndjson(request.stream, events_file)
+
+        token_error = check_token(run, header.get('token'))
+        if token_error:
+            return token_error
+
+        wait_for_journal()
+        events_file.seek(0)
+        trial.set_completed()
+        record_measures(trial, header.get('trial', {}),
+                        (json.loads(line) for line in events_file))
+        notify(run, 'trialCompleted', completed_trial_count=trial.position + 1)
+        db.session.commit()
+    return trial_info(trial)
+
+
+def _spool_ndjson(stream, events_file):
+    """Parse the newline-delimited JSON objects of stream, write the event lines
+    to events_file, and return the header object."""
+    header = None
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError as error:
+            raise MalformedResults('Invalid JSON on line {}: {}'.format(line_number, error))
+        if not isinstance(value, dict):
+            raise MalformedResults('Line {} is not a JSON object.'.format(line_number))
+        if header is None:
+            header = value
+        else:
+            events_file.write(line if line.endswith(b'\n') else line + b'\n')
+    if header is None:
+        raise MalformedResults('Missing header line.')
+    return header
+
+
+def check_token(run, token):
+    """Return an error response if token cannot be used to write run's results."""
     if run.token is None:
         response = jsonify({
             'message': 'Run must be locked before writing.',
@@ -67,69 +200,135 @@ def post_result(experiment, run, block, trial):
         response.status_code = 405
         return response
 
-    data_measures = data['measures']
-    if data_measures:
-        add_measures_if_missing = ('ADD_MISSING_MEASURES' in app.config
-                                   and app.config['ADD_MISSING_MEASURES'])
-        # register trial measures
-        for measure_id, measure_value in _convert_measures(data_measures['trial']):
-            val = _get_measure_value(
-                measure_id, measure_value,
-                measure_level='trial',
-                trial=trial,
-                add_measure_if_missing=add_measures_if_missing
-            )
-            trial.measure_values.append(val)
-
-        # register events
-        event_num = 0
-        for event_measures in data_measures['events']:
-            values = []
-            for measure_id, measure_value in _convert_measures(event_measures):
-                if measure_value is not None:
-                    val = _get_measure_value(
-                        measure_id, measure_value,
-                        measure_level='event',
-                        trial=trial,
-                        add_measure_if_missing=add_measures_if_missing
-                    )
-                    values.append(val)
-
-            Event(values, event_num, trial)
-            event_num += 1
 
-        trial.set_completed()
-        db.session.commit()
-    return trial_info(trial)
+def record_measures(trial, trial_measures, events_measures):
+    add_measures_if_missing = ('ADD_MISSING_MEASURES' in app.config
+                               and app.config['ADD_MISSING_MEASURES'])
+    record_trial_results(
+        trial,
+        _get_measures_values(trial_measures, 'trial', trial, add_measures_if_missing),
+        (_get_measures_values(event_measures, 'event', trial, add_measures_if_missing)
+         for event_measures in events_measures)
+    )
 
 
 @blueprint.route('/<experiment>/<run>/<int:block>/<int:trial>', methods=['GET'])
+@conditional
 def trial_info(trial, experiment=None, run=None, block=None):
-    factors = trial.experiment.factors
-    exp_values = (
-        factor.default_value for factor in factors if factor.default_value)
-    block_values = (value for value in trial.block.factor_values)
-    factor_values = dict((value.factor.id, value.id)
-                         for value
-                         in itertools.chain(exp_values, block_values, trial.factor_values))
+    return Response(trial_json(trial), mimetype='application/json')
+
+
+def trial_json(trial, measures=True):
+    """Return the JSON info of trial.
+
+    The trial's configuration is serialized at import: only its completion date
+    and measures are added. If measures is False, the trial's measures are not
+    fetched and considered empty (e.g. because the trial is not completed).
+    """
+    if trial.static_info is None:
+        trial.update_static_info()
     measures = dict((m_value.measure.id, m_value.value)
                     for m_value
-                    in trial.measure_values)
-    answer = {
-        'experimentId': trial.experiment.id,
-        'runId': trial.run.id,
-        'number': trial.number,
-        'blockNumber': trial.block.number,
-        'measuredBlockNumber': trial.block.measured_block_number(),
-        'factorValues': factor_values,
-        'measures': measures,
-        'practice': trial.block.practice,
-        'completionDate': convert_date(trial.completion_date)
-    }
-    return jsonify(answer)
-
-
-def _get_measure_value(
+                    in trial.measure_values) if measures else {}
+    return '{}, "measures": {}, "completionDate": {}}}'.format(
+        trial.static_info[:-1],
+        json.dumps(measures),
+        json.dumps(convert_date(trial.completion_date))
+    )
+
+
+# Compiled measure plans, by experiment database id.
+_measure_plans = register_db_id_cache({})
+
+
+class _MeasurePlan(object):
+    """Measures of an experiment compiled into a tree following their dotted ids.
+
+    Each node is a [path, entry, children] list where entry is a
+    (measure db id, trial level, event level) tuple if path is a measure id.
+    """
+
+    def __init__(self, measures):
+        self.entries = {}
+        self.root = [None, None, {}]
+        for measure in measures.values():
+            entry = (measure._db_id, measure.trial_level, measure.event_level)
+            self.entries[measure.id] = entry
+            node = self.root
+            for key in measure.id.split('.'):
+                child = node[2].get(key)
+                if child is None:
+                    path = key if node[0] is None else node[0] + '.' + key
+                    child = node[2][key] = [path, None, {}]
+                node = child
+            node[1] = entry
+
+
+def _get_measure_plan(experiment):
+    plan = _measure_plans.get(experiment._db_id)
+    if plan is None:
+        plan = _MeasurePlan(experiment.measures)
+        # Measures registered during this request are not committed yet.
+        if not g.get('measures_registered', False):
+            _measure_plans[experiment._db_id] = plan
+    return plan
+
+
+def _get_measures_values(measures, measure_level, trial, add_measures_if_missing=False):
+    level_index = 1 if measure_level == 'trial' else 2
+    plan = _get_measure_plan(trial.experiment)
+    for measure_id, entry, measure_value in _flatten_measures(measures, plan.root, None):
+        if entry is None:
+            # Keys that contain dots are not in the tree.
+            entry = plan.entries.get(measure_id)
+        if entry is not None and entry[level_index]:
+            yield entry[0], measure_value
+        else:
+            measure = _get_measure(
+                measure_id, measure_value,
+                measure_level=measure_level,
+                trial=trial,
+                add_measure_if_missing=add_measures_if_missing
+            )
+            if measure is not None:
+                # The plan did not know about this measure.
+                _measure_plans.pop(trial.experiment._db_id, None)
+                plan = _get_measure_plan(trial.experiment)
+                yield measure._db_id, measure_value
+
+
+def _flatten_measures(measures, node, path):
+    """Yield (measure id, plan entry, value) for each leaf of measures.
+
+    node is the plan node matching path, or None if path is outside of the plan.
+    """
+    if isinstance(measures, dict):
+        items = measures.items()
+    elif isinstance(measures, list):
+        items = zip(map(str, itertools.count()), measures)
+    else:
+        if measures is not None:
+            yield ('' if path is None else path), (node[1] if node else None), measures
+        return
+    children = node[2] if node else None
+    for key, value in items:
+        child = children.get(key) if children else None
+        if child is not None:
+            yield from _flatten_measures(value, child, child[0])
+        else:
+            yield from _flatten_measures(
+                value, None, key if path is None else path + '.' + key
+            )
+
+
+def _registered_measure():
+    # Make sure the measure has an id, and prevent the measure plan to be cached
+    # until the request is committed.
+    db.session.flush()
+    g.measures_registered = True
+
+
+def _get_measure(
     measure_id,
     measure_value,
     measure_level,
@@ -155,6 +354,7 @@ def _get_measure_value(
             measure = Measure(**m_args)
             # register it
             experiment.measures[measure_id] = measure
+            _registered_measure()
             # show a warning
             msg = "Unknown {} measure key: '{}' (value: '{}'). New measure type registered.".format(
                 measure_level,
@@ -167,14 +367,12 @@ def _get_measure_value(
         elif not getattr(measure, measure_level + '_level'):
             # add the level
             setattr(measure, measure_level + '_level', True)
+            _registered_measure()
             # show a warning
             msg = ("Measure key '{}'(value: '{}') was not at the {} level. "
                    "Trial level added.").format(measure_level, measure_id, measure_value)
             warnings.warn(msg, WrongMeasureKey)
-        return (
-            TrialMeasureValue(measure_value, measure) if measure_level is 'trial'
-            else EventMeasureValue(measure_value, measure)
-        )
+        return measure
 
     # case refuse incorrect measure types
     elif measure is None:
@@ -184,37 +382,12 @@ def _get_measure_value(
             measure_value
         )
         raise WrongMeasureKey(msg)
+    elif not getattr(measure, measure_level + '_level'):
+        msg = "Measure key '{}'(value: '{}') is not at the {} level.".format(
+            measure_id,
+            measure_value,
+            measure_level
+        )
+        warnings.warn(msg, WrongMeasureKey)
     else:
-        try:
-            return (
-                TrialMeasureValue(measure_value, measure) if measure_level is 'trial'
-                else EventMeasureValue(measure_value, measure)
-            )
-        except MeasureLevelError:
-            msg = "Measure key '{}'(value: '{}') is not at the {} level.".format(
-                measure_id,
-                measure_value,
-                measure_level
-            )
-            warnings.warn(msg, WrongMeasureKey)
-
-
-def _convert_measures(measures):
-    for measure_path, value in _get_measures_paths(measures):
-        if value is not None:
-            yield '.'.join(measure_path), value
-
-
-def _get_measures_paths(measures):
-    if isinstance(measures, dict):
-        for path_head, path_tail in measures.items():
-            for path_tail, value in _get_measures_paths(path_tail):
-                yield [path_head] + path_tail, value
-    elif isinstance(measures, list):
-        path_head = 0
-        for path_tail in measures:
-            for path_tail, value in _get_measures_paths(path_tail):
-                yield [str(path_head)] + path_tail, value
-            path_head += 1
-    else:
-        yield [], measures
+        return measure
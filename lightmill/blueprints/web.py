@@ -1,27 +1,36 @@
 import itertools
 import os
-from flask import render_template, redirect, Response
+import tempfile
+from datetime import datetime
+from flask import render_template, redirect, request, Response, send_file
 from flask.blueprints import Blueprint
 from flask.helpers import url_for
-from sqlalchemy import func
 from sqlalchemy.sql.expression import literal_column
 from ..model import (
     Experiment,
     Run,
     Trial,
     Block,
+    Event,
     db,
     TrialMeasureValue,
+    EventMeasureValue,
     trial_factor_values,
     block_values,
 )
 from ..model import Measure, FactorValue, Factor
 from ._utils import inject_model, convert_date
+from ._csv import csv_chunks
 from .api.run import generate_run_trials_info
+from ..progress import notify, stream as progress_stream
 
 web_blueprint = Blueprint("web", os.path.splitext(__name__)[0])
 web_blueprint.url_value_preprocessor(inject_model)
 
+# Number of rows fetched at once by the CSV exports so that results are not
+# loaded in memory all at once.
+CSV_FETCH_SIZE = 1000
+
 
 def _toCamelCase(st):
     output = "".join(x for x in st.title() if x.isalpha())
@@ -40,20 +49,6 @@ def _get_free_name(name, others, prefix):
     return name
 
 
-def _format_csv_cell(cell_content):
-    "Escaping CSV cells accordingly to RFC4180 (https://tools.ietf.org/html/rfc4180)"
-    enclose = False
-    if '"' in cell_content:
-        enclose = True
-        cell_content = cell_content.replace('"', '""')
-    if "\n" in cell_content or "," in cell_content:
-        enclose = True
-    if enclose:
-        return '"' + cell_content + '"'
-    else:
-        return cell_content
-
-
 @web_blueprint.route("/")
 def index():
     return render_template("experiments_list.jinja", experiments=Experiment.query.all())
@@ -61,21 +56,24 @@ def index():
 
 @web_blueprint.route("/experiment/<experiment>")
 def experiment(experiment):
-    run_statuses = (
-        db.session.query(
-            Run, func.count(Trial.completion_date), func.count(Trial.number)
-        )
-        .filter(Run.experiment == experiment)
-        .outerjoin(Block, Block._run_db_id == Run._db_id)
-        .outerjoin(Trial, Trial._block_db_id == Block._db_id)
-        .group_by(Run.id)
-    ).all()
+    runs = experiment.runs.order_by(Run.id).all()
     return render_template(
         "experiment.jinja",
-        run_statuses=run_statuses,
+        runs=runs,
         experiment=experiment,
-        completed_nb=len([r for r in filter(lambda e: e[1] == e[2], run_statuses)]),
-        total_nb=len(run_statuses),
+        completed_nb=len([run for run in runs if run.completed()]),
+        total_nb=len(runs),
+        parquet_available=_get_parquet_export().is_available(),
+    )
+
+
+@web_blueprint.route("/experiment/<experiment>/progress")
+def experiment_progress(experiment):
+    """Stream the progress of the experiment's runs as server-sent events."""
+    return Response(
+        progress_stream(experiment),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
@@ -118,26 +116,21 @@ def generate_trial_csv(experiment):
         headers = list(map(_toCamelCase, header_ids))
 
         # Yield the header row.
-        yield ",".join(
+        other_factor_names = set(measure_ids + headers)
+        other_measure_names = set(factor_ids + headers)
+        yield (
             headers
-            + list(
-                _format_csv_cell(_get_free_name(f, measure_ids + headers, "_factor_"))
-                for f in factor_ids
-            )
-            + list(
-                _format_csv_cell(_get_free_name(m, factor_ids + headers, "_measure_"))
-                for m in measure_ids
-            )
-        ) + "\n"
+            + [_get_free_name(f, other_factor_names, "_factor_") for f in factor_ids]
+            + [_get_free_name(m, other_measure_names, "_measure_") for m in measure_ids]
+        )
 
-        # From 3 records, yield each cell in the right order.
+        # From 3 records, return the cells in the right order.
         def generate_cells(trial, factors, measures):
-            for h in header_ids:
-                yield _format_csv_cell(trial.get(h, ""))
-            for f in factor_ids:
-                yield _format_csv_cell(factors.get(f, ""))
-            for m in measure_ids:
-                yield _format_csv_cell(measures.get(m, ""))
+            return (
+                [trial.get(h, "") for h in header_ids]
+                + [factors.get(f, "") for f in factor_ids]
+                + [measures.get(m, "") for m in measure_ids]
+            )
 
         # Request factor values and measure values.
         factor_values = (
@@ -147,9 +140,10 @@ def generate_trial_csv(experiment):
                 Trial.number,
                 Trial.completion_date,
                 Block.number,
+                Block.measured_number,
                 Block.practice,
                 Run.id,
-                literal_column('"factors"'),
+                literal_column("'factors'").label("kind"),
             )
             .filter(Run.experiment == experiment)
             .join(Factor, FactorValue.factor)
@@ -162,9 +156,10 @@ def generate_trial_csv(experiment):
                 Trial.number,
                 Trial.completion_date,
                 Block.number,
+                Block.measured_number,
                 Block.practice,
                 Run.id,
-                literal_column('"measures"'),
+                literal_column("'measures'").label("kind"),
             )
             .filter(Run.experiment == experiment)
             .join(Measure, TrialMeasureValue.measure)
@@ -177,21 +172,23 @@ def generate_trial_csv(experiment):
                 literal_column("-1"),
                 literal_column("null"),
                 Block.number,
+                Block.measured_number,
                 Block.practice,
                 Run.id,
-                literal_column('"factors"'),
+                literal_column("'factors'").label("kind"),
             )
             .filter(Run.experiment == experiment)
             .join(Factor, FactorValue.factor)
             .join(block_values, Block, Run)
         )
 
-        values = measure_values.union_all(factor_values, block_factor_values).order_by(
-            Run.id, Block.number, Trial.number
+        values = (
+            measure_values.union_all(factor_values, block_factor_values)
+            .order_by(Run.id, Block.number, Trial.number)
+            .yield_per(CSV_FETCH_SIZE)
         )
 
         current_record = None
-        current_measured_block_num = None
         current_trial_number = None
         current_block_number = None
         current_block_factors = {}
@@ -202,6 +199,7 @@ def generate_trial_csv(experiment):
             trial_number,
             completion_date,
             block_number,
+            measured_block_number,
             practice,
             run_id,
             value_group,
@@ -224,19 +222,12 @@ def generate_trial_csv(experiment):
                     current_block_factors = current_record["factors"]
                 else:
                     # Yield the current record.
-                    yield ",".join(generate_cells(**current_record)) + "\n"
+                    yield generate_cells(**current_record)
                 # Reset the values.
                 current_record = None
 
             if not current_record:
                 current_trial_number = trial_number
-                current_measured_block_num = (
-                    0
-                    if not current_measured_block_num and not practice
-                    else current_measured_block_num
-                    if practice
-                    else current_measured_block_num + 1
-                )
                 current_block_number = block_number
                 current_run_id = run_id
                 # print(type(completion_date))
@@ -251,7 +242,7 @@ def generate_trial_csv(experiment):
                         "run_id": run_id,
                         "block_number": str(block_number),
                         "measured_block_number": (
-                            "" if practice else str(current_measured_block_num)
+                            "" if practice else str(measured_block_number)
                         ),
                         "trial_number": str(trial_number),
                         "practice": str(practice),
@@ -261,11 +252,11 @@ def generate_trial_csv(experiment):
                 }
             current_record[value_group][value_id] = value
         # Yield the last record
-        yield ",".join(generate_cells(**current_record)) + "\n"
+        yield generate_cells(**current_record)
 
     # Create and return the response, allowing cross-origin requests.
     return Response(
-        generate(),
+        csv_chunks(generate()),
         mimetype="text/csv",
         headers={
             "Access-Control-Allow-Origin": "*",
@@ -274,9 +265,285 @@ def generate_trial_csv(experiment):
     )
 
 
+@web_blueprint.route("/experiment/<experiment>-events.csv")
+def generate_event_csv(experiment):
+    """Stream the events of the experiment, with their measures and the factor
+    values of their trial.
+
+    The optional run (repeatable), practice (true or false), and completed_since
+    (timestamp in milliseconds, as in the serverCompletionDate column, or ISO
+    8601 date) arguments select the events to export.
+    """
+    try:
+        filters = _get_event_filters(request.args)
+    except ValueError as error:
+        return Response(str(error), status=400, mimetype="text/plain")
+
+    def generate():
+        factor_ids = list(
+            map(
+                lambda x: x[0],
+                db.session.query(Factor.id)
+                .join(Experiment)
+                .filter(Factor.experiment == experiment)
+                .order_by(Factor.id),
+            )
+        )
+        measure_ids = list(
+            map(
+                lambda x: x[0],
+                db.session.query(Measure.id)
+                .filter_by(event_level=True)
+                .filter(Measure.experiment == experiment)
+                .join(Experiment)
+                .order_by(Measure.id),
+            )
+        )
+
+        header_ids = [
+            "experiment_id",
+            "run_id",
+            "block_number",
+            "measured_block_number",
+            "trial_number",
+            "event_number",
+            "practice",
+            "server_completion_date",
+        ]
+
+        headers = list(map(_toCamelCase, header_ids))
+
+        other_factor_names = set(measure_ids + headers)
+        other_measure_names = set(factor_ids + headers)
+        yield (
+            headers
+            + [_get_free_name(f, other_factor_names, "_factor_") for f in factor_ids]
+            + [_get_free_name(m, other_measure_names, "_measure_") for m in measure_ids]
+        )
+
+        def generate_cells(event, factors, measures):
+            return (
+                [event.get(h, "") for h in header_ids]
+                + [factors.get(f, "") for f in factor_ids]
+                + [measures.get(m, "") for m in measure_ids]
+            )
+
+        # Event measure values, then trial factor values (with -1 as event
+        # number) and block factor values (with -1 as trial and event numbers)
+        # so that the factor values of a trial come before its events.
+        measure_values = filters(
+            db.session.query(
+                Measure.id.label("id"),
+                EventMeasureValue.value.label("value"),
+                Event.number,
+                Trial.number,
+                Trial.completion_date,
+                Block.number,
+                Block.measured_number,
+                Block.practice,
+                Run.id,
+            )
+            .filter(Run.experiment == experiment)
+            .join(Measure, EventMeasureValue.measure)
+            .join(Event, Trial, Block, Run),
+            trial_level=True,
+        )
+        factor_values = filters(
+            db.session.query(
+                Factor.id.label("id"),
+                FactorValue.id.label("value"),
+                literal_column("-1").label("event_number"),
+                Trial.number,
+                Trial.completion_date,
+                Block.number,
+                Block.measured_number,
+                Block.practice,
+                Run.id,
+            )
+            .filter(Run.experiment == experiment)
+            .join(Factor, FactorValue.factor)
+            .join(trial_factor_values, Trial, Block, Run),
+            trial_level=True,
+        )
+        block_factor_values = filters(
+            db.session.query(
+                Factor.id.label("id"),
+                FactorValue.id.label("value"),
+                literal_column("-1").label("event_number"),
+                literal_column("-1").label("trial_number"),
+                literal_column("null").label("completion_date"),
+                Block.number,
+                Block.measured_number,
+                Block.practice,
+                Run.id,
+            )
+            .filter(Run.experiment == experiment)
+            .join(Factor, FactorValue.factor)
+            .join(block_values, Block, Run),
+            trial_level=False,
+        )
+
+        values = (
+            measure_values.union_all(factor_values, block_factor_values)
+            .order_by(Run.id, Block.number, Trial.number, Event.number)
+            .yield_per(CSV_FETCH_SIZE)
+        )
+
+        current_block = None
+        current_trial = None
+        current_event = None
+        block_factors = {}
+        trial_factors = {}
+        current_record = None
+        for [
+            value_id,
+            value,
+            event_number,
+            trial_number,
+            completion_date,
+            block_number,
+            measured_block_number,
+            practice,
+            run_id,
+        ] in values:
+            block = (run_id, block_number)
+            if block != current_block:
+                current_block = block
+                block_factors = {}
+            if trial_number < 0:
+                block_factors[value_id] = value
+                continue
+            trial = block + (trial_number,)
+            if trial != current_trial:
+                current_trial = trial
+                trial_factors = block_factors.copy()
+            if event_number < 0:
+                trial_factors[value_id] = value
+                continue
+            event = trial + (event_number,)
+            if event != current_event:
+                if current_record is not None:
+                    yield generate_cells(**current_record)
+                current_event = event
+                current_record = {
+                    "event": {
+                        "server_completion_date": (
+                            str(convert_date(completion_date))
+                            if completion_date
+                            else ""
+                        ),
+                        "experiment_id": experiment.id,
+                        "run_id": run_id,
+                        "block_number": str(block_number),
+                        "measured_block_number": (
+                            "" if practice else str(measured_block_number)
+                        ),
+                        "trial_number": str(trial_number),
+                        "event_number": str(event_number),
+                        "practice": str(practice),
+                    },
+                    "factors": trial_factors,
+                    "measures": {},
+                }
+            current_record["measures"][value_id] = value
+        # Yield the last record
+        if current_record is not None:
+            yield generate_cells(**current_record)
+
+    return Response(
+        csv_chunks(generate()),
+        mimetype="text/csv",
+        headers={
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "X-Requested-With, Content-Type",
+        },
+    )
+
+
+def _get_event_filters(args):
+    """Return a function that applies the filters in args to a query of
+    generate_event_csv. Raise ValueError if an argument is invalid."""
+    run_ids = args.getlist("run")
+    practice = args.get("practice")
+    if practice is not None:
+        if practice.lower() not in ("true", "false", "1", "0"):
+            raise ValueError("practice must be true or false.")
+        practice = practice.lower() in ("true", "1")
+    completed_since = args.get("completed_since")
+    if completed_since is not None:
+        completed_since = _parse_date_argument(completed_since)
+
+    def apply_filters(query, trial_level):
+        if run_ids:
+            query = query.filter(Run.id.in_(run_ids))
+        if practice is not None:
+            query = query.filter(Block.practice == practice)
+        # Block factor values are only used by the trials that are selected.
+        if completed_since is not None and trial_level:
+            query = query.filter(Trial.completion_date >= completed_since)
+        return query
+
+    return apply_filters
+
+
+def _parse_date_argument(value):
+    try:
+        return datetime.fromtimestamp(int(value) / 1000.0)
+    except ValueError:
+        pass
+    for date_format in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError(
+        "completed_since must be a timestamp in milliseconds or an ISO 8601 date."
+    )
+
+
+@web_blueprint.route("/experiment/<experiment>.parquet")
+def download_trial_parquet(experiment):
+    return _parquet_response(experiment, experiment.id + ".parquet", events=False)
+
+
+@web_blueprint.route("/experiment/<experiment>-events.parquet")
+def download_event_parquet(experiment):
+    return _parquet_response(experiment, experiment.id + "-events.parquet", events=True)
+
+
+def _get_parquet_export():
+    # Imported lazily since the export modules import the application.
+    from .. import parquet_export
+
+    return parquet_export
+
+
+def _parquet_response(experiment, file_name, events):
+    parquet_export = _get_parquet_export()
+    if not parquet_export.is_available():
+        return Response(
+            "Parquet exports require pyarrow.", status=501, mimetype="text/plain"
+        )
+    # Parquet files end with their metadata so they cannot be streamed as they
+    # are written.
+    target = tempfile.TemporaryFile()
+    if events:
+        parquet_export.write_parquet(experiment, events_target=target)
+    else:
+        parquet_export.write_parquet(experiment, trials_target=target)
+    target.seek(0)
+    return send_file(
+        target,
+        mimetype="application/vnd.apache.parquet",
+        as_attachment=True,
+        attachment_filename=file_name,
+    )
+
+
 @web_blueprint.route("/run/<experiment>/<run>/unlock")
 def unlock_run(experiment, run):
-    run.token = None
+    if run.unlock():
+        notify(run, "runUnlocked", locked=False)
     db.session.commit()
     return redirect(url_for(".experiment", experiment=experiment.id))
 
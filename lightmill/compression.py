@@ -0,0 +1,80 @@
+__author__ = "Quentin Roy"
+
+import zlib
+from flask import request
+
+# Types of the responses that may be compressed. Event streams are not: their
+# events must be delivered as soon as they are sent.
+COMPRESSED_MIMETYPES = set(
+    ["application/json", "text/csv", "text/html", "text/plain", "text/css"]
+)
+
+# Appended to the ETag of compressed responses: they are a different
+# representation than their uncompressed version.
+GZIP_ETAG_SUFFIX = "-gzip"
+
+
+def compress_responses(app, min_size, level):
+    """Compress the responses of app with gzip if the client accepts it.
+
+    Responses smaller than min_size bytes are sent as is. Streamed responses
+    (e.g. CSV exports) are compressed chunk by chunk as they are generated, so
+    their size is not known and they are always compressed.
+    """
+
+    @app.after_request
+    def compress(response):
+        if not _is_compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        if request.accept_encodings["gzip"] <= 0:
+            return response
+        if response.is_streamed:
+            response.response = _compress_chunks(
+                response.iter_encoded(),
+                level,
+                getattr(response.response, "close", None),
+            )
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(gzip_compress(data, level))
+        response.headers["Content-Encoding"] = "gzip"
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(etag + GZIP_ETAG_SUFFIX, weak)
+        return response
+
+
+def gzip_compress(data, level):
+    compressor = _create_compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compress_chunks(chunks, level, close=None):
+    compressor = _create_compressor(level)
+    try:
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+    finally:
+        if close is not None:
+            close()
+
+
+def _create_compressor(level):
+    # 16 + MAX_WBITS writes a gzip header and trailer around the deflate stream.
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def _is_compressible(response):
+    return (
+        response.status_code == 200
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSED_MIMETYPES
+    )
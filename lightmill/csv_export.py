@@ -1,13 +1,20 @@
 __author__ = "Quentin Roy"
 
 from .app import create_app
-from .default_settings import DATABASE_URI
-from .model import Experiment
+from .model import db, Experiment, Run, Block, Trial, Event, Factor, FactorValue
+from .model import TrialMeasureValue, EventMeasureValue
+from .model import block_values, trial_factor_values
+from sqlalchemy import select
 import os
-import sys
+import json
 import time
+import shutil
+import tempfile
+import multiprocessing
+import itertools
+from itertools import groupby
 from csv import DictWriter
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
 
 def convert_bool(val):
@@ -131,192 +138,549 @@ def create_event_fields(experiment):
     return field_info
 
 
-def create_logger(fields, target_path):
+def create_logger(fields, target_file, write_header=True):
     field_names = []
 
     for sub_fields in fields.values():
         for field in sub_fields.values():
             field_names.append(field["final_name"])
 
-    target_file = open(target_path, "w")
     dict_writer = DictWriter(target_file, field_names)
-    dict_writer.writeheader()
+    if write_header:
+        dict_writer.writeheader()
     return dict_writer
 
 
-def run_csv_export(
-    run,
-    trial_logger,
-    events_log_dir,
-    trial_fields,
-    event_fields,
-    global_event_logger=None,
-):
-    print("Export Run {}:".format(run.id))
-
-    trial_export_time = 0
-    event_export_time = 0
-    trial_count = 0
-    event_count = 0
-
-    run_start = time.time()
-
-    if not os.path.exists(events_log_dir):
-        os.makedirs(events_log_dir)
-
-    for trial in run.trials:
-        sys.stdout.write(
-            "  Trial {} of block {}...".format(trial.number, trial.block.number)
-        )
-        sys.stdout.flush()
-        factor_values = list(trial.iter_all_factor_values())
-        trial_start = time.time()
-        trial_event_count = 0
-        trial_events_time = 0
-        row = get_trial_row(trial, trial_fields, factor_values)
-        trial_logger.writerow(row)
-        trial_row_end = time.time()
-
-        events_path = os.path.join(
-            events_log_dir,
-            "{}-{}-{}.csv".format(run.id, trial.block.number, trial.number),
+# Name of the file, in each experiment's export directory, that records what
+# has been exported.
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class RunExporter(object):
+    """Export the trials of the runs of an experiment.
+
+    Each run is read with a few ordered queries, and its rows are built in a
+    single pass over their results.
+    """
+
+    def __init__(self, experiment, target_dir=None):
+        self.experiment = experiment
+        self.trial_fields = create_trial_fields(experiment)
+        self.event_fields = create_event_fields(experiment)
+        if target_dir is not None:
+            self.runs_dir = os.path.join(target_dir, "runs")
+            self.events_dir = os.path.join(target_dir, "events")
+        self.xp_name = experiment.name or experiment.id
+        self.value_labels = _get_factor_value_labels(experiment)
+        self.default_values = _get_default_values(experiment)
+        self.trial_measure_names = _get_measure_names(self.trial_fields)
+        self.event_measure_names = _get_measure_names(self.event_fields)
+        self.trial_factor_names = _get_factor_names(self.trial_fields)
+        self.event_factor_names = _get_factor_names(self.event_fields)
+
+    def iter_rows(
+        self, run_db_id, run_id, start_position, end_position, convert=convert_bool
+    ):
+        """Yield (trial row, event rows) for the trials of a run from
+        start_position (included) to end_position (excluded), or to the end of
+        the run if end_position is None.
+
+        convert is applied to the practice flag, and to the factor and measure
+        values.
+        """
+        block_values_by_block = _get_block_values(run_db_id)
+        trials = _merged(
+            _merged(
+                _iter_trials(run_db_id, start_position, end_position),
+                _iter_trial_values(run_db_id, start_position, end_position),
+                lambda trial: trial[3],
+            ),
+            _iter_events(run_db_id, start_position, end_position),
+            lambda trial: trial[0][3],
         )
-        events_logger = create_logger(event_fields, events_path)
-
-        event_rows_start = time.time()
-        for event in trial.events:
-            trial_event_count += 1
-            event_start = time.time()
-            row = get_event_row(event, event_fields, factor_values)
-            events_logger.writerow(row)
-            if global_event_logger:
-                global_event_logger.writerow(row)
-            event_end = time.time()
-            trial_events_time += event_end - event_start
-
-        trial_end = time.time()
-        trial_duration = trial_end - trial_start
-        trial_export_time += trial_duration
-        event_export_time += trial_events_time
-        event_count += trial_event_count
-        trial_count += 1
+        for (trial, trial_value_ids), events in trials:
+            (
+                block_db_id,
+                block_number,
+                practice,
+                _,
+                trial_number,
+                measure_values,
+            ) = trial
+            # Trial values, then block values, then default values.
+            factor_labels = {}
+            for value_db_id in itertools.chain(
+                trial_value_ids,
+                block_values_by_block.get(block_db_id, ()),
+                self.default_values.values(),
+            ):
+                factor_id, label = self.value_labels[value_db_id]
+                if factor_id not in factor_labels:
+                    factor_labels[factor_id] = convert(label)
+
+            trial_row = {
+                u"Experiment Name": self.xp_name,
+                u"Run Id": run_id,
+                u"Block Number": block_number,
+                u"Trial Number": trial_number,
+                u"Practice": convert(practice),
+            }
+            for factor_id, label in factor_labels.items():
+                trial_row[self.trial_factor_names[factor_id]] = label
+            for measure_db_id, value in measure_values:
+                if measure_db_id in self.trial_measure_names:
+                    trial_row[self.trial_measure_names[measure_db_id]] = convert(value)
+
+            event_rows = []
+            for event_number, event_measure_values in events:
+                event_row = {
+                    u"Experiment Name": self.xp_name,
+                    u"Run Id": run_id,
+                    u"Block Number": block_number,
+                    u"Trial Number": trial_number,
+                    u"Practice": convert(practice),
+                    u"Event Number": event_number,
+                }
+                for factor_id, label in factor_labels.items():
+                    event_row[self.event_factor_names[factor_id]] = label
+                for measure_db_id, value in event_measure_values:
+                    if measure_db_id in self.event_measure_names:
+                        event_row[self.event_measure_names[measure_db_id]] = convert(
+                            value
+                        )
+                event_rows.append(event_row)
+            yield trial_row, event_rows
+
+    def export_run(
+        self,
+        run_db_id,
+        run_id,
+        start_position,
+        end_position,
+        xp_logger=None,
+        xp_event_logger=None,
+    ):
+        """Export the trials of a run from start_position (included) to
+        end_position (excluded), or to the end of the run if end_position is
+        None.
+
+        The rows of the trials are appended to the run's file, which is created
+        if start_position is 0, and to xp_logger and xp_event_logger if
+        provided.
+        """
+        print("Export Run {}:".format(run_id))
+        run_start = time.time()
+        trial_count = 0
+        event_count = 0
+        with open(
+            os.path.join(self.runs_dir, run_id + ".csv"),
+            "a" if start_position > 0 else "w",
+            newline="",
+        ) as run_file:
+            run_logger = create_logger(
+                self.trial_fields, run_file, write_header=start_position == 0
+            )
+            for trial_row, event_rows in self.iter_rows(
+                run_db_id, run_id, start_position, end_position
+            ):
+                if xp_logger is not None:
+                    xp_logger.writerow(trial_row)
+                run_logger.writerow(trial_row)
+                trial_count += 1
+
+                events_path = os.path.join(
+                    self.events_dir,
+                    "{}-{}-{}.csv".format(
+                        run_id, trial_row[u"Block Number"], trial_row[u"Trial Number"]
+                    ),
+                )
+                with open(events_path, "w", newline="") as events_file:
+                    events_logger = create_logger(self.event_fields, events_file)
+                    events_logger.writerows(event_rows)
+                if xp_event_logger is not None:
+                    xp_event_logger.writerows(event_rows)
+                event_count += len(event_rows)
         print(
-            " exported ({:.02f} sec, {} events, trial row: {}sec, event rows: {}sec"
-            ", event mean: {}sec)".format(
-                trial_duration,
-                trial_event_count,
-                trial_row_end - trial_start,
-                trial_end - event_rows_start,
-                float(trial_events_time) / trial_event_count
-                if trial_event_count
-                else 0,
+            "Run {} exported ({:.2f} sec, {} trials, {} events).".format(
+                run_id, time.time() - run_start, trial_count, event_count
             )
         )
 
-    run_end = time.time()
-    print("Run {} exported.".format(run.id))
-    print(
-        "{} sec, {:.2f} sec/trials, {:} ms/events, {} trials, {} events".format(
-            round(run_end - run_start),
-            trial_export_time / trial_count,
-            round((event_export_time / event_count) * 1000),
-            trial_count,
-            event_count,
+
+def _get_factor_value_labels(experiment):
+    """Return {factor value db id: (factor id, value label)} for experiment."""
+    return dict(
+        (value_db_id, (factor_id, value_name or value_id))
+        for value_db_id, factor_id, value_id, value_name in db.session.execute(
+            select([FactorValue._db_id, Factor.id, FactorValue.id, FactorValue.name])
+            .select_from(
+                FactorValue.__table__.join(
+                    Factor.__table__, Factor._db_id == FactorValue._factor_db_id
+                )
+            )
+            .where(Factor._experiment_db_id == experiment._db_id)
         )
     )
 
 
-def get_trial_row(trial, fields, factor_values):
-    row = {
-        u"Experiment Name": trial.experiment.name or trial.experiment.id,
-        u"Run Id": trial.run.id,
-        u"Block Number": trial.block.number,
-        u"Trial Number": trial.number,
-        u"Practice": convert_bool(trial.block.practice),
-    }
-    for factor_value in factor_values:
-        factor = factor_value.factor
-        factor_name = fields["factor"][factor.id]["final_name"]
-        value_name = factor_value.name or factor_value.id
-        row[factor_name] = convert_bool(value_name)
-    for measure_value in trial.measure_values:
-        measure = measure_value.measure
-        measure_name = fields["measure"][measure.id]["final_name"]
-        row[measure_name] = convert_bool(measure_value.value)
-    return row
-
-
-def get_event_row(event, fields, factor_values):
-    trial = event.trial
-    row = {
-        u"Experiment Name": trial.experiment.name or trial.experiment.id,
-        u"Run Id": trial.run.id,
-        u"Block Number": trial.block.number,
-        u"Trial Number": trial.number,
-        u"Practice": convert_bool(trial.block.practice),
-        u"Event Number": event.number,
-    }
-    for factor_value in factor_values:
-        factor = factor_value.factor
-        factor_name = fields["factor"][factor.id]["final_name"]
-        value_name = factor_value.name or factor_value.id
-        row[factor_name] = convert_bool(value_name)
-    for measure_value in event.measure_values.values():
-        measure = measure_value.measure
-        measure_name = fields["measure"][measure.id]["final_name"]
-        row[measure_name] = convert_bool(measure_value.value)
-    return row
+def _get_default_values(experiment):
+    return dict(
+        db.session.execute(
+            select([Factor.id, FactorValue._db_id])
+            .select_from(
+                Factor.__table__.join(
+                    FactorValue.__table__,
+                    FactorValue._db_id == Factor._default_value_db_id,
+                )
+            )
+            .where(Factor._experiment_db_id == experiment._db_id)
+        ).fetchall()
+    )
+
+
+def _get_measure_names(fields):
+    return dict(
+        (field["original_field"]._db_id, field["final_name"])
+        for field in fields["measure"].values()
+    )
+
+
+def _get_factor_names(fields):
+    return dict(
+        (factor_id, field["final_name"]) for factor_id, field in fields["factor"].items()
+    )
+
 
+def _get_field_names(fields):
+    return [
+        field["final_name"]
+        for sub_fields in fields.values()
+        for field in sub_fields.values()
+    ]
 
-class MultiLogger:
-    def __init__(self, loggers):
-        self._loggers = loggers
 
-    def writerow(self, row):
-        for logger in self._loggers:
-            logger.writerow(row)
+def _get_block_values(run_db_id):
+    values = defaultdict(list)
+    for block_db_id, value_db_id in db.session.execute(
+        select([block_values.c.block_db_id, block_values.c.factor_value_db_id])
+        .select_from(block_values.join(Block.__table__))
+        .where(Block._run_db_id == run_db_id)
+    ):
+        values[block_db_id].append(value_db_id)
+    return values
 
 
-def xp_csv_export(experiment, target_dir):
+def started_runs_query(experiment):
+    return (
+        select([Run._db_id, Run.id, Run.next_trial_position, Run.last_completion_date])
+        .where(
+            (Run._experiment_db_id == experiment._db_id)
+            & (Run.next_trial_position > 0)
+        )
+        .order_by(Run._db_id)
+    )
 
-    # create the field list
-    trial_fields = create_trial_fields(experiment)
-    event_fields = create_event_fields(experiment)
 
-    # create the main logger
-    xp_logger = create_logger(
-        trial_fields, os.path.join(target_dir, experiment.id + ".csv")
+def _ordered_trials_query(columns, from_clause, run_db_id, start_position, end_position):
+    """Select columns from the trials of a run from start_position (included) to
+    end_position (excluded, or None), in order."""
+    condition = (Block._run_db_id == run_db_id) & (Trial.position >= start_position)
+    if end_position is not None:
+        condition &= Trial.position < end_position
+    return (
+        select(columns)
+        .select_from(from_clause.join(Block.__table__))
+        .where(condition)
+        .order_by(Block.number, Trial.number)
     )
-    # create the event logger
-    event_logger = create_logger(
-        event_fields, os.path.join(target_dir, experiment.id + "-events.csv")
+
+
+def _iter_trials(run_db_id, start_position, end_position):
+    """Yield (block db id, block number, practice, trial db id, trial number,
+    [(measure db id, value)]) for each trial of a run from start_position
+    (included) to end_position (excluded), in order."""
+    rows = db.session.execute(
+        _ordered_trials_query(
+            [
+                Block._db_id,
+                Block.number,
+                Block.practice,
+                Trial._db_id,
+                Trial.number,
+                TrialMeasureValue._measure_db_id,
+                TrialMeasureValue.value,
+            ],
+            Trial.__table__.outerjoin(TrialMeasureValue.__table__),
+            run_db_id,
+            start_position,
+            end_position,
+        )
     )
+    for _, trial_rows in groupby(rows, lambda row: row[3]):
+        trial_rows = list(trial_rows)
+        yield tuple(trial_rows[0][:5]) + (
+            [(row[5], row[6]) for row in trial_rows if row[5] is not None],
+        )
 
-    # create the directories
-    runs_dir = os.path.join(target_dir, "runs")
-    events_dir = os.path.join(target_dir, "events")
-    if not os.path.exists(runs_dir):
-        os.makedirs(runs_dir)
-    if not os.path.exists(events_dir):
-        os.makedirs(events_dir)
-
-    # log each run
-    for run in experiment.runs:
-        if run.started():
-            run_logger = create_logger(
-                trial_fields, os.path.join(runs_dir, run.id + ".csv")
+
+def _iter_trial_values(run_db_id, start_position, end_position):
+    """Yield (trial db id, [factor value db id]) in the order of _iter_trials."""
+    rows = db.session.execute(
+        _ordered_trials_query(
+            [Trial._db_id, trial_factor_values.c.factor_value_db_id],
+            Trial.__table__.join(trial_factor_values),
+            run_db_id,
+            start_position,
+            end_position,
+        )
+    )
+    for trial_db_id, trial_rows in groupby(rows, lambda row: row[0]):
+        yield trial_db_id, [row[1] for row in trial_rows]
+
+
+def _iter_events(run_db_id, start_position, end_position):
+    """Yield (trial db id, [(event number, [(measure db id, value)])]) in the
+    order of _iter_trials, for each trial that has events."""
+    rows = db.session.execute(
+        _ordered_trials_query(
+            [
+                Trial._db_id,
+                Event.number,
+                Event._db_id,
+                EventMeasureValue._measure_db_id,
+                EventMeasureValue.value,
+            ],
+            Event.__table__.outerjoin(EventMeasureValue.__table__).join(
+                Trial.__table__
+            ),
+            run_db_id,
+            start_position,
+            end_position,
+        ).order_by(Event.number)
+    )
+    for trial_db_id, trial_rows in groupby(rows, lambda row: row[0]):
+        yield trial_db_id, [
+            (event_number, [(row[3], row[4]) for row in event_rows if row[3] is not None])
+            for (event_number, _), event_rows in groupby(
+                trial_rows, lambda row: (row[1], row[2])
             )
-            run_csv_export(
-                run,
-                MultiLogger([xp_logger, run_logger]),
-                events_dir,
-                trial_fields,
-                event_fields,
-                event_logger,
+        ]
+
+
+def _merged(trials, entries, get_trial_db_id):
+    """Yield each trial with its entries, or [] for the trials without entries.
+
+    entries are (trial db id, trial entries) in the same order as trials.
+    """
+    entries = iter(entries)
+    next_entry = next(entries, None)
+    for trial in trials:
+        if next_entry is not None and next_entry[0] == get_trial_db_id(trial):
+            yield trial, next_entry[1]
+            next_entry = next(entries, None)
+        else:
+            yield trial, []
+
+
+def xp_csv_export(experiment, target_dir, jobs=1, full=False, completed_only=False):
+    """Export the trials of the started runs of experiment, and their events.
+
+    If completed_only is True, only completed trials are exported, and a manifest
+    records the trials that have been exported. Unless full is True or the
+    manifest does not match the current export, only the trials completed since
+    are then exported, and their rows appended to the existing files. Otherwise,
+    every trial is exported each time.
+    If jobs > 1, the runs are exported by a pool of jobs processes, and the
+    experiment-wide files are merged afterwards.
+    """
+    exporter = RunExporter(experiment, target_dir)
+    if not os.path.exists(exporter.runs_dir):
+        os.makedirs(exporter.runs_dir)
+    if not os.path.exists(exporter.events_dir):
+        os.makedirs(exporter.events_dir)
+
+    xp_path = os.path.join(target_dir, experiment.id + ".csv")
+    xp_events_path = os.path.join(target_dir, experiment.id + "-events.csv")
+    manifest_path = os.path.join(target_dir, MANIFEST_FILE_NAME)
+    # Snapshot the runs' progress: trials completed during the export are left
+    # for the next one.
+    runs = db.session.execute(started_runs_query(experiment)).fetchall()
+    fields = {
+        "experimentId": experiment.id,
+        "trialFields": _get_field_names(exporter.trial_fields),
+        "eventFields": _get_field_names(exporter.event_fields),
+        "completedOnly": completed_only,
+    }
+    start_positions = None
+    # Uncompleted trials may be completed later on: their rows cannot be
+    # appended to.
+    if completed_only and not full:
+        start_positions = _get_start_positions(
+            _read_manifest(manifest_path), fields, runs, exporter.runs_dir
+        )
+        if start_positions is not None and not (
+            os.path.exists(xp_path) and os.path.exists(xp_events_path)
+        ):
+            start_positions = None
+    incremental = start_positions is not None
+    if not incremental:
+        print("Full export of {}.".format(experiment.id))
+        start_positions = {}
+    # If the export is interrupted, the next one must be a full one.
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    tasks = [
+        (
+            run_db_id,
+            run_id,
+            start_positions.get(run_db_id, 0),
+            position if completed_only else None,
+        )
+        for run_db_id, run_id, position, _ in runs
+        if start_positions.get(run_db_id, 0) < position
+    ]
+    mode = "a" if incremental else "w"
+    with open(xp_path, mode, newline="") as xp_file, open(
+        xp_events_path, mode, newline=""
+    ) as xp_events_file:
+        xp_logger = create_logger(
+            exporter.trial_fields, xp_file, write_header=not incremental
+        )
+        xp_event_logger = create_logger(
+            exporter.event_fields, xp_events_file, write_header=not incremental
+        )
+        if jobs > 1 and len(tasks) > 1:
+            # Make sure the headers are written before the merged rows.
+            xp_file.flush()
+            xp_events_file.flush()
+            _parallel_export(experiment, target_dir, jobs, tasks, xp_file, xp_events_file)
+        else:
+            for task in tasks:
+                exporter.export_run(*task, xp_logger=xp_logger, xp_event_logger=xp_event_logger)
+
+    manifest = dict(fields)
+    manifest["runs"] = dict(
+        (
+            str(run_db_id),
+            {
+                "runId": run_id,
+                "position": position,
+                "lastCompletionDate": last_completion_date
+                and last_completion_date.isoformat(),
+            },
+        )
+        for run_db_id, run_id, position, last_completion_date in runs
+    )
+    _write_manifest(manifest_path, manifest)
+
+
+def _get_start_positions(manifest, fields, runs, runs_dir):
+    """Return {run db id: position of the first trial to export} for the runs
+    exported according to manifest, or None if the previous export cannot be
+    appended to."""
+    if manifest is None:
+        return None
+    if any(manifest.get(key) != value for key, value in fields.items()):
+        return None
+    exported_runs = manifest.get("runs", {})
+    start_positions = {}
+    for run_db_id, run_id, position, _ in runs:
+        exported = exported_runs.get(str(run_db_id))
+        if exported is None:
+            continue
+        # The database may have been replaced.
+        if (
+            exported["runId"] != run_id
+            or exported["position"] > position
+            or not os.path.exists(os.path.join(runs_dir, run_id + ".csv"))
+        ):
+            return None
+        start_positions[run_db_id] = exported["position"]
+    return start_positions
+
+
+def _read_manifest(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as manifest_file:
+            return json.load(manifest_file)
+    except ValueError:
+        return None
+
+
+def _write_manifest(path, manifest):
+    # Write to a temporary file first so that an interrupted write does not
+    # leave a partial manifest.
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), suffix=".tmp"
+    )
+    with os.fdopen(file_descriptor, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temp_path, path)
+
+
+def _parallel_export(experiment, target_dir, jobs, tasks, xp_file, xp_events_file):
+    """Export the runs of tasks with a pool of jobs processes, then append their
+    rows to xp_file and xp_events_file in the order of the tasks."""
+    parts_dir = tempfile.mkdtemp(prefix=".parts-", dir=target_dir)
+    # Spawned workers do not inherit the database connections of this process.
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(
+        jobs,
+        initializer=_init_worker,
+        initargs=(str(db.engine.url), experiment._db_id, target_dir),
+    )
+    try:
+        for trials_path, events_path in pool.imap(
+            _export_run_part, [(parts_dir,) + task for task in tasks]
+        ):
+            for part_path, target_file in (
+                (trials_path, xp_file),
+                (events_path, xp_events_file),
+            ):
+                with open(part_path, newline="") as part_file:
+                    shutil.copyfileobj(part_file, target_file)
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(parts_dir)
+
+
+# Exporter of the pool worker processes.
+_worker_exporter = None
+
+
+def _init_worker(database_url, experiment_db_id, target_dir):
+    global _worker_exporter
+    create_app(database_uri=database_url)
+    _worker_exporter = RunExporter(Experiment.query.get(experiment_db_id), target_dir)
+
+
+def _export_run_part(task):
+    """Export a run in a pool worker. Its rows for the experiment-wide files are
+    written to part files (without headers), whose paths are returned."""
+    parts_dir, run_db_id = task[:2]
+    trials_path = os.path.join(parts_dir, "{}.csv".format(run_db_id))
+    events_path = os.path.join(parts_dir, "{}-events.csv".format(run_db_id))
+    with open(trials_path, "w", newline="") as trials_file, open(
+        events_path, "w", newline=""
+    ) as events_file:
+        _worker_exporter.export_run(
+            *task[1:],
+            xp_logger=create_logger(
+                _worker_exporter.trial_fields, trials_file, write_header=False
+            ),
+            xp_event_logger=create_logger(
+                _worker_exporter.event_fields, events_file, write_header=False
             )
+        )
+    db.session.remove()
+    return trials_path, events_path
 
 
-def csv_export(target_dir, database_uri):
+def csv_export(target_dir, database_uri, jobs=1, full=False, completed_only=False):
     # app must be created (even if not use).
     create_app(database_uri=database_uri)
     if not os.path.exists(target_dir):
@@ -325,4 +689,4 @@ def csv_export(target_dir, database_uri):
         exp_dir = os.path.abspath(os.path.join(target_dir, experiment.id))
         if not os.path.exists(exp_dir):
             os.makedirs(exp_dir)
-        xp_csv_export(experiment, exp_dir)
+        xp_csv_export(experiment, exp_dir, jobs, full, completed_only)
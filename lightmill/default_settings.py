@@ -2,9 +2,43 @@ __author__ = "Quentin Roy"
 
 import os
 
-DATABASE_URI = (
-    os.environ["LIGHTMILL_DB_URI"]
+# A database URL (e.g. postgresql://user@localhost/lightmill) or an SQLite file
+# path. LIGHTMILL_DB_URI is the former name of LIGHTMILL_DATABASE_URL.
+DATABASE_URL = (
+    os.environ["LIGHTMILL_DATABASE_URL"]
+    if "LIGHTMILL_DATABASE_URL" in os.environ
+    else os.environ["LIGHTMILL_DB_URI"]
     if "LIGHTMILL_DB_URI" in os.environ
     else "experiments.db"
 )
 SERVER_PORT = 5000
+STORAGE_PROFILE = (
+    os.environ["LIGHTMILL_STORAGE_PROFILE"]
+    if "LIGHTMILL_STORAGE_PROFILE" in os.environ
+    else "safe"
+)
+# Connection pool settings. None uses SQLAlchemy's default.
+POOL_SIZE = (
+    int(os.environ["LIGHTMILL_POOL_SIZE"]) if "LIGHTMILL_POOL_SIZE" in os.environ else None
+)
+POOL_MAX_OVERFLOW = (
+    int(os.environ["LIGHTMILL_POOL_MAX_OVERFLOW"])
+    if "LIGHTMILL_POOL_MAX_OVERFLOW" in os.environ
+    else None
+)
+POOL_RECYCLE = (
+    int(os.environ["LIGHTMILL_POOL_RECYCLE"])
+    if "LIGHTMILL_POOL_RECYCLE" in os.environ
+    else None
+)
+POOL_PRE_PING = os.environ.get("LIGHTMILL_POOL_PRE_PING", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Responses larger than this number of bytes are compressed with gzip if the
+# client accepts it. Streamed responses are always compressed. 0 disables
+# compression.
+COMPRESSION_MIN_SIZE = int(os.environ.get("LIGHTMILL_COMPRESSION_MIN_SIZE", 1024))
+# From 1 (fastest) to 9 (smallest).
+COMPRESSION_LEVEL = int(os.environ.get("LIGHTMILL_COMPRESSION_LEVEL", 6))
@@ -0,0 +1,69 @@
+__author__ = "Quentin Roy"
+
+from sqlalchemy import select
+from .model import db, Event, TrialMeasureValue, EventMeasureValue
+
+# Number of events inserted per executemany batch.
+EVENT_CHUNK_SIZE = 1000
+
+_event_table = Event.__table__
+_trial_value_table = TrialMeasureValue.__table__
+_event_value_table = EventMeasureValue.__table__
+
+
+def record_trial_results(trial, trial_values, events_values, chunk_size=EVENT_CHUNK_SIZE):
+    """Write the measure values and the events of a trial with set-based inserts.
+
+    trial_values is an iterable of (measure db id, value) pairs. events_values is
+    an iterable yielding one iterable of such pairs per event, in event order.
+    Rows are inserted in the current transaction: it is up to the caller to
+    commit it.
+    """
+    # Make sure the trial has an id.
+    db.session.flush()
+    trial_db_id = trial._db_id
+
+    rows = [
+        {"_trial_db_id": trial_db_id, "_measure_db_id": measure_db_id, "value": value}
+        for measure_db_id, value in trial_values
+    ]
+    if rows:
+        db.session.execute(_trial_value_table.insert(), rows)
+
+    chunk = []
+    event_num = 0
+    for event_values in events_values:
+        chunk.append((event_num, list(event_values)))
+        event_num += 1
+        if len(chunk) >= chunk_size:
+            _insert_events(trial_db_id, chunk)
+            chunk = []
+    if chunk:
+        _insert_events(trial_db_id, chunk)
+
+
+def _insert_events(trial_db_id, chunk):
+    db.session.execute(
+        _event_table.insert(),
+        [{"_trial_db_id": trial_db_id, "number": number} for number, _ in chunk],
+    )
+    event_db_ids = dict(
+        (number, event_db_id)
+        for event_db_id, number in db.session.execute(
+            select([_event_table.c._db_id, _event_table.c.number]).where(
+                (_event_table.c._trial_db_id == trial_db_id)
+                & (_event_table.c.number.between(chunk[0][0], chunk[-1][0]))
+            )
+        )
+    )
+    rows = [
+        {
+            "_event_db_id": event_db_ids[number],
+            "_measure_db_id": measure_db_id,
+            "value": value,
+        }
+        for number, values in chunk
+        for measure_db_id, value in values
+    ]
+    if rows:
+        db.session.execute(_event_value_table.insert(), rows)
@@ -0,0 +1,201 @@
+__author__ = "Quentin Roy"
+
+import os
+import json
+import time
+import traceback
+import gevent
+from gevent.event import Event
+from collections import deque
+from datetime import datetime
+from .model import db, Trial, ExperimentProgressError
+from .blueprints.api.trial import record_measures
+
+_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+class TrialJournal(object):
+    """Append-only journal of trial results.
+
+    Results are acknowledged as soon as they are written and synced to the
+    journal file. A background greenlet then applies them to the database, several
+    entries per transaction. Entries are applied in order, and entries whose trial
+    is already completed are skipped so that the journal can be replayed safely
+    (e.g. after a crash).
+
+    The server is not monkey patched: the journal's state is only used from
+    greenlets, and file syncs and database transactions run in the hub's thread
+    pool so that they do not block other requests.
+    """
+
+    def __init__(self, path, app, batch_size=100, interval=0.1):
+        self.path = os.path.abspath(path)
+        self._app = app
+        self._batch_size = batch_size
+        self._interval = interval
+        self._wake_up = Event()
+        # Set (and replaced) each time a batch of entries has been processed.
+        self._batch_processed = Event()
+        self._queue = deque()
+        self._pending = set()
+        self._appended = 0
+        self._applied = 0
+        self._failed = []
+        self._greenlet = None
+        self._file = None
+
+    def start(self):
+        """Replay the journal, then start applying new entries in the background."""
+        self.replay()
+        self._file = open(self.path, "a")
+        self._greenlet = gevent.spawn(self._run)
+
+    def replay(self):
+        """Apply the entries left in the journal file by a previous server."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as journal_file:
+            lines = journal_file.readlines()
+        entries = []
+        for line_num, line in enumerate(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # The last entry may have been interrupted while written. It has
+                # not been acknowledged.
+                if line_num != len(lines) - 1:
+                    raise
+        if not entries:
+            return
+        print("Replaying {} journal entries...".format(len(entries)))
+        self._appended += len(entries)
+        self._queue.extend((entry, time.time()) for entry in entries)
+        while self._queue:
+            self._apply_next_batch()
+        self._truncate_if_drained()
+
+    def is_pending(self, trial):
+        return trial._db_id in self._pending
+
+    def append(self, trial, trial_measures, events_measures):
+        """Append the results of a trial to the journal and sync it to disk."""
+        entry = {
+            "experiment": trial.experiment.id,
+            "run": trial.run.id,
+            "block": trial.block.number,
+            "trial": trial.number,
+            "trialDbId": trial._db_id,
+            "date": datetime.today().strftime(_DATE_FORMAT),
+            "measures": {"trial": trial_measures, "events": events_measures},
+        }
+        line = json.dumps(entry) + "\n"
+        if trial._db_id in self._pending:
+            raise ExperimentProgressError("Trial already completed.")
+        # Entries are queued in the order they are written.
+        self._file.write(line)
+        self._file.flush()
+        self._pending.add(trial._db_id)
+        self._queue.append((entry, time.time()))
+        self._appended += 1
+        self._wake_up.set()
+        # Concurrent appends wait for their syncs together.
+        _run_in_thread(os.fsync, self._file.fileno())
+
+    def wait_drained(self):
+        """Wait until every entry appended so far has been applied."""
+        target = self._appended
+        self._wake_up.set()
+        while self._applied + len(self._failed) < target:
+            self._batch_processed.wait()
+
+    def status(self):
+        oldest = self._queue[0][1] if self._queue else None
+        return {
+            "path": self.path,
+            "appended": self._appended,
+            "applied": self._applied,
+            "failed": len(self._failed),
+            "lag": len(self._queue),
+            "oldestPendingAge": time.time() - oldest if oldest else 0,
+        }
+
+    def _run(self):
+        while True:
+            self._wake_up.wait(self._interval)
+            self._wake_up.clear()
+            while self._queue:
+                self._apply_next_batch()
+            self._truncate_if_drained()
+
+    def _apply_next_batch(self):
+        batch = [
+            self._queue[i][0] for i in range(min(self._batch_size, len(self._queue)))
+        ]
+        failed = _run_in_thread(self._apply_batch, batch)
+        for entry in batch:
+            self._queue.popleft()
+            self._pending.discard(entry.get("trialDbId"))
+        self._applied += len(batch) - len(failed)
+        self._failed.extend(failed)
+        batch_processed, self._batch_processed = self._batch_processed, Event()
+        batch_processed.set()
+
+    def _apply_batch(self, batch):
+        """Apply batch to the database and return the entries that failed."""
+        with self._app.app_context():
+            try:
+                for entry in batch:
+                    _apply_entry(entry)
+                db.session.commit()
+                failed = []
+            except Exception:
+                db.session.rollback()
+                failed = self._apply_one_by_one(batch)
+            finally:
+                db.session.remove()
+        return failed
+
+    def _apply_one_by_one(self, entries):
+        failed = []
+        for entry in entries:
+            try:
+                _apply_entry(entry)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                print(
+                    "Cannot apply journal entry for trial {trial} of block {block}"
+                    " (run {run} of {experiment}):".format(**entry)
+                )
+                traceback.print_exc()
+                failed.append(entry)
+        return failed
+
+    def _truncate_if_drained(self):
+        # Failed entries are kept in the journal file so that they are not lost.
+        if self._queue or self._failed:
+            return
+        if self._file is None:
+            open(self.path, "w").close()
+        elif self._file.tell() > 0:
+            self._file.seek(0)
+            self._file.truncate()
+            self._file.flush()
+            _run_in_thread(os.fsync, self._file.fileno())
+
+
+def _run_in_thread(func, *args):
+    """Call func in the hub's thread pool and wait for its result without blocking
+    other greenlets."""
+    return gevent.get_hub().threadpool.apply(func, args)
+
+
+def _apply_entry(entry):
+    trial = Trial.query.get_by_number(
+        entry["trial"], entry["block"], entry["run"], entry["experiment"]
+    )
+    # The entry has already been applied.
+    if trial.completed:
+        return
+    trial.set_completed(datetime.strptime(entry["date"], _DATE_FORMAT))
+    record_measures(trial, entry["measures"]["trial"], entry["measures"]["events"])
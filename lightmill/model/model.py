@@ -1,5 +1,8 @@
 __author__ = "Quentin Roy"
 
+import json
+import itertools
+from sqlalchemy import event
 from sqlalchemy.orm.exc import NoResultFound
 from flask_sqlalchemy import SQLAlchemy, BaseQuery
 from datetime import datetime
@@ -35,6 +38,9 @@ class Experiment(db.Model):
     name = db.Column(db.String(200))
     author = db.Column(db.String(200), nullable=True)
     description = db.Column(db.Text, nullable=True)
+    # Incremented each time the experiment, its factors, measures or list of
+    # runs change.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
 
     factors = db.relationship(
         "Factor",
@@ -69,6 +75,44 @@ class Experiment(db.Model):
     def get_run(self, run_id):
         return self.runs.filter_by(id=run_id).one()
 
+    def free_runs(self):
+        """Return the query of the runs that are neither locked nor started."""
+        return self.runs.filter(
+            Run.token.is_(None), Run.next_trial_position == 0
+        ).order_by(Run._db_id)
+
+    def allocate_run(self, token, attempts=5):
+        """Lock the first free run of the experiment with token.
+
+        The run is picked and locked in a single statement so that concurrent
+        allocations cannot get the same run. Return the run, or None if there
+        is no free run.
+        """
+        free_run_db_id = (
+            db.session.query(Run._db_id)
+            .filter(
+                Run._experiment_db_id == self._db_id,
+                Run.token.is_(None),
+                Run.next_trial_position == 0,
+            )
+            .order_by(Run._db_id)
+            .limit(1)
+            .subquery()
+        )
+        for _ in range(attempts):
+            result = db.session.execute(
+                Run.__table__.update()
+                .where(Run._db_id.in_(free_run_db_id) & Run.token.is_(None))
+                .values(token=token, version=Run.version + 1)
+            )
+            if result.rowcount == 1:
+                return Run.query.filter(Run.token == token).one()
+            # A concurrent allocation may have locked the run picked by the
+            # statement before it could (depending on the database's isolation).
+            if not db.session.query(self.free_runs().exists()).scalar():
+                return None
+        return None
+
     def trial_measures(self):
         return self.measures.filter_by(trial_level=True)
 
@@ -97,6 +141,19 @@ class Run(db.Model):
 
     token = db.Column(db.String(50), unique=True)
 
+    # Position of the first uncompleted trial of the run, i.e. its number of
+    # completed trials.
+    next_trial_position = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    # Progress counters, maintained as blocks and trials are created and
+    # completed.
+    trial_total = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    block_total = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    last_completion_date = db.Column(db.DateTime)
+    # Incremented each time the run or its blocks change.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
     experiment = db.relationship(
         Experiment,
         backref=db.backref("runs", lazy="dynamic", cascade="all, delete-orphan"),
@@ -106,11 +163,18 @@ class Run(db.Model):
     __table_args__ = (
         db.UniqueConstraint("_experiment_db_id", "id"),
         db.Index("index_xp_runs", "_experiment_db_id"),
+        # Free runs lookup.
+        db.Index(
+            "index_xp_run_allocation", "_experiment_db_id", "token", "next_trial_position"
+        ),
     )
 
     def __init__(self, id, experiment):
         self.id = id
         self.experiment = experiment
+        self.next_trial_position = 0
+        self.trial_total = 0
+        self.block_total = 0
 
     @property
     def locked(self):
@@ -125,8 +189,84 @@ class Run(db.Model):
             .filter(Block.run == self)
         )
 
+    def lock(self, token, force=False):
+        """Lock the run with token if it is not locked already (or anyway if force
+        is True).
+
+        The check and the update are made in a single statement. Return True on
+        success.
+        """
+        condition = Run._db_id == self._db_id
+        if not force:
+            condition &= Run.token.is_(None)
+        return self._set_token(condition, token)
+
+    def unlock(self, token=None):
+        """Unlock the run if it is locked with token (or whatever its token if
+        token is None).
+
+        The check and the update are made in a single statement. Return True on
+        success.
+        """
+        condition = Run._db_id == self._db_id
+        condition &= Run.token.isnot(None) if token is None else Run.token == token
+        return self._set_token(condition, None)
+
+    def _set_token(self, condition, token):
+        result = db.session.execute(
+            Run.__table__.update()
+            .where(condition)
+            .values(token=token, version=Run.version + 1)
+        )
+        db.session.expire(self, ["token", "version"])
+        return result.rowcount == 1
+
+    def get_trial_at(self, position):
+        return (
+            Trial.query.join(Block)
+            .filter(Block._run_db_id == self._db_id, Trial.position == position)
+            .one_or_none()
+        )
+
     def current_trial(self):
-        return self.trials.filter(Trial.completion_date.is_(None)).first()
+        return self.get_trial_at(self.next_trial_position)
+
+    def upcoming_trials(self, count):
+        """Return the count first uncompleted trials of the run, in order."""
+        position = self.next_trial_position
+        return (
+            Trial.query.join(Block)
+            .filter(
+                Block._run_db_id == self._db_id,
+                Trial.position >= position,
+                Trial.position < position + count,
+            )
+            .order_by(Trial.position)
+            .all()
+        )
+
+    def advance(self, position, count=1, completion_date=None):
+        """Mark count trials as completed from position.
+
+        This only succeeds if position is the position of the run's first
+        uncompleted trial. The check and the update are made in a single
+        statement. Return True on success.
+        """
+        result = db.session.execute(
+            Run.__table__.update()
+            .where(
+                (Run._db_id == self._db_id) & (Run.next_trial_position == position)
+            )
+            .values(
+                next_trial_position=position + count,
+                last_completion_date=completion_date or datetime.today(),
+                version=Run.version + 1,
+            )
+        )
+        db.session.expire(
+            self, ["next_trial_position", "last_completion_date", "version"]
+        )
+        return result.rowcount == 1
 
     def __repr__(self):
         return "<{} {} (experiment id: {}, token: {})>".format(
@@ -137,21 +277,16 @@ class Run(db.Model):
         )
 
     def completed(self):
-        exist_query = self.trials.filter(Trial.completion_date.is_(None)).exists()
-        session_query = db.session.query(exist_query)
-        completed = not session_query.scalar()
-        return completed
+        return self.next_trial_position >= self.trial_total
 
     def started(self):
-        exist_query = self.trials.filter(Trial.completion_date.isnot(None)).exists()
-        started = db.session.query(exist_query).scalar()
-        return started
+        return self.next_trial_position > 0
 
     def trial_count(self):
-        return self.trials.count()
+        return self.trial_total
 
     def block_count(self):
-        return self.blocks.count()
+        return self.block_total
 
     def get_block(self, block_number):
         return self.blocks.filter(Block.number == block_number).one()
@@ -222,6 +357,9 @@ class Block(db.Model):
     )
 
     number = db.Column(db.Integer, nullable=False)
+    # Number of the block among the run's blocks that are not practice blocks.
+    # None for practice blocks.
+    measured_number = db.Column(db.Integer)
     practice = db.Column(db.Boolean)
     factor_values = db.relationship(
         "FactorValue", secondary=block_values, lazy="joined"
@@ -230,6 +368,7 @@ class Block(db.Model):
     __table_args__ = (
         db.UniqueConstraint("_run_db_id", "number"),
         db.Index("index_run_blocks", "_run_db_id"),
+        db.Index("index_run_measured_blocks", "_run_db_id", "measured_number"),
     )
 
     @property
@@ -237,14 +376,29 @@ class Block(db.Model):
         return self.run.experiment if self.run is not None else None
 
     def __init__(self, run, values, number=None, practice=False):
+        run_blocks = list(run.blocks)
         self.practice = practice
         self.number = (
             number
             if number is not None
-            else _free_number(block.number for block in run.blocks)
+            else _free_number(block.number for block in run_blocks)
         )
+        self.measured_number = None
+        if not practice:
+            self.measured_number = 0
+            for block in run_blocks:
+                if block.practice:
+                    continue
+                if block.number < self.number:
+                    self.measured_number += 1
+                else:
+                    # The block is inserted before this one.
+                    block.measured_number += 1
+                    for trial in block.trials:
+                        trial.update_static_info()
         self.run = run
         self.factor_values = values
+        run.block_total += 1
 
     def __repr__(self):
         return "<{} {} (run id: {}, experiment id: {}>".format(
@@ -257,13 +411,7 @@ class Block(db.Model):
         )
 
     def measured_block_number(self):
-        if not self.practice:
-            i = 0
-            for block in self.run.blocks.order_by(Block.number):
-                if block is self:
-                    return i
-                elif not block.practice:
-                    i += 1
+        return self.measured_number
 
     def length(self):
         return self.trials.count()
@@ -314,7 +462,14 @@ class Trial(db.Model):
         "FactorValue", secondary=trial_factor_values, lazy="joined"
     )
     number = db.Column(db.Integer, nullable=False)
+    # Position of the trial in its run.
+    position = db.Column(db.Integer, nullable=False)
     completion_date = db.Column(db.DateTime)
+    # Incremented each time the trial changes (e.g. when it is completed).
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # JSON serialization of the part of the trial's info that does not change
+    # once imported (see update_static_info).
+    static_info = db.Column(db.Text)
     measure_values = db.relationship(
         "TrialMeasureValue",
         cascade="all, delete-orphan",
@@ -333,43 +488,31 @@ class Trial(db.Model):
     __table_args__ = (
         db.UniqueConstraint("number", "_block_db_id"),
         db.Index("index_block_trials", "_block_db_id"),
+        db.Index("index_block_trial_positions", "_block_db_id", "position"),
     )
 
     @property
     def completed(self):
         return self.completion_date is not None
 
-    def set_completed(self):
-        previous = self.previous()
-        if self.completed:
-            raise ExperimentProgressError("Trial already completed.")
-        if previous is not None and not previous.completed:
+    def set_completed(self, completion_date=None):
+        run = self.run
+        completion_date = completion_date or datetime.today()
+        if not run.advance(self.position, completion_date=completion_date):
+            if self.position < run.next_trial_position:
+                raise ExperimentProgressError("Trial already completed.")
             raise ExperimentProgressError(
                 "Cannot complete trial {}: previous trial is not completed yet. "
                 "Trials must be completed sequentially.".format(repr(self))
             )
-        self.completion_date = datetime.today()
+        self.completion_date = completion_date
 
     def previous(self):
-        if self.number > 0:
-            return Trial.query.get_by_number(
-                self.number - 1, self.block.number, self.run.id, self.experiment.id
-            )
-        elif self.block.number > 0:
-            block = Block.query.get_by_number(
-                self.block.number - 1, self.run.id, self.experiment.id
-            )
-            return block.trials.filter(Trial.number == block.length() - 1).one()
+        if self.position > 0:
+            return self.run.get_trial_at(self.position - 1)
 
     def next(self):
-        if self.number + 1 < self.block.length():
-            return Trial.query.get_by_number(
-                self.number + 1, self.block.number, self.run.id, self.experiment.id
-            )
-        elif self.block.number + 1 < self.run.block_count():
-            return Trial.query.get_by_number(
-                0, self.block.number + 1, self.run.id, self.experiment.id
-            )
+        return self.run.get_trial_at(self.position + 1)
 
     @property
     def experiment(self):
@@ -392,14 +535,45 @@ class Trial(db.Model):
             if factor.default_value:
                 yield factor.default_value
 
-    def __init__(self, block, values, number=None):
+    def __init__(self, block, values, number=None, position=None):
         self.number = (
             number
             if number is not None
             else _free_number(trial.number for trial in block.trials)
         )
+        # By default, the trial is appended at the end of its run.
+        self.position = position if position is not None else block.run.trial_total
         self.block = block
         self.factor_values = values
+        block.run.trial_total += 1
+        self.update_static_info()
+
+    def update_static_info(self):
+        """Serialize the trial's configuration: everything but its completion date
+        and measures."""
+        block = self.block
+        run = block.run
+        default_values = (
+            factor.default_value
+            for factor in run.experiment.factors
+            if factor.default_value
+        )
+        self.static_info = json.dumps(
+            {
+                "experimentId": run.experiment.id,
+                "runId": run.id,
+                "number": self.number,
+                "blockNumber": block.number,
+                "measuredBlockNumber": block.measured_number,
+                "factorValues": dict(
+                    (value.factor.id, value.id)
+                    for value in itertools.chain(
+                        default_values, block.factor_values, self.factor_values
+                    )
+                ),
+                "practice": block.practice,
+            }
+        )
 
     def record_measure_value(self, measure_id, value):
         measure = Measure.query.get_by_id(measure_id, self.experiment.id)
@@ -669,3 +843,32 @@ class EventMeasureValue(MeasureValue):
                 )
             )
 
+
+def _versioned_owners(instance, is_new_or_deleted):
+    """Yield the instances whose version must be incremented when instance
+    changes."""
+    if isinstance(instance, (Experiment, Run, Trial)) and not is_new_or_deleted:
+        yield instance
+    if isinstance(instance, (Measure, Factor)) or (
+        isinstance(instance, Run) and is_new_or_deleted
+    ):
+        yield instance.experiment
+    elif isinstance(instance, Block) or (
+        isinstance(instance, Trial) and is_new_or_deleted
+    ):
+        yield instance.run
+
+
+@event.listens_for(db.session, "before_flush")
+def _increment_versions(session, flush_context, instances):
+    owners = set()
+    for instance in session.dirty:
+        if session.is_modified(instance):
+            owners.update(_versioned_owners(instance, False))
+    for instance in itertools.chain(session.new, session.deleted):
+        owners.update(_versioned_owners(instance, True))
+    # New instances get the default version.
+    owners.difference_update(session.new, session.deleted, [None])
+    for owner in owners:
+        # Use an SQL expression so that concurrent increments are not lost.
+        owner.version = type(owner).version + 1
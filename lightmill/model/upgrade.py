@@ -0,0 +1,178 @@
+__author__ = "Quentin Roy"
+
+from itertools import groupby
+from sqlalchemy import inspect, select, func
+from sqlalchemy.schema import CreateColumn, DefaultClause
+from .model import db, Run, Block, Trial
+
+_backfills = []
+_placeholders = {}
+
+
+def _backfill(table, column, placeholder=None):
+    """Register a function that fills up a column added to an existing database.
+
+    Existing rows must have a value for columns that are not nullable: they are
+    set to placeholder when the column is added, until the function runs.
+    """
+
+    def decorator(func):
+        _backfills.append(((table, column), func))
+        if placeholder is not None:
+            _placeholders[(table, column)] = placeholder
+        return func
+
+    return decorator
+
+
+def upgrade_database():
+    """Add the columns and indexes missing from a database created by a previous
+    version of LightMill, and fill them up."""
+    engine = db.engine
+    inspector = inspect(engine)
+    added_columns = set()
+    for table in db.metadata.sorted_tables:
+        existing_columns = set(column["name"] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing_columns:
+                print("Adding column {} to table {}...".format(column.name, table.name))
+                added_column = column
+                placeholder = _placeholders.get((table.name, column.name))
+                if placeholder is not None:
+                    added_column = column.copy()
+                    added_column.server_default = DefaultClause(placeholder)
+                engine.execute(
+                    "ALTER TABLE {} ADD COLUMN {}".format(
+                        table.name,
+                        CreateColumn(added_column).compile(dialect=engine.dialect),
+                    )
+                )
+                added_columns.add((table.name, column.name))
+        existing_indexes = set(index["name"] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(engine)
+    for key, backfill in _backfills:
+        if key in added_columns:
+            backfill()
+            db.session.commit()
+
+
+@_backfill("trial", "position", placeholder="0")
+def _fill_trial_positions():
+    trials = db.session.execute(
+        select([Block._run_db_id, Trial._db_id, Trial.completion_date])
+        .select_from(Trial.__table__.join(Block.__table__))
+        .order_by(Block._run_db_id, Block.number, Trial.number)
+    )
+    trial_rows = []
+    run_rows = []
+    for run_db_id, run_trials in groupby(trials, lambda row: row[0]):
+        completed_count = 0
+        for position, (_, trial_db_id, completion_date) in enumerate(run_trials):
+            trial_rows.append({"trial_db_id": trial_db_id, "position": position})
+            if completion_date is not None:
+                completed_count = position + 1
+        run_rows.append({"run_db_id": run_db_id, "next_position": completed_count})
+    if trial_rows:
+        db.session.execute(
+            Trial.__table__.update()
+            .where(Trial._db_id == db.bindparam("trial_db_id"))
+            .values(position=db.bindparam("position")),
+            trial_rows,
+        )
+    if run_rows:
+        db.session.execute(
+            Run.__table__.update()
+            .where(Run._db_id == db.bindparam("run_db_id"))
+            .values(next_trial_position=db.bindparam("next_position")),
+            run_rows,
+        )
+
+
+@_backfill("block", "measured_number")
+def _fill_measured_block_numbers():
+    blocks = db.session.execute(
+        select([Block._run_db_id, Block._db_id, Block.practice]).order_by(
+            Block._run_db_id, Block.number
+        )
+    )
+    block_rows = []
+    for _, run_blocks in groupby(blocks, lambda row: row[0]):
+        measured_number = 0
+        for _, block_db_id, practice in run_blocks:
+            if not practice:
+                block_rows.append(
+                    {"block_db_id": block_db_id, "measured_number": measured_number}
+                )
+                measured_number += 1
+    if block_rows:
+        db.session.execute(
+            Block.__table__.update()
+            .where(Block._db_id == db.bindparam("block_db_id"))
+            .values(measured_number=db.bindparam("measured_number")),
+            block_rows,
+        )
+
+
+@_backfill("run", "trial_total")
+def _fill_run_counters():
+    block_counts = (
+        select([Block._run_db_id.label("run_db_id"), func.count().label("count")])
+        .group_by(Block._run_db_id)
+        .alias()
+    )
+    trial_counts = (
+        select(
+            [
+                Block._run_db_id.label("run_db_id"),
+                func.count().label("count"),
+                func.max(Trial.completion_date).label("last_completion_date"),
+            ]
+        )
+        .select_from(Trial.__table__.join(Block.__table__))
+        .group_by(Block._run_db_id)
+        .alias()
+    )
+    counters = db.session.execute(
+        select(
+            [
+                Run._db_id,
+                block_counts.c.count,
+                trial_counts.c.count,
+                trial_counts.c.last_completion_date,
+            ]
+        ).select_from(
+            Run.__table__.outerjoin(
+                block_counts, block_counts.c.run_db_id == Run._db_id
+            ).outerjoin(trial_counts, trial_counts.c.run_db_id == Run._db_id)
+        )
+    )
+    run_rows = [
+        {
+            "run_db_id": run_db_id,
+            "block_total": block_total or 0,
+            "trial_total": trial_total or 0,
+            "last_completion_date": last_completion_date,
+        }
+        for run_db_id, block_total, trial_total, last_completion_date in counters
+    ]
+    if run_rows:
+        db.session.execute(
+            Run.__table__.update()
+            .where(Run._db_id == db.bindparam("run_db_id"))
+            .values(
+                block_total=db.bindparam("block_total"),
+                trial_total=db.bindparam("trial_total"),
+                last_completion_date=db.bindparam("last_completion_date"),
+            ),
+            run_rows,
+        )
+
+
+@_backfill("trial", "static_info")
+def _fill_trial_static_info():
+    for run in Run.query:
+        for trial in run.trials:
+            trial.update_static_info()
+        db.session.flush()
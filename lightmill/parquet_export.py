@@ -0,0 +1,225 @@
+__author__ = "Quentin Roy"
+
+from .app import create_app
+from .csv_export import RunExporter, started_runs_query
+from .model import db, Experiment, TrialMeasureValue, EventMeasureValue
+import os
+from collections import defaultdict
+from sqlalchemy import select
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+# Number of rows buffered before being written as a row group.
+ROW_GROUP_SIZE = 50000
+
+
+def is_available():
+    """Return True if Parquet exports are available (i.e. pyarrow is
+    installed)."""
+    return pyarrow is not None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        float_value = float(value)
+        if not float_value.is_integer():
+            raise
+        return int(float_value)
+
+
+def _to_bool(value):
+    lower_value = str(value).lower()
+    if lower_value in ("true", "1"):
+        return True
+    if lower_value in ("false", "0"):
+        return False
+    raise ValueError("Not a boolean: {}".format(value))
+
+
+# Converters and arrow type names, by touchstone type.
+_TYPES = {
+    "integer": (_to_int, "int64"),
+    "int": (_to_int, "int64"),
+    "float": (float, "float64"),
+    "double": (float, "float64"),
+    "real": (float, "float64"),
+    "number": (float, "float64"),
+    "boolean": (_to_bool, "bool_"),
+    "bool": (_to_bool, "bool_"),
+}
+_STRING_TYPE = (str, "string")
+
+_HEADER_TYPES = {
+    u"Experiment Name": _STRING_TYPE,
+    u"Run Id": _STRING_TYPE,
+    u"Block Number": (int, "int64"),
+    u"Trial Number": (int, "int64"),
+    u"Event Number": (int, "int64"),
+    u"Practice": (bool, "bool_"),
+}
+
+
+def _get_column_types(fields, factor_labels, mistyped_measures):
+    """Return [(column name, converter, arrow type name)] for fields.
+
+    The type of factors is only used if all their values can be converted. The
+    type of measures is not used if they are in mistyped_measures.
+    """
+    columns = []
+    for field in fields["header"].values():
+        columns.append((field["final_name"],) + _HEADER_TYPES[field["final_name"]])
+    for factor_id, field in fields["factor"].items():
+        converter, type_name = _TYPES.get(
+            (field["original_field"].type or "").lower(), _STRING_TYPE
+        )
+        try:
+            for label in factor_labels[factor_id]:
+                converter(label)
+        except ValueError:
+            converter, type_name = _STRING_TYPE
+        columns.append((field["final_name"], converter, type_name))
+    for measure_id, field in fields["measure"].items():
+        if measure_id in mistyped_measures:
+            converter, type_name = _STRING_TYPE
+        else:
+            converter, type_name = _get_measure_type(field["original_field"])
+        columns.append((field["final_name"], converter, type_name))
+    return columns
+
+
+def _get_measure_type(measure):
+    return _TYPES.get((measure.type or "").lower(), _STRING_TYPE)
+
+
+def _get_mistyped_measures(experiment, value_model):
+    """Return the ids of the measures of experiment with values (of value_model)
+    that cannot be converted to their type."""
+    converters = {}
+    for measure in experiment.measures.values():
+        converter, type_name = _get_measure_type(measure)
+        if type_name != _STRING_TYPE[1]:
+            converters[measure._db_id] = (measure.id, converter)
+    mistyped_measures = set()
+    if not converters:
+        return mistyped_measures
+    table = value_model.__table__
+    for measure_db_id, value in db.session.execute(
+        select([table.c._measure_db_id, table.c.value])
+        .where(table.c._measure_db_id.in_(list(converters)))
+        .distinct()
+    ):
+        measure_id, converter = converters[measure_db_id]
+        if measure_id in mistyped_measures:
+            continue
+        try:
+            converter(value)
+        except ValueError:
+            mistyped_measures.add(measure_id)
+    return mistyped_measures
+
+
+class _ParquetRowWriter(object):
+    """Write rows to a Parquet file, ROW_GROUP_SIZE rows at a time."""
+
+    def __init__(self, target, columns):
+        self.columns = columns
+        self.schema = pyarrow.schema(
+            [(name, getattr(pyarrow, type_name)()) for name, _, type_name in columns]
+        )
+        self.buffers = [[] for _ in columns]
+        self._writer = parquet.ParquetWriter(target, self.schema)
+
+    def write(self, row):
+        for (name, converter, _), buffer in zip(self.columns, self.buffers):
+            value = row.get(name)
+            buffer.append(None if value is None else converter(value))
+        if len(self.buffers[0]) >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffers[0]:
+            return
+        self._writer.write_table(
+            pyarrow.Table.from_arrays(
+                [
+                    pyarrow.array(buffer, type=column_type)
+                    for buffer, column_type in zip(self.buffers, self.schema.types)
+                ],
+                schema=self.schema,
+            )
+        )
+        self.buffers = [[] for _ in self.columns]
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+def write_parquet(experiment, trials_target=None, events_target=None):
+    """Write the trials of the started runs of experiment to trials_target and
+    their events to events_target. Targets are file paths or binary file objects.
+    """
+    if not is_available():
+        raise RuntimeError("Parquet exports require pyarrow.")
+    exporter = RunExporter(experiment)
+    factor_labels = defaultdict(list)
+    for factor_id, label in exporter.value_labels.values():
+        factor_labels[factor_id].append(label)
+    writers = []
+    trial_writer = event_writer = None
+    if trials_target is not None:
+        trial_writer = _ParquetRowWriter(
+            trials_target,
+            _get_column_types(
+                exporter.trial_fields,
+                factor_labels,
+                _get_mistyped_measures(experiment, TrialMeasureValue),
+            ),
+        )
+        writers.append(trial_writer)
+    if events_target is not None:
+        event_writer = _ParquetRowWriter(
+            events_target,
+            _get_column_types(
+                exporter.event_fields,
+                factor_labels,
+                _get_mistyped_measures(experiment, EventMeasureValue),
+            ),
+        )
+        writers.append(event_writer)
+    try:
+        for run_db_id, run_id, _, _ in db.session.execute(
+            started_runs_query(experiment)
+        ).fetchall():
+            for trial_row, event_rows in exporter.iter_rows(
+                run_db_id, run_id, 0, None, convert=lambda value: value
+            ):
+                if trial_writer is not None:
+                    trial_writer.write(trial_row)
+                if event_writer is not None:
+                    for event_row in event_rows:
+                        event_writer.write(event_row)
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+def parquet_export(target_dir, database_uri):
+    # app must be created (even if not use).
+    create_app(database_uri=database_uri)
+    for experiment in Experiment.query.order_by(Experiment.id).all():
+        exp_dir = os.path.abspath(os.path.join(target_dir, experiment.id))
+        if not os.path.exists(exp_dir):
+            os.makedirs(exp_dir)
+        print("Export {}...".format(experiment.id))
+        write_parquet(
+            experiment,
+            os.path.join(exp_dir, experiment.id + ".parquet"),
+            os.path.join(exp_dir, experiment.id + "-events.parquet"),
+        )
@@ -0,0 +1,246 @@
+__author__ = "Quentin Roy"
+
+import os
+import json
+import hashlib
+import tempfile
+from collections import defaultdict
+from flask import current_app as app
+from sqlalchemy import select
+from .model import db, Block, Trial, Factor, FactorValue
+from .model import block_values, trial_factor_values
+
+# Compiled run plans, by run database id.
+_run_plans = {}
+
+
+class RunPlan(object):
+    """The blocks and trials of a run, serialized once.
+
+    A run's plan does not change after import except for the completion dates
+    of its trials, which are spliced in when the plan is rendered, and the
+    blocks and trials added by updating the experiment, which change its run
+    counters.
+    """
+
+    def __init__(self, experiment_id, run_id, blocks, fingerprint=None):
+        self.experiment_id = experiment_id
+        self.run_id = run_id
+        # Fingerprint of the trials the plan has been compiled from (see
+        # get_run_fingerprint).
+        self.fingerprint = fingerprint
+        # List of (block JSON head, list of trial JSON heads). The heads are
+        # JSON objects missing their last member and closing brace.
+        self.blocks = blocks
+        self.digest = hashlib.sha1(
+            json.dumps(blocks, separators=(",", ":")).encode("utf8")
+        ).hexdigest()
+
+    def matches(self, run):
+        return (
+            self.experiment_id == run.experiment.id
+            and self.run_id == run.id
+            and len(self.blocks) == run.block_total
+            and sum(len(trial_heads) for _, trial_heads in self.blocks)
+            == run.trial_total
+        )
+
+    def etag(self, run):
+        # Completion dates only change when the run's cursor moves.
+        return "{}-{}".format(self.digest, run.next_trial_position)
+
+    def render(self, completion_dates):
+        """Yield the plan's JSON chunks.
+
+        completion_dates is the list of the completion dates of the run's
+        trials, in order, converted to timestamps. It may be shorter than the
+        number of trials: the remaining trials are not completed.
+        """
+        position = 0
+        yield "["
+        for block_num, (block_head, trial_heads) in enumerate(self.blocks):
+            if block_num > 0:
+                yield ","
+            yield block_head
+            yield '"trials":['
+            for trial_num, trial_head in enumerate(trial_heads):
+                completion_date = (
+                    completion_dates[position]
+                    if position < len(completion_dates)
+                    else None
+                )
+                yield (
+                    ("," if trial_num > 0 else "")
+                    + trial_head
+                    + '"completionDate":'
+                    + json.dumps(completion_date)
+                    + "}"
+                )
+                position += 1
+            yield "]}"
+        yield "]"
+
+    def to_dict(self):
+        return {
+            "experimentId": self.experiment_id,
+            "runId": self.run_id,
+            "blocks": self.blocks,
+            "fingerprint": self.fingerprint,
+        }
+
+
+def get_run_plan(run):
+    """Return the plan of run, from the memory or disk cache if possible."""
+    plan = _run_plans.get(run._db_id)
+    if plan is None or not plan.matches(run):
+        path = _plan_file_path(run)
+        fingerprint = get_run_fingerprint(run) if path else None
+        plan = _read_plan_file(path, run, fingerprint) if path else None
+        if plan is None:
+            plan = compile_run_plan(run)
+            plan.fingerprint = fingerprint
+            if path:
+                _write_plan_file(path, plan)
+        _run_plans[run._db_id] = plan
+    return plan
+
+
+def get_run_fingerprint(run):
+    """Return a digest of the configuration of the trials of run.
+
+    Plans cached on disk are only used if their fingerprint matches, since the
+    database may have been replaced or the experiment imported again since they
+    have been written.
+    """
+    digest = hashlib.sha1()
+    for static_info, in db.session.execute(
+        select([Trial.static_info])
+        .select_from(Trial.__table__.join(Block.__table__))
+        .where(Block._run_db_id == run._db_id)
+        .order_by(Block.number, Trial.number)
+    ):
+        digest.update((static_info or "").encode("utf8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def compile_run_plan(run):
+    """Compile the plan of run with a constant number of queries."""
+    default_values = dict(
+        db.session.execute(
+            select([Factor.id, FactorValue.id])
+            .select_from(
+                Factor.__table__.join(
+                    FactorValue.__table__,
+                    FactorValue._db_id == Factor._default_value_db_id,
+                )
+            )
+            .where(Factor._experiment_db_id == run._experiment_db_id)
+        ).fetchall()
+    )
+
+    block_factor_values = defaultdict(dict)
+    for block_db_id, factor_id, value_id in db.session.execute(
+        select([block_values.c.block_db_id, Factor.id, FactorValue.id])
+        .select_from(
+            block_values.join(
+                FactorValue.__table__,
+                FactorValue._db_id == block_values.c.factor_value_db_id,
+            )
+            .join(Factor.__table__, Factor._db_id == FactorValue._factor_db_id)
+            .join(Block.__table__, Block._db_id == block_values.c.block_db_id)
+        )
+        .where(Block._run_db_id == run._db_id)
+    ):
+        block_factor_values[block_db_id][factor_id] = value_id
+
+    trial_values = defaultdict(dict)
+    for trial_db_id, factor_id, value_id in db.session.execute(
+        select([trial_factor_values.c.trial_db_id, Factor.id, FactorValue.id])
+        .select_from(
+            trial_factor_values.join(
+                FactorValue.__table__,
+                FactorValue._db_id == trial_factor_values.c.factor_value_db_id,
+            )
+            .join(Factor.__table__, Factor._db_id == FactorValue._factor_db_id)
+            .join(Trial.__table__, Trial._db_id == trial_factor_values.c.trial_db_id)
+            .join(Block.__table__, Block._db_id == Trial._block_db_id)
+        )
+        .where(Block._run_db_id == run._db_id)
+    ):
+        trial_values[trial_db_id][factor_id] = value_id
+
+    trials = defaultdict(list)
+    for block_db_id, trial_db_id, number in db.session.execute(
+        select([Trial._block_db_id, Trial._db_id, Trial.number])
+        .select_from(Trial.__table__.join(Block.__table__))
+        .where(Block._run_db_id == run._db_id)
+        .order_by(Trial.number)
+    ):
+        trials[block_db_id].append((trial_db_id, number))
+
+    blocks = []
+    for block_db_id, number, practice, measured_number in db.session.execute(
+        select([Block._db_id, Block.number, Block.practice, Block.measured_number])
+        .where(Block._run_db_id == run._db_id)
+        .order_by(Block.number)
+    ):
+        block_info = {
+            "number": number,
+            "factorValues": block_factor_values[block_db_id],
+            "practice": practice,
+        }
+        if not practice:
+            block_info["measuredBlockNumber"] = measured_number
+        trial_heads = []
+        for trial_db_id, trial_number in trials[block_db_id]:
+            factor_values = dict(default_values)
+            factor_values.update(block_factor_values[block_db_id])
+            factor_values.update(trial_values[trial_db_id])
+            trial_heads.append(
+                _json_head({"number": trial_number, "factorValues": factor_values})
+            )
+        blocks.append((_json_head(block_info), trial_heads))
+    return RunPlan(run.experiment.id, run.id, blocks)
+
+
+def _json_head(obj):
+    # Serialize obj leaving it open for another member.
+    return json.dumps(obj)[:-1] + ", "
+
+
+def _plan_file_path(run):
+    cache_dir = app.config.get("CACHE_DIR")
+    if cache_dir:
+        return os.path.join(cache_dir, "plans", "run-{}.json".format(run._db_id))
+
+
+def _read_plan_file(path, run, fingerprint):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as plan_file:
+            data = json.load(plan_file)
+    except ValueError:
+        return None
+    # Database ids may be reused, e.g. if the database has been replaced.
+    if data.get("fingerprint") != fingerprint:
+        return None
+    plan = RunPlan(
+        data["experimentId"],
+        data["runId"],
+        [(block_head, trial_heads) for block_head, trial_heads in data["blocks"]],
+        fingerprint,
+    )
+    return plan if plan.matches(run) else None
+
+
+def _write_plan_file(path, plan):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first so that other processes never read a
+    # partial plan.
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(file_descriptor, "w") as plan_file:
+        json.dump(plan.to_dict(), plan_file)
+    os.replace(temp_path, path)
@@ -0,0 +1,58 @@
+__author__ = "Quentin Roy"
+
+import os
+import sys
+import time
+import signal
+import socket
+import gevent
+from gevent.pywsgi import WSGIServer
+from .model import db
+
+# Minimum delay between two restarts of a worker.
+RESTART_DELAY = 1
+
+
+def serve_forever(app, address, worker_count):
+    """Serve app from worker_count pre-forked processes sharing the same socket.
+
+    The current process supervises the workers and restarts them if they die.
+    """
+    listener = WSGIServer.get_listener(address, family=socket.AF_INET)
+    workers = {}
+
+    def spawn_worker():
+        pid = gevent.fork()
+        if pid == 0:
+            # Interruptions are handled by the supervisor.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # Do not share database connections with the other processes.
+            db.get_engine(app).dispose()
+            try:
+                WSGIServer(listener, app).serve_forever()
+            finally:
+                os._exit(1)
+        workers[pid] = time.time()
+
+    def terminate(signum, frame):
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    for _ in range(worker_count):
+        spawn_worker()
+    print("* Started {} workers.".format(worker_count))
+    try:
+        while True:
+            pid, status = os.wait()
+            start_time = workers.pop(pid, None)
+            if start_time is None:
+                continue
+            print("Worker {} died (status: {}). Restarting...".format(pid, status))
+            time.sleep(max(0, start_time + RESTART_DELAY - time.time()))
+            spawn_worker()
+    finally:
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+        for pid in workers:
+            os.waitpid(pid, 0)
@@ -0,0 +1,184 @@
+__author__ = "Quentin Roy"
+
+import json
+import gevent
+from collections import defaultdict
+from flask import current_app as app
+from gevent.queue import Queue, Full, Empty
+from sqlalchemy import event, select
+from .model import db, Run
+
+# Maximum number of events waiting to be sent to a subscriber. Subscribers that
+# fall behind are disconnected.
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Delay between two keep-alive comments sent to idle subscribers (in seconds).
+KEEP_ALIVE_INTERVAL = 15
+# Delay between two polls of the database for the changes made by other
+# processes (in seconds).
+POLL_INTERVAL = 1
+
+# Subscriber queues, by experiment database id.
+_subscribers = defaultdict(set)
+
+# Greenlets polling the progress of the runs of an experiment, by experiment
+# database id.
+_pollers = {}
+
+# Sent to a subscriber's queue to end its stream.
+_CLOSE = object()
+
+
+def notify(run, event_type, completed_trial_count=None, locked=None):
+    """Send an event about the progress of run once the current transaction is
+    committed.
+
+    completed_trial_count and locked are read from run if not provided.
+
+    With several server processes, streams are not fed by notify but by polling
+    the database (see stream).
+    """
+    if app.config.get("MULTIPROCESS"):
+        return
+    data = _get_progress_data(
+        run.id,
+        run.next_trial_position
+        if completed_trial_count is None
+        else completed_trial_count,
+        run.trial_total,
+        run.locked if locked is None else locked,
+    )
+    db.session.info.setdefault("progress_events", []).append(
+        (run._experiment_db_id, event_type, data)
+    )
+
+
+def _get_progress_data(run_id, completed_trial_count, trial_count, locked):
+    return {
+        "runId": run_id,
+        "completedTrialCount": completed_trial_count,
+        "trialCount": trial_count,
+        "locked": locked,
+        "status": "completed"
+        if completed_trial_count >= trial_count
+        else "started"
+        if completed_trial_count > 0
+        else "unstarted",
+    }
+
+
+@event.listens_for(db.session, "after_commit")
+def _publish_events(session):
+    for experiment_db_id, event_type, data in session.info.pop("progress_events", ()):
+        publish(experiment_db_id, event_type, data)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _discard_events(session, previous_transaction):
+    session.info.pop("progress_events", None)
+
+
+def publish(experiment_db_id, event_type, data):
+    """Send an event to the progress streams of an experiment served by this
+    process."""
+    message = "event: {}\ndata: {}\n\n".format(event_type, json.dumps(data))
+    for subscriber in list(_subscribers.get(experiment_db_id, ())):
+        try:
+            subscriber.put_nowait(message)
+        except Full:
+            _unsubscribe(experiment_db_id, subscriber)
+            subscriber.queue.clear()
+            subscriber.put_nowait(_CLOSE)
+
+
+def stream(experiment):
+    """Return a generator of server-sent events for the progress of experiment.
+
+    With several server processes, the runs may progress in any of them: the
+    database is polled for changes every POLL_INTERVAL seconds instead.
+    """
+    experiment_db_id = experiment._db_id
+    subscriber = Queue(SUBSCRIBER_QUEUE_SIZE)
+    _subscribers[experiment_db_id].add(subscriber)
+    if app.config.get("MULTIPROCESS") and experiment_db_id not in _pollers:
+        _pollers[experiment_db_id] = gevent.spawn(
+            _poll_progress, app._get_current_object(), experiment_db_id
+        )
+
+    def generate():
+        try:
+            # Ask the clients to reconnect quickly if the stream ends.
+            yield "retry: 1000\n\n"
+            while True:
+                try:
+                    message = subscriber.get(timeout=KEEP_ALIVE_INTERVAL)
+                except Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is _CLOSE:
+                    return
+                yield message
+        finally:
+            _unsubscribe(experiment_db_id, subscriber)
+
+    return generate()
+
+
+def _unsubscribe(experiment_db_id, subscriber):
+    subscribers = _subscribers.get(experiment_db_id)
+    if subscribers is not None:
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del _subscribers[experiment_db_id]
+
+
+def _poll_progress(app, experiment_db_id):
+    """Publish the changes of the runs of an experiment, whatever the process that
+    made them, as long as the experiment has subscribers."""
+    runs = None
+    try:
+        while experiment_db_id in _subscribers:
+            with app.app_context():
+                try:
+                    new_runs = dict(
+                        (row["_db_id"], row)
+                        for row in db.session.execute(
+                            select(
+                                [
+                                    Run._db_id,
+                                    Run.id,
+                                    Run.version,
+                                    Run.next_trial_position,
+                                    Run.trial_total,
+                                    Run.token,
+                                ]
+                            ).where(Run._experiment_db_id == experiment_db_id)
+                        )
+                    )
+                finally:
+                    db.session.remove()
+            if runs is not None:
+                for run_db_id, new_run in new_runs.items():
+                    run = runs.get(run_db_id)
+                    if run is None or run["version"] != new_run["version"]:
+                        _publish_run_changes(experiment_db_id, run, new_run)
+            runs = new_runs
+            gevent.sleep(POLL_INTERVAL)
+    finally:
+        _pollers.pop(experiment_db_id, None)
+
+
+def _publish_run_changes(experiment_db_id, run, new_run):
+    locked = new_run["token"] is not None
+    data = _get_progress_data(
+        new_run["id"],
+        new_run["next_trial_position"],
+        new_run["trial_total"],
+        locked,
+    )
+    if run is None or (run["token"] is not None) != locked:
+        publish(experiment_db_id, "runLocked" if locked else "runUnlocked", data)
+    if run is None or (
+        run["next_trial_position"] != new_run["next_trial_position"]
+        or run["trial_total"] != new_run["trial_total"]
+    ):
+        publish(experiment_db_id, "trialCompleted", data)
@@ -0,0 +1,127 @@
+__author__ = "Quentin Roy"
+
+import os
+import gevent
+from gevent.lock import RLock
+from sqlalchemy import event
+
+# Delay between two attempts to lock the write lock file.
+WRITE_LOCK_RETRY_INTERVAL = 0.005
+
+# SQLite settings applied to every database connection, by profile name.
+STORAGE_PROFILES = {
+    # SQLite's defaults: full synchronization. The journal mode of the database
+    # is left as is (i.e. a rollback journal unless the database has been
+    # switched to WAL), so that opening a WAL database does not revert it.
+    "safe": {
+        "busy_timeout": 5000,
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+    },
+    # Write-ahead log: readers do not block writers and writers do not block
+    # readers. Commits are still synchronized to disk.
+    "wal": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -16000,
+        "mmap_size": 256 * 1024 * 1024,
+        "wal_autocheckpoint": 1000,
+    },
+    # Write-ahead log without synchronizing every commit. The database cannot be
+    # corrupted, but the last commits may be lost on power failure.
+    "fast": {
+        "busy_timeout": 5000,
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 1024 * 1024 * 1024,
+        "wal_autocheckpoint": 10000,
+    },
+}
+
+
+def apply_storage_profile(engine, profile_name):
+    """Apply a storage profile to each new connection of an SQLite engine."""
+    pragmas = STORAGE_PROFILES[profile_name]
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            # Changing the journal mode requires an exclusive lock on the
+            # database: do not do it on each connection if it is already set.
+            if name == "journal_mode":
+                cursor.execute("PRAGMA journal_mode")
+                if cursor.fetchone()[0].lower() == value.lower():
+                    continue
+            cursor.execute("PRAGMA {}={}".format(name, value))
+        cursor.close()
+
+
+def apply_write_lock(engine, lock_path):
+    """Serialize the write transactions of several processes using a lock file.
+
+    The lock is acquired before the first statement of a transaction that is not
+    a read, and released when the transaction ends. Waiting for the lock does not
+    block the other greenlets of the process.
+    """
+    import fcntl
+
+    state = {"pid": None, "file": None, "lock": None, "holders": 0}
+
+    def acquire():
+        # The lock file must be opened by each (forked) process.
+        if state["pid"] != os.getpid():
+            state["pid"] = os.getpid()
+            state["file"] = open(lock_path, "a")
+            state["lock"] = RLock()
+            state["holders"] = 0
+        # Greenlets of the same process wait for each other, and a greenlet may
+        # write from several connections at once.
+        state["lock"].acquire()
+        try:
+            if state["holders"] == 0:
+                _lock_file(state["file"])
+        except BaseException:
+            state["lock"].release()
+            raise
+        state["holders"] += 1
+
+    def release(conn):
+        if conn.info.pop("write_locked", False) and state["pid"] == os.getpid():
+            state["holders"] -= 1
+            if state["holders"] == 0:
+                fcntl.flock(state["file"], fcntl.LOCK_UN)
+            state["lock"].release()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def lock_writes(conn, cursor, statement, parameters, context, executemany):
+        if conn.info.get("write_locked", False):
+            return
+        verb = statement.lstrip()[:6].upper()
+        if verb not in ("SELECT", "PRAGMA"):
+            acquire()
+            conn.info["write_locked"] = True
+
+    @event.listens_for(engine, "commit")
+    def unlock_on_commit(conn):
+        release(conn)
+
+    @event.listens_for(engine, "rollback")
+    def unlock_on_rollback(conn):
+        release(conn)
+
+
+def _lock_file(lock_file):
+    """Lock lock_file. The hub is not monkey patched: sleep between non-blocking
+    attempts instead of blocking the process."""
+    import fcntl
+
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            gevent.sleep(WRITE_LOCK_RETRY_INTERVAL)
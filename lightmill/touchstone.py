@@ -111,9 +111,11 @@ def _parse_value(dom):
 def _parse_run(dom, experiment):
     run = Run(id=dom.get("id"), experiment=experiment)
 
+    position = 0
     for block_dom in dom.iter():
         if block_dom.tag in ("block", "practice"):
-            _parse_block(block_dom, run)
+            _parse_block(block_dom, run, position)
+            position += len(block_dom.findall("trial"))
     return run
 
 
@@ -142,7 +144,7 @@ def _parse_factor_values_string(values_string, experiment):
     return values
 
 
-def _parse_block(dom, run):
+def _parse_block(dom, run, first_position):
     practice = dom.tag == "practice"
     values_string = dom.get("values")
     values = (
@@ -152,19 +154,19 @@ def _parse_block(dom, run):
     )
     block = Block(run=run, practice=practice, values=values)
 
-    for trial_dom in dom.findall("trial"):
-        _parse_trial(trial_dom, block)
+    for trial_num, trial_dom in enumerate(dom.findall("trial")):
+        _parse_trial(trial_dom, block, first_position + trial_num)
     return block
 
 
-def _parse_trial(dom, block):
+def _parse_trial(dom, block, position):
     values_string = dom.get("values")
     values = (
         _parse_factor_values_string(values_string, block.experiment)
         if values_string
         else []
     )
-    trial = Trial(block, values=values)
+    trial = Trial(block, values=values, position=position)
     return trial
 
 
@@ -0,0 +1,16 @@
+__author__ = "Quentin Roy"
+
+import os
+from lightmill.blueprints._utils import clear_model_id_cache
+from lightmill.model import db
+from lightmill import plans
+
+EXPERIMENT_FILE = os.path.join(os.path.dirname(__file__), "data", "experiment.xml")
+
+
+def close_app(app):
+    """Release the database of app and clear the caches it filled up."""
+    db.session.remove()
+    db.get_engine(app).dispose()
+    clear_model_id_cache()
+    plans._run_plans.clear()
@@ -0,0 +1,65 @@
+__author__ = "Quentin Roy"
+
+import json
+import pytest
+from lightmill.app import create_app, import_experiment
+from lightmill.model import Experiment
+from ._utils import EXPERIMENT_FILE, close_app
+
+MEASURES = {"trial": {"time": 1}, "events": [{"x": 0}]}
+
+
+@pytest.fixture(params=["file", "memory"])
+def app(request, tmpdir):
+    """An application with the test experiment imported, backed by an SQLite
+    database file or an in-memory SQLite database."""
+    if request.param == "file":
+        app = create_app(str(tmpdir.join("lightmill.db")))
+    else:
+        app = create_app(None, volatile=True)
+    import_experiment(app, EXPERIMENT_FILE)
+    yield app
+    close_app(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def experiment(app):
+    return Experiment.query.get_by_id("XP")
+
+
+@pytest.fixture
+def post_results(client):
+    """Post a batch of results to a run, locking the run the first time.
+
+    Trials are (block number, trial number) tuples, or (block number, trial number,
+    measures) tuples. Return the response.
+    """
+    tokens = {}
+
+    def post(trials, run_id="S0"):
+        if run_id not in tokens:
+            lock_url = "/api/run/XP/{}/lock".format(run_id)
+            tokens[run_id] = client.get(lock_url).get_json()["token"]
+        return client.post(
+            "/api/run/XP/{}/results".format(run_id),
+            data=json.dumps(
+                {
+                    "token": tokens[run_id],
+                    "trials": [
+                        {
+                            "blockNumber": trial[0],
+                            "number": trial[1],
+                            "measures": trial[2] if len(trial) > 2 else MEASURES,
+                        }
+                        for trial in trials
+                    ],
+                }
+            ),
+        )
+
+    return post
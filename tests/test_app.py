@@ -0,0 +1,39 @@
+__author__ = "Quentin Roy"
+
+import pytest
+from lightmill.app import create_app, get_engine_options
+from lightmill.model import db
+
+
+@pytest.fixture(params=["file", "memory"])
+def database_options(request, tmpdir):
+    if request.param == "file":
+        return dict(database_uri=str(tmpdir.join("lightmill.db")))
+    return dict(database_uri=None, volatile=True)
+
+
+def test_pool_sizing_options_are_ignored_for_sqlite(database_options):
+    app = create_app(pool_size=5, pool_max_overflow=10, **database_options)
+    try:
+        assert db.session.execute("SELECT 1").scalar() == 1
+        assert "pool_size" not in app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        assert "max_overflow" not in app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    finally:
+        db.session.remove()
+        db.get_engine(app).dispose()
+
+
+def test_pool_options_are_kept_for_other_databases():
+    assert get_engine_options(
+        "postgresql://localhost/lightmill",
+        pool_size=5,
+        max_overflow=10,
+        pool_recycle=None,
+        pool_pre_ping=False,
+    ) == dict(pool_size=5, max_overflow=10)
+
+
+def test_pool_recycle_is_kept_for_sqlite():
+    assert get_engine_options(
+        "sqlite://", pool_size=5, pool_recycle=3600, pool_pre_ping=True
+    ) == dict(pool_recycle=3600, pool_pre_ping=True)
@@ -0,0 +1,63 @@
+__author__ = "Quentin Roy"
+
+import gzip
+import pytest
+from werkzeug.test import Client
+from lightmill.app import create_app, import_experiment
+from ._utils import EXPERIMENT_FILE, close_app
+
+URLS = [
+    "/api/experiment/XP",
+    "/api/run/XP/S0",
+    "/api/block/XP/S0/0",
+    "/api/trial/XP/S0/0/0",
+    "/api/run/XP/S0/plan",
+]
+
+
+@pytest.fixture
+def compressing_client(tmpdir):
+    """A client of an application compressing all its responses."""
+    app = create_app(str(tmpdir.join("lightmill.db")), compression_min_size=1)
+    import_experiment(app, EXPERIMENT_FILE)
+    yield app.test_client()
+    close_app(app)
+
+
+def _get_not_modified_headers(client, url, headers):
+    """Return the headers of a 304 Not Modified answer as sent by the application
+    (test clients add a Content-Type when they wrap responses)."""
+    app_iter, status, response_headers = Client(client.application).get(
+        url, headers=headers
+    )
+    assert status.startswith("304")
+    assert b"".join(app_iter) == b""
+    return response_headers
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_not_modified(client, url):
+    etag = client.get(url).headers["ETag"]
+    headers = _get_not_modified_headers(client, url, {"If-None-Match": etag})
+    assert headers["ETag"] == etag
+    assert "Content-Type" not in headers
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_compressed_responses_have_their_own_etag(compressing_client, url):
+    client = compressing_client
+    response = client.get(url)
+    etag = response.headers["ETag"]
+    compressed = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.data) == response.data
+    gzip_etag = compressed.headers["ETag"]
+    assert gzip_etag == etag[:-1] + '-gzip"'
+
+    headers = _get_not_modified_headers(
+        client, url, {"Accept-Encoding": "gzip", "If-None-Match": gzip_etag}
+    )
+    assert headers["ETag"] == gzip_etag
+    assert "Content-Type" not in headers
+    # An uncompressed copy is still valid.
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,47 @@
+__author__ = "Quentin Roy"
+
+import csv
+import io
+
+
+def _read_csv(response):
+    assert response.status_code == 200, response.data
+    return list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+
+
+def test_event_csv(client, post_results):
+    # Results are posted out of order to check the ordering of the rows.
+    response = post_results(
+        [(0, 0, {"trial": {"time": 3}, "events": [{"x": 10}]})], "S1"
+    )
+    assert response.status_code == 200
+    response = post_results(
+        [
+            (0, 0, {"trial": {"time": 1}, "events": [{"x": 0, "time": 5}, {"x": 1}]}),
+            (0, 1, {"trial": {"time": 2}, "events": [{"x": 2}]}),
+        ]
+    )
+    assert response.status_code == 200
+    rows = _read_csv(client.get("/experiment/XP-events.csv"))
+    assert [
+        (row["runId"], row["blockNumber"], row["trialNumber"], row["eventNumber"])
+        for row in rows
+    ] == [
+        ("S0", "0", "0", "0"),
+        ("S0", "0", "0", "1"),
+        ("S0", "0", "1", "0"),
+        ("S1", "0", "0", "0"),
+    ]
+    assert [row["x"] for row in rows] == ["0", "1", "2", "10"]
+    assert [row["time"] for row in rows] == ["5", "", "", ""]
+    # Block and trial factor values are repeated on each event.
+    assert all(row["tech"] for row in rows)
+    assert [row["size"] for row in rows[:3]] == ["s1", "s1", "s2"]
+
+
+def test_event_csv_filters(client, post_results):
+    assert post_results([(0, 0, {"events": [{"x": 10}]})], "S1").status_code == 200
+    assert post_results([(0, 0, {"events": [{"x": 0}]})]).status_code == 200
+    rows = _read_csv(client.get("/experiment/XP-events.csv?run=S1"))
+    assert [(row["runId"], row["x"]) for row in rows] == [("S1", "10")]
+    assert client.get("/experiment/XP-events.csv?practice=maybe").status_code == 400
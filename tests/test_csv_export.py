@@ -0,0 +1,49 @@
+__author__ = "Quentin Roy"
+
+import csv
+import os
+from lightmill.csv_export import xp_csv_export
+from lightmill.model import Experiment
+
+
+def _export(target_dir, **options):
+    # Requests remove the session: the experiment must be loaded afterwards.
+    xp_csv_export(Experiment.query.get_by_id("XP"), target_dir, **options)
+
+
+def _read_trials(target_dir):
+    with open(os.path.join(target_dir, "XP.csv")) as trial_file:
+        return [
+            (row["Block Number"], row["Trial Number"])
+            for row in csv.DictReader(trial_file)
+        ]
+
+
+def test_export_includes_uncompleted_trials(post_results, tmpdir):
+    assert post_results([(0, 0), (0, 1)]).status_code == 200
+    target_dir = str(tmpdir)
+    _export(target_dir)
+    # Every trial of the started run, completed or not.
+    assert _read_trials(target_dir) == [
+        (str(block), str(trial)) for block in range(3) for trial in range(4)
+    ]
+
+
+def test_completed_only_export_appends_new_trials(post_results, tmpdir):
+    assert post_results([(0, 0), (0, 1)]).status_code == 200
+    target_dir = str(tmpdir)
+    _export(target_dir, completed_only=True)
+    assert _read_trials(target_dir) == [("0", "0"), ("0", "1")]
+    assert os.path.exists(os.path.join(target_dir, "manifest.json"))
+    assert post_results([(0, 2), (0, 3), (1, 0)]).status_code == 200
+    _export(target_dir, completed_only=True)
+    assert _read_trials(target_dir) == [
+        ("0", "0"),
+        ("0", "1"),
+        ("0", "2"),
+        ("0", "3"),
+        ("1", "0"),
+    ]
+    # Exports that are not completed only do not append to completed only ones.
+    _export(target_dir)
+    assert len(_read_trials(target_dir)) == 12
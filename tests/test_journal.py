@@ -0,0 +1,102 @@
+__author__ = "Quentin Roy"
+
+import json
+import gevent
+import pytest
+from lightmill.app import create_app, import_experiment
+from lightmill.model import db, Trial
+from ._utils import EXPERIMENT_FILE, close_app
+
+MEASURES = {"trial": {"time": 1.5}, "events": [{"x": i} for i in range(3)]}
+
+
+@pytest.fixture
+def journal_app(tmpdir):
+    app = create_app(
+        str(tmpdir.join("lightmill.db")), journal_path=str(tmpdir.join("journal"))
+    )
+    import_experiment(app, EXPERIMENT_FILE)
+    yield app
+    app.extensions["trial_journal"]._greenlet.kill()
+    close_app(app)
+
+
+def _post(client, token, block, trial):
+    return client.post(
+        "/api/trial/XP/S0/{}/{}".format(block, trial),
+        data=json.dumps({"token": token, "measures": MEASURES}),
+    )
+
+
+def test_results_are_applied_in_the_background(journal_app, tmpdir):
+    client = journal_app.test_client()
+    journal = journal_app.extensions["trial_journal"]
+    token = client.get("/api/run/XP/S0/lock").get_json()["token"]
+    for trial_num in range(3):
+        assert _post(client, token, 0, trial_num).status_code == 202
+    assert _post(client, token, 0, 1).status_code == 405
+    assert tmpdir.join("journal").size() > 0
+
+    # Other greenlets keep running while the journal is being applied.
+    ticks = []
+
+    def tick():
+        for _ in range(5):
+            gevent.sleep(0.001)
+            ticks.append(journal.status()["lag"])
+
+    ticker = gevent.spawn(tick)
+    journal.wait_drained()
+    ticker.join()
+    assert len(ticks) == 5
+
+    status = journal.status()
+    assert status["applied"] == 3 and status["lag"] == 0
+    db.session.expire_all()
+    assert Trial.query.get_by_number(2, 0, "S0", "XP").completed
+    assert Trial.query.get_by_number(2, 0, "S0", "XP").measure_values[0].value == "1.5"
+
+
+def test_journal_is_replayed(tmpdir):
+    journal_path = tmpdir.join("journal")
+    with journal_path.open("w") as journal_file:
+        for trial_num in range(2):
+            entry = {
+                "experiment": "XP",
+                "run": "S0",
+                "block": 0,
+                "trial": trial_num,
+                "date": "2020-01-01T00:00:00.000000",
+                "measures": MEASURES,
+            }
+            journal_file.write(json.dumps(entry) + "\n")
+        # Interrupted entry.
+        journal_file.write('{"experiment": "X')
+    app = create_app(str(tmpdir.join("lightmill.db")))
+    import_experiment(app, EXPERIMENT_FILE)
+    close_app(app)
+    app = create_app(str(tmpdir.join("lightmill.db")), journal_path=str(journal_path))
+    try:
+        assert journal_path.size() == 0
+        assert Trial.query.get_by_number(1, 0, "S0", "XP").completed
+        assert not Trial.query.get_by_number(2, 0, "S0", "XP").completed
+    finally:
+        app.extensions["trial_journal"]._greenlet.kill()
+        close_app(app)
+
+
+def test_progress_reads_wait_for_the_journal(journal_app):
+    client = journal_app.test_client()
+    journal = journal_app.extensions["trial_journal"]
+    token = client.get("/api/run/XP/S0/lock").get_json()["token"]
+    etag = client.get("/api/run/XP/S0/upcoming").headers["ETag"]
+    assert _post(client, token, 0, 0).status_code == 202
+    assert journal.status()["lag"] == 1
+
+    # The trial that has just been posted is not returned again.
+    assert client.get("/api/run/XP/S0/current_trial").get_json()["number"] == 1
+    assert client.get("/api/run/XP/S0/next_trial").get_json()["number"] == 2
+    response = client.get("/api/run/XP/S0/upcoming", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [trial["number"] for trial in response.get_json()] == [1]
+    assert client.get("/api/run/XP/S0").get_json()["started"]
@@ -0,0 +1,49 @@
+__author__ = "Quentin Roy"
+
+import json
+from lightmill.app import create_app, import_experiment
+from lightmill.model import db, Trial
+from ._utils import EXPERIMENT_FILE, close_app
+
+
+def _post_time(app, time):
+    client = app.test_client()
+    token = client.get("/api/run/XP/S0/lock").get_json()["token"]
+    response = client.post(
+        "/api/trial/XP/S0/0/0",
+        data=json.dumps({"token": token, "measures": {"trial": {"time": time}}}),
+    )
+    assert response.status_code == 200, response.data
+    trial = Trial.query.get_by_number(0, 0, "S0", "XP")
+    return [(value.measure.id, value.value) for value in trial.measure_values]
+
+
+def test_measure_plans_are_not_reused_by_other_databases(tmpdir):
+    # Same experiment, but its measures are created in the reverse order so
+    # they get different database ids.
+    with open(EXPERIMENT_FILE) as experiment_file:
+        lines = experiment_file.read().split("\n")
+    measure_lines = [line for line in lines if line.startswith("<measure ")]
+    first = lines.index(measure_lines[0])
+    lines[first : first + len(measure_lines)] = measure_lines[::-1]
+    other_experiment_file = tmpdir.join("experiment.xml")
+    other_experiment_file.write("\n".join(lines))
+    other_database = str(tmpdir.join("other.db"))
+    app = create_app(other_database)
+    import_experiment(app, str(other_experiment_file))
+    db.session.remove()
+    db.get_engine(app).dispose()
+
+    app = create_app(str(tmpdir.join("lightmill.db")))
+    import_experiment(app, EXPERIMENT_FILE)
+    assert _post_time(app, 1.5) == [("time", "1.5")]
+    db.session.remove()
+    db.get_engine(app).dispose()
+
+    # The database is already imported: nothing else than create_app clears
+    # the caches.
+    other_app = create_app(other_database)
+    try:
+        assert _post_time(other_app, 2.5) == [("time", "2.5")]
+    finally:
+        close_app(other_app)
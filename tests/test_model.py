@@ -0,0 +1,73 @@
+__author__ = "Quentin Roy"
+
+import pytest
+from lightmill.model import db, Run, Block, Trial, ExperimentProgressError
+
+
+def test_experiment_import(experiment):
+    assert experiment.name == "Test XP"
+    assert [run.id for run in experiment.runs.order_by(Run.id)] == ["S0", "S1", "S2"]
+    run = experiment.get_run("S0")
+    assert run.trial_count() == 12
+    assert run.block_count() == 3
+    assert [block.measured_block_number() for block in run.blocks] == [None, 0, 1]
+    assert [trial.position for trial in run.trials] == list(range(12))
+
+
+def test_run_lock(experiment):
+    run = experiment.get_run("S0")
+    assert run.lock("token")
+    assert not run.lock("other token")
+    assert run.token == "token"
+    assert not run.unlock("other token")
+    assert run.unlock("token")
+    assert not run.locked
+    assert run.lock("other token")
+
+
+def test_run_allocation(experiment):
+    first = experiment.allocate_run("token 1")
+    second = experiment.allocate_run("token 2")
+    assert first.id == "S0"
+    assert second.id == "S1"
+    assert experiment.allocate_run("token 3").id == "S2"
+    assert experiment.allocate_run("token 4") is None
+
+
+def test_sequential_completion(experiment):
+    run = experiment.get_run("S0")
+    trials = run.trials.all()
+    with pytest.raises(ExperimentProgressError):
+        trials[1].set_completed()
+    trials[0].set_completed()
+    db.session.commit()
+    with pytest.raises(ExperimentProgressError):
+        trials[0].set_completed()
+    assert run.current_trial() == trials[1]
+    assert run.started() and not run.completed()
+    assert trials[1].previous() == trials[0]
+    assert trials[1].next() == trials[2]
+    for trial in trials[1:]:
+        trial.set_completed()
+    db.session.commit()
+    assert run.completed()
+    assert run.status() == "completed"
+    assert run.current_trial() is None
+
+
+def test_trials_are_appended_to_their_run_by_default(experiment):
+    run = Run("S3", experiment)
+    factor = experiment.get_factor("size")
+    for practice in (True, False):
+        block = Block(run, practice=practice, values=[])
+        for value in factor.values:
+            Trial(block, values=[value])
+    db.session.add(run)
+    db.session.commit()
+    trials = run.trials.all()
+    assert [trial.position for trial in trials] == [0, 1, 2, 3]
+    assert run.upcoming_trials(10) == trials
+    trials[0].set_completed()
+    assert trials[0].next() == trials[1]
+    assert trials[1].previous() == trials[0]
+    assert run.current_trial() == trials[1]
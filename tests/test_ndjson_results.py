@@ -0,0 +1,67 @@
+__author__ = "Quentin Roy"
+
+import json
+import pytest
+from lightmill.model import db, Trial
+
+
+@pytest.fixture
+def token(client):
+    return client.get("/api/run/XP/S0/lock").get_json()["token"]
+
+
+def _post(client, lines):
+    return client.post(
+        "/api/trial/XP/S0/0/0",
+        data="".join(line + "\n" for line in lines),
+        content_type="application/x-ndjson",
+    )
+
+
+def _get_trial():
+    db.session.expire_all()
+    return Trial.query.get_by_number(0, 0, "S0", "XP")
+
+
+def test_results(client, token):
+    response = _post(
+        client,
+        [json.dumps({"token": token, "trial": {"time": 1.5}})]
+        + [json.dumps({"x": i}) for i in range(3)],
+    )
+    assert response.status_code == 200, response.data
+    assert response.get_json()["measures"] == {"time": "1.5"}
+    trial = _get_trial()
+    assert trial.completed
+    assert [
+        event.measure_values["x"].value
+        for event in trial.events.order_by("number").all()
+    ] == ["0", "1", "2"]
+
+
+def test_wrong_token(client, token):
+    response = _post(client, [json.dumps({"token": "wrong"}), json.dumps({"x": 0})])
+    assert response.status_code == 405
+    assert response.get_json()["type"] == "WrongToken"
+    assert not _get_trial().completed
+
+
+def test_malformed_line_is_rolled_back(client, token):
+    response = _post(
+        client,
+        [json.dumps({"token": token, "trial": {"time": 1.5}}), json.dumps({"x": 0})]
+        + ['{"x": 1'],
+    )
+    assert response.status_code == 400
+    assert response.get_json()["type"] == "MalformedResults"
+    trial = _get_trial()
+    assert not trial.completed
+    assert trial.events.count() == 0
+    assert len(trial.measure_values) == 0
+
+
+def test_empty_body(client, token):
+    response = _post(client, [])
+    assert response.status_code == 400
+    assert response.get_json()["type"] == "MalformedResults"
+    assert not _get_trial().completed
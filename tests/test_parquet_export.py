@@ -0,0 +1,48 @@
+__author__ = "Quentin Roy"
+
+import pytest
+from lightmill.model import Experiment
+
+parquet = pytest.importorskip("pyarrow.parquet")
+from lightmill.parquet_export import write_parquet  # noqa: E402
+
+
+def _export(tmpdir):
+    trials_path = str(tmpdir.join("trials.parquet"))
+    events_path = str(tmpdir.join("events.parquet"))
+    write_parquet(Experiment.query.get_by_id("XP"), trials_path, events_path)
+    return parquet.read_table(trials_path), parquet.read_table(events_path)
+
+
+def test_columns_are_typed(post_results, tmpdir):
+    response = post_results(
+        [
+            (0, 0, {"trial": {"time": 1.5, "err": 2}, "events": [{"x": 1}]}),
+            (0, 1, {"trial": {"time": 2, "err": 0}, "events": [{"x": 2}]}),
+        ]
+    )
+    assert response.status_code == 200
+    trials, events = _export(tmpdir)
+    assert str(trials.schema.field("Time").type) == "double"
+    assert str(trials.schema.field("err").type) == "int64"
+    assert str(events.schema.field("x").type) == "int64"
+    assert trials.column("err").to_pylist()[:3] == [2, 0, None]
+    assert events.column("x").to_pylist() == [1, 2]
+
+
+def test_mistyped_measures_are_strings(post_results, tmpdir):
+    response = post_results(
+        [
+            (0, 0, {"trial": {"time": 1.5, "err": 2}, "events": [{"x": 1}]}),
+            (0, 1, {"trial": {"time": 2, "err": "none"}, "events": [{"x": "left"}]}),
+        ]
+    )
+    assert response.status_code == 200
+    trials, events = _export(tmpdir)
+    # Values that do not match the measure type are kept.
+    assert str(trials.schema.field("err").type) == "string"
+    assert trials.column("err").to_pylist()[:3] == ["2", "none", None]
+    assert str(events.schema.field("x").type) == "string"
+    assert events.column("x").to_pylist() == ["1", "left"]
+    # Other measures keep their type.
+    assert str(trials.schema.field("Time").type) == "double"
@@ -0,0 +1,50 @@
+__author__ = "Quentin Roy"
+
+import os
+from lightmill.app import create_app, import_experiment
+from lightmill.model import Experiment
+from lightmill import plans
+from ._utils import EXPERIMENT_FILE, close_app
+
+
+def _get_plan(database_path, cache_dir, experiment_file):
+    app = create_app(database_path, cache_dir=cache_dir)
+    try:
+        import_experiment(app, experiment_file)
+        run = Experiment.query.get_by_id("XP").get_run("S0")
+        return app.test_client().get("/api/run/XP/S0/plan").get_json(), run._db_id
+    finally:
+        close_app(app)
+
+
+def test_plans_are_cached_on_disk(tmpdir, monkeypatch):
+    cache_dir = str(tmpdir.join("cache"))
+    database_path = str(tmpdir.join("lightmill.db"))
+    plan, run_db_id = _get_plan(database_path, cache_dir, EXPERIMENT_FILE)
+    plan_path = os.path.join(cache_dir, "plans", "run-{}.json".format(run_db_id))
+    assert os.path.exists(plan_path)
+    # Once written, the plan is read from the disk instead of compiled.
+    monkeypatch.setattr(plans, "compile_run_plan", None)
+    assert _get_plan(database_path, cache_dir, EXPERIMENT_FILE)[0] == plan
+
+
+def test_plans_of_replaced_databases_are_not_reused(tmpdir):
+    cache_dir = str(tmpdir.join("cache"))
+    plan, run_db_id = _get_plan(
+        str(tmpdir.join("lightmill.db")), cache_dir, EXPERIMENT_FILE
+    )
+    # Same experiment, runs, blocks and trials counts, but different values.
+    with open(EXPERIMENT_FILE) as experiment_file:
+        content = experiment_file.read()
+    other_experiment_file = tmpdir.join("experiment.xml")
+    other_experiment_file.write(
+        content.replace("tech=A", "tech=C").replace(
+            '<value id="B"/>', '<value id="B"/><value id="C"/>'
+        )
+    )
+    other_plan, other_run_db_id = _get_plan(
+        str(tmpdir.join("other.db")), cache_dir, str(other_experiment_file)
+    )
+    assert other_run_db_id == run_db_id
+    assert other_plan != plan
+    assert other_plan[0]["factorValues"]["tech"] == "C"
@@ -0,0 +1,76 @@
+__author__ = "Quentin Roy"
+
+import json
+import gevent
+import pytest
+from lightmill import progress
+from lightmill.app import create_app, import_experiment
+from lightmill.model import Experiment
+from ._utils import EXPERIMENT_FILE, close_app
+
+
+@pytest.fixture(params=[False, True], ids=["single process", "multiprocess"])
+def progress_app(request, tmpdir, monkeypatch):
+    monkeypatch.setattr(progress, "POLL_INTERVAL", 0.01)
+    app = create_app(str(tmpdir.join("lightmill.db")), multiprocess=request.param)
+    import_experiment(app, EXPERIMENT_FILE)
+    yield app
+    close_app(app)
+
+
+def _read_events(app, events):
+    with app.test_request_context():
+        for message in progress.stream(Experiment.query.get_by_id("XP")):
+            if message.startswith("event: "):
+                event_line, data_line = message.splitlines()[:2]
+                events.append(
+                    (event_line[len("event: "):], json.loads(data_line[len("data: "):]))
+                )
+
+
+def _wait_for(events, count):
+    with gevent.Timeout(2):
+        while len(events) < count:
+            gevent.sleep(0.01)
+
+
+def test_progress_events(progress_app):
+    client = progress_app.test_client()
+    events = []
+    reader = gevent.spawn(_read_events, progress_app, events)
+    gevent.sleep(0.05)
+
+    token = client.get("/api/run/XP/S0/lock").get_json()["token"]
+    _wait_for(events, 1)
+    client.post(
+        "/api/trial/XP/S0/0/0",
+        data=json.dumps({"token": token, "measures": {"trial": {"time": 1}}}),
+    )
+    _wait_for(events, 2)
+    reader.kill()
+
+    assert events == [
+        (
+            "runLocked",
+            {
+                "runId": "S0",
+                "completedTrialCount": 0,
+                "trialCount": 12,
+                "locked": True,
+                "status": "unstarted",
+            },
+        ),
+        (
+            "trialCompleted",
+            {
+                "runId": "S0",
+                "completedTrialCount": 1,
+                "trialCount": 12,
+                "locked": True,
+                "status": "started",
+            },
+        ),
+    ]
+    # Streams stop polling once they have all ended.
+    gevent.sleep(0.05)
+    assert not progress._pollers
@@ -0,0 +1,66 @@
+__author__ = "Quentin Roy"
+
+import json
+import os
+import pytest
+from lightmill.app import create_app, import_experiment
+from lightmill.model import db, Experiment
+from ._utils import EXPERIMENT_FILE, close_app
+
+CLIENT_COUNT = 8
+
+
+@pytest.fixture(params=[False, True], ids=["single-process", "multiprocess"])
+def file_app(request, tmpdir):
+    app = create_app(str(tmpdir.join("lightmill.db")), multiprocess=request.param)
+    import_experiment(app, EXPERIMENT_FILE)
+    yield app
+    close_app(app)
+
+
+def _lock_in_child(app, start_reader, result_writer):
+    """Fork a process that locks S0 once start_reader can be read, and writes
+    the answer to result_writer."""
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    status = 1
+    try:
+        db.get_engine(app).dispose()
+        client = app.test_client()
+        os.read(start_reader, 1)
+        response = client.get("/api/run/XP/S0/lock")
+        result = dict(response.get_json(), status=response.status_code)
+        os.write(result_writer, (json.dumps(result) + "\n").encode())
+        status = 0
+    finally:
+        os._exit(status)
+
+
+def test_concurrent_locks(file_app):
+    start_reader, start_writer = os.pipe()
+    result_reader, result_writer = os.pipe()
+    pids = [
+        _lock_in_child(file_app, start_reader, result_writer)
+        for _ in range(CLIENT_COUNT)
+    ]
+    os.close(result_writer)
+    # Start every client at once.
+    os.write(start_writer, b"x" * CLIENT_COUNT)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+    with os.fdopen(result_reader) as results_file:
+        results = [json.loads(line) for line in results_file]
+    os.close(start_reader)
+    os.close(start_writer)
+
+    assert len(results) == CLIENT_COUNT
+    winners = [result for result in results if result["status"] == 200]
+    assert len(winners) == 1
+    losers = [result for result in results if result["status"] != 200]
+    assert [(result["status"], result["type"]) for result in losers] == [
+        (405, "RunAlreadyLocked")
+    ] * (CLIENT_COUNT - 1)
+    db.session.expire_all()
+    run = Experiment.query.get_by_id("XP").get_run("S0")
+    assert run.token == winners[0]["token"]
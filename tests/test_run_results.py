@@ -0,0 +1,54 @@
+__author__ = "Quentin Roy"
+
+import pytest
+
+
+def _statuses(response):
+    assert response.status_code == 200, response.data
+    return [trial["status"] for trial in response.get_json()["trials"]]
+
+
+def _current_trial(client):
+    trial = client.get("/api/run/XP/S0/current_trial").get_json()
+    return trial["blockNumber"], trial["number"]
+
+
+def test_batches(client, post_results):
+    assert _statuses(post_results([(0, 0), (0, 1), (0, 2)])) == ["completed"] * 3
+    # Re-sent batch, continued.
+    assert _statuses(post_results([(0, 1), (0, 2), (0, 3), (1, 0)])) == [
+        "alreadyCompleted",
+        "alreadyCompleted",
+        "completed",
+        "completed",
+    ]
+    # Re-sent batch only.
+    assert _statuses(post_results([(0, 0), (0, 1)])) == ["alreadyCompleted"] * 2
+    assert _current_trial(client) == (1, 1)
+
+
+@pytest.mark.parametrize(
+    "keys",
+    [
+        # Not the next trial.
+        [(0, 3)],
+        [(0, 0), (0, 1), (0, 3)],
+        # Completed trial after the trials to complete.
+        [(0, 2), (0, 3), (0, 0)],
+        # Completed trials that do not precede the trials to complete.
+        [(0, 0), (0, 2)],
+        # Completed trials that are not consecutive, or in order.
+        [(0, 1), (0, 0), (0, 2)],
+        [(0, 0), (0, 0), (0, 2)],
+        [(0, 0), (0, 1), (0, 0)],
+        # Unknown trials.
+        [(0, 9)],
+        [(9, 0), (0, 2)],
+    ],
+)
+def test_invalid_batches(client, post_results, keys):
+    assert _statuses(post_results([(0, 0), (0, 1)])) == ["completed"] * 2
+    response = post_results(keys)
+    assert response.status_code == 405
+    assert response.get_json()["type"] == "ExperimentProgressError"
+    assert _current_trial(client) == (0, 2)
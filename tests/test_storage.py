@@ -0,0 +1,117 @@
+__author__ = "Quentin Roy"
+
+import fcntl
+import json
+import os
+import gevent
+import pytest
+from lightmill.app import create_app, import_experiment
+from lightmill.model import db, Experiment
+from ._utils import EXPERIMENT_FILE, close_app
+
+
+def _open(path, profile):
+    app = create_app(path, storage_profile=profile)
+    journal_mode = db.session.execute("PRAGMA journal_mode").scalar()
+    db.session.remove()
+    db.get_engine(app).dispose()
+    return journal_mode.lower()
+
+
+@pytest.mark.parametrize("profile", ["wal", "fast"])
+def test_wal_profiles(tmpdir, profile):
+    assert _open(str(tmpdir.join("lightmill.db")), profile) == "wal"
+
+
+def test_safe_profile_keeps_journal_mode(tmpdir):
+    path = str(tmpdir.join("lightmill.db"))
+    assert _open(path, "safe") == "delete"
+    assert _open(path, "wal") == "wal"
+    assert _open(path, "safe") == "wal"
+
+
+@pytest.fixture
+def multiprocess_app(tmpdir):
+    app = create_app(str(tmpdir.join("lightmill.db")), multiprocess=True)
+    import_experiment(app, EXPERIMENT_FILE)
+    yield app
+    close_app(app)
+
+
+def test_write_lock_does_not_block_the_hub(multiprocess_app, tmpdir):
+    # Another open file description of the lock file, as in another process.
+    with tmpdir.join("lightmill.db.lock").open("a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        def lock_run():
+            # Sessions are scoped to greenlets.
+            Experiment.query.get_by_id("XP").get_run("S0").lock("token")
+            db.session.commit()
+            db.session.remove()
+
+        writer = gevent.spawn(lock_run)
+        gevent.sleep(0.05)
+        # The writer waits for the lock, but this greenlet keeps running.
+        assert not writer.dead
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        writer.join(1)
+    assert writer.successful()
+    assert Experiment.query.get_by_id("XP").get_run("S0").token == "token"
+
+
+def test_concurrent_writers(multiprocess_app):
+    """Record the trials of each run from a different process, two greenlets
+    per process (one recording, one locking and unlocking another run)."""
+    run_ids = ["S0", "S1", "S2"]
+    pids = []
+    for run_num, run_id in enumerate(run_ids):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                db.get_engine(multiprocess_app).dispose()
+                client = multiprocess_app.test_client()
+                recorder = gevent.spawn(_record_run, client, run_id)
+                locker = gevent.spawn(
+                    _lock_repeatedly, client, run_ids[(run_num + 1) % len(run_ids)]
+                )
+                gevent.joinall([recorder, locker], raise_error=True)
+                status = 0
+            finally:
+                os._exit(status)
+        pids.append(pid)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+    db.session.expire_all()
+    for run_id in run_ids:
+        run = Experiment.query.get_by_id("XP").get_run(run_id)
+        assert run.completed()
+        assert all(trial.events.count() == 3 for trial in run.trials)
+
+
+def _record_run(client, run_id):
+    token = None
+    while token is None:
+        response = client.get("/api/run/XP/{}/lock".format(run_id))
+        token = response.get_json().get("token")
+        gevent.sleep(0.001)
+    measures = {"trial": {"time": 1}, "events": [{"x": i} for i in range(3)]}
+    for block_num in range(3):
+        for trial_num in range(4):
+            response = client.post(
+                "/api/trial/XP/{}/{}/{}".format(run_id, block_num, trial_num),
+                data=json.dumps({"token": token, "measures": measures}),
+            )
+            assert response.status_code == 200, response.data
+
+
+def _lock_repeatedly(client, run_id):
+    for _ in range(10):
+        response = client.get("/api/run/XP/{}/lock".format(run_id))
+        if response.status_code == 200:
+            client.post(
+                "/api/run/XP/{}/unlock".format(run_id),
+                data=json.dumps({"token": response.get_json()["token"]}),
+                content_type="application/json",
+            )
+        gevent.sleep(0.001)